@@ -0,0 +1,73 @@
+# File: backup_export.py
+# Xuất dữ liệu sao lưu theo kiểu streaming: từng hàng được ghi thẳng vào file tạm (SpooledTemporaryFile,
+# tự chuyển xuống đĩa khi lớn), có thể nén gzip và tự chia thành nhiều phần để không vượt giới hạn 50 MB của Telegram.
+
+import csv
+import gzip
+import io
+import json
+import tempfile
+
+BACKUP_FORMATS = ("csv", "csv.gz", "jsonl", "jsonl.gz")
+
+
+class _PartWriter:
+    """Một phần của file sao lưu: file tạm (+ gzip) + lớp ghi văn bản UTF-8."""
+
+    def __init__(self, fmt: str, spool_max_bytes: int):
+        self.file = tempfile.SpooledTemporaryFile(max_size=spool_max_bytes, mode="w+b")
+        self._gzip = gzip.GzipFile(fileobj=self.file, mode="wb") if fmt.endswith(".gz") else None
+        self.text = io.TextIOWrapper(self._gzip or self.file, encoding="utf-8", newline="")
+        self.rows = 0
+
+    def size(self) -> int:
+        """Số byte đã ghi xuống file (với gzip là kích thước sau nén, có thể trễ một chút do bộ đệm)."""
+        self.text.flush()
+        return self.file.tell()
+
+    def finish(self):
+        """Hoàn tất phần này và trả về file tạm đã tua về đầu."""
+        self.text.flush()
+        self.text.detach()  # Không để TextIOWrapper đóng file tạm
+        if self._gzip is not None:
+            self._gzip.close()  # GzipFile không đóng fileobj được truyền vào
+        self.file.seek(0)
+        return self.file
+
+
+def write_backup_parts(headers: list, records, fmt: str = "csv", max_part_bytes: int = 45 * 1024 * 1024,
+                       spool_max_bytes: int = 8 * 1024 * 1024) -> list:
+    """
+    Ghi `records` (các dict tên cột -> giá trị) theo định dạng `fmt` và trả về danh sách các file tạm, mỗi file một phần.
+    Phần mới được bắt đầu khi phần hiện tại vượt `max_part_bytes`; mỗi phần CSV đều có hàng tiêu đề riêng.
+    """
+    if fmt not in BACKUP_FORMATS:
+        raise ValueError(f"Định dạng không hỗ trợ: {fmt}")
+    is_csv = fmt.startswith("csv")
+    parts = []
+    part = None
+    writer = None
+
+    def _start_part():
+        nonlocal part, writer
+        part = _PartWriter(fmt, spool_max_bytes)
+        if is_csv:
+            writer = csv.writer(part.text)
+            writer.writerow(headers)
+
+    _start_part()
+    for record in records:
+        if is_csv:
+            writer.writerow([record.get(header, '') for header in headers])
+        else:
+            part.text.write(json.dumps({header: record.get(header, '') for header in headers}, ensure_ascii=False) + "\n")
+        part.rows += 1
+        # Kiểm tra kích thước sau mỗi 200 hàng để không phải flush quá thường xuyên
+        if max_part_bytes and part.rows % 200 == 0 and part.size() >= max_part_bytes:
+            parts.append(part.finish())
+            _start_part()
+    if part.rows or not parts:
+        parts.append(part.finish())
+    else:
+        part.finish().close()
+    return parts
@@ -0,0 +1,273 @@
+# File: benchmarks/bench_handlers.py
+# Benchmark các lệnh của bot (search, inline, stats, random, find_row_by_username) với sheet giả trong bộ nhớ
+# gồm 1k / 10k / 100k hàng. Chạy hoàn toàn offline: không cần Telegram, Google Sheets hay mạng.
+#
+#   python benchmarks/bench_handlers.py [--sizes 1000,10000,100000] [--iterations 200] [--output file.json]
+#
+# Mỗi lệnh được đo trong 3 tình huống:
+#   cold  - bộ nhớ đệm trống, lệnh phải tải toàn bộ sheet
+#   stale - bộ nhớ đệm hết hạn, lệnh phải kiểm tra thay đổi (đồng bộ một phần)
+#   warm  - bộ nhớ đệm còn hạn, không gọi Sheets
+# Kết quả: độ trễ (p50/p90/p95/p99), số lần gọi Sheets và bộ nhớ đỉnh (tracemalloc), lưu dưới dạng JSON.
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from collections import Counter
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+# Cấu hình cho tele_bot phải có trước khi import (tele_bot kiểm tra các biến này ngay khi được import)
+_WORK_DIR = tempfile.mkdtemp(prefix="bench_handlers_")
+os.environ.update({
+    "TELEGRAM_TOKEN": "0:benchmark",
+    "GOOGLE_SHEET_NAME": "Benchmark",
+    "WORKSHEET_NAME": "Profiles",
+    "GOOGLE_CREDENTIALS_FILE": os.path.join(_WORK_DIR, "credentials.json"),
+    "INSTAGRAM_COOKIE_FILE": os.path.join(_WORK_DIR, "cookies.pkl"),
+    "STORAGE_BACKEND": "sheets",
+    "SHEET_DELTA_SYNC": "1",
+    "SHEETS_REQUESTS_PER_MINUTE": "1000000",  # Không để hạn mức của lớp ghi làm sai lệch số đo
+    "SHEETS_WRITE_WINDOW_SECONDS": "0",
+    "INLINE_DEBOUNCE_SECONDS": "0",
+    "ADD_JOURNAL_FILE": os.path.join(_WORK_DIR, "add_journal.jsonl"),
+    "SCRAPE_CHECKPOINT_FILE": os.path.join(_WORK_DIR, "scrape_checkpoint.jsonl"),
+})
+
+import tele_bot  # noqa: E402
+from record_cache import RecordCache  # noqa: E402
+from storage import create_backend  # noqa: E402
+
+from fakes import FakeContext, FakeInlineQuery, FakeMessage, FakeUpdate, FakeWorksheet, generate_rows  # noqa: E402
+
+logging.disable(logging.INFO)
+warnings.filterwarnings("ignore")  # Cảnh báo của seaborn / matplotlib khi vẽ biểu đồ /stats
+
+SCENARIOS = ("cold", "stale", "warm")
+
+
+def install_sheet(sheet: FakeWorksheet, ttl: float):
+    """Gắn sheet giả vào tele_bot với nơi lưu và bộ nhớ đệm mới (giống cách tele_bot tự khởi tạo)."""
+    tele_bot.worksheet = sheet
+    tele_bot.storage = create_backend(
+        "sheets",
+        tele_bot.get_worksheet,
+        tele_bot.sheets_writer,
+        key_func=lambda record: tele_bot.extract_username(record.get("URL", "")),
+        rating_field=tele_bot.RATING_COLUMN_NAME,
+        checksum_column=tele_bot.SHEET_CHECKSUM_COLUMN,
+    )
+    tele_bot.record_cache = RecordCache(
+        tele_bot.storage.load_rows,
+        key_func=lambda record: tele_bot.extract_username(record.get("URL", "")),
+        ttl=ttl,
+        search_fields=(tele_bot.FULL_NAME_COLUMN_NAME,),
+        rating_field=tele_bot.RATING_COLUMN_NAME,
+        delta_loader=tele_bot.storage.load_changes,
+    )
+    tele_bot.inline_result_cache.clear()
+    tele_bot.inline_query_sequence.clear()
+    tele_bot.random_sessions.clear()
+
+
+def build_commands(rows: list, rng: random.Random) -> dict:
+    """Mỗi lệnh là một hàm tạo coroutine mới với tham số ngẫu nhiên lấy từ dữ liệu thật của sheet."""
+    names = [row[1].split()[0].lower() for row in rows[1:]]
+    usernames = [tele_bot.extract_username(row[0]) for row in rows[1:]]
+
+    def search():
+        return tele_bot.search_command(FakeUpdate(message=FakeMessage()), FakeContext([rng.choice(names)]))
+
+    def inline():
+        # Giống người dùng đang gõ: tiền tố ngẫu nhiên của một tên
+        name = rng.choice(names)
+        query = FakeInlineQuery(name[:rng.randint(2, len(name))], user_id=rng.randint(1, 50))
+        return tele_bot.inline_query_handler(FakeUpdate(inline_query=query), FakeContext())
+
+    def inline_random():
+        query = FakeInlineQuery("random", user_id=rng.randint(1, 50))
+        return tele_bot.inline_query_handler(FakeUpdate(inline_query=query), FakeContext())
+
+    def stats():
+        return tele_bot.stats_command(FakeUpdate(message=FakeMessage()), FakeContext())
+
+    def random_profile():
+        args = [str(rng.randint(1, 5))] if rng.random() < 0.5 else []
+        return tele_bot.random_command(FakeUpdate(user_id=rng.randint(1, 50), message=FakeMessage()), FakeContext(args))
+
+    def find_row():
+        return tele_bot.find_row_by_username(rng.choice(usernames))
+
+    return {
+        "search": search,
+        "inline": inline,
+        "inline_random": inline_random,
+        "stats": stats,
+        "random": random_profile,
+        "find_row_by_username": find_row,
+    }
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Phân vị theo phương pháp nearest-rank."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize_latencies(latencies: list) -> dict:
+    values = sorted(latency * 1000 for latency in latencies)
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 0.50),
+        "p90": percentile(values, 0.90),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": values[-1] if values else 0.0,
+    }
+
+
+async def measure(sheet: FakeWorksheet, make_call, scenario: str, iterations: int) -> dict:
+    """Chạy một lệnh `iterations` lần trong một tình huống, trả về độ trễ và số lần gọi Sheets."""
+    latencies = []
+    calls = Counter()
+    if scenario != "cold":
+        install_sheet(sheet, ttl=3600)
+        await tele_bot.refresh_cache_if_stale()
+        for _ in range(min(3, iterations)):
+            await make_call()  # Làm nóng (ví dụ: biểu đồ /stats được vẽ lần đầu)
+    for _ in range(iterations):
+        if scenario == "cold":
+            install_sheet(sheet, ttl=3600)
+        elif scenario == "stale":
+            # Cho bộ nhớ đệm hết hạn đúng một lần trước lệnh (ttl=0 sẽ làm mọi lần đọc bên trong lệnh cũng đồng bộ lại)
+            tele_bot.record_cache._loaded_at -= tele_bot.record_cache.ttl + 1
+        before = Counter(sheet.calls)
+        started = time.perf_counter()
+        await make_call()
+        latencies.append(time.perf_counter() - started)
+        calls.update(Counter(sheet.calls) - before)
+    return {
+        "latency_ms": summarize_latencies(latencies),
+        "sheets_calls": {
+            "total": sum(calls.values()),
+            "per_call": sum(calls.values()) / iterations,
+            "by_method": dict(calls),
+        },
+    }
+
+
+async def measure_memory(sheet: FakeWorksheet, commands: dict, iterations: int) -> dict:
+    """Bộ nhớ đỉnh (tracemalloc) khi tải toàn bộ sheet vào bộ nhớ đệm và khi chạy từng lệnh với bộ nhớ đệm còn hạn."""
+    tracemalloc.start()
+    try:
+        install_sheet(sheet, ttl=3600)
+        base, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        await tele_bot.refresh_cache_if_stale()
+        current, peak = tracemalloc.get_traced_memory()
+        result = {"cache_load_peak_bytes": peak - base, "cache_resident_bytes": current - base, "commands": {}}
+        for name, make_call in commands.items():
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            for _ in range(iterations):
+                await make_call()
+            _, peak = tracemalloc.get_traced_memory()
+            result["commands"][name] = peak - before
+        return result
+    finally:
+        tracemalloc.stop()
+
+
+async def run_size(size: int, iterations: int, cold_iterations: int, memory_iterations: int, seed: int,
+                   selected: list | None = None) -> dict:
+    rows = generate_rows(size, seed)
+    sheet = FakeWorksheet(rows)
+    commands = build_commands(rows, random.Random(seed))
+    if selected:
+        commands = {name: make_call for name, make_call in commands.items() if name in selected}
+    result = {"rows": size, "commands": {}}
+    for name, make_call in commands.items():
+        result["commands"][name] = {}
+        for scenario in SCENARIOS:
+            count = cold_iterations if scenario == "cold" else iterations
+            result["commands"][name][scenario] = await measure(sheet, make_call, scenario, count)
+            summary = result["commands"][name][scenario]
+            print(f"{size:>7} {name:<22} {scenario:<5} "
+                  f"p50={summary['latency_ms']['p50']:9.3f}ms p95={summary['latency_ms']['p95']:9.3f}ms "
+                  f"p99={summary['latency_ms']['p99']:9.3f}ms sheets/lệnh={summary['sheets_calls']['per_call']:.2f}")
+    result["memory"] = await measure_memory(sheet, commands, memory_iterations)
+    memory = result["memory"]
+    print(f"{size:>7} bộ nhớ: tải sheet đỉnh {memory['cache_load_peak_bytes'] / 1e6:.1f} MB, "
+          f"bộ nhớ đệm {memory['cache_resident_bytes'] / 1e6:.1f} MB")
+    return result
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark các lệnh của bot với sheet giả trong bộ nhớ.")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Số hàng của sheet giả, cách nhau bởi dấu phẩy")
+    parser.add_argument("--iterations", type=int, default=200, help="Số lần chạy mỗi lệnh (stale / warm)")
+    parser.add_argument("--cold-iterations", type=int, default=3, help="Số lần chạy mỗi lệnh khi bộ nhớ đệm trống")
+    parser.add_argument("--memory-iterations", type=int, default=20, help="Số lần chạy mỗi lệnh khi đo bộ nhớ")
+    parser.add_argument("--commands", help="Chỉ chạy các lệnh này, cách nhau bởi dấu phẩy (mặc định: tất cả)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="File JSON kết quả (mặc định: benchmarks/results/handlers_<thời gian>.json)")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    selected = [name.strip() for name in args.commands.split(",") if name.strip()] if args.commands else None
+    started_at = datetime.now()
+    results = []
+    for size in sizes:
+        results.append(asyncio.run(run_size(size, args.iterations, args.cold_iterations, args.memory_iterations, args.seed, selected)))
+
+    report = {
+        "benchmark": "handlers",
+        "started_at": started_at.isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "sizes": sizes,
+            "iterations": args.iterations,
+            "cold_iterations": args.cold_iterations,
+            "memory_iterations": args.memory_iterations,
+            "seed": args.seed,
+            "commands": selected,
+            "delta_sync": tele_bot.SHEET_DELTA_SYNC,
+            "checksum_column": tele_bot.SHEET_CHECKSUM_COLUMN,
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join(BENCH_DIR, "results", f"handlers_{started_at:%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ Đã lưu kết quả vào {output}")
+
+
+if __name__ == "__main__":
+    main()
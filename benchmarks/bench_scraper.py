@@ -0,0 +1,228 @@
+# File: benchmarks/bench_scraper.py
+# Benchmark thông lượng của scraper (scraper.iter_scrape_instagram_profiles) với Instagram và Cloudinary giả
+# chạy trên máy (benchmarks/stubs.py). Không truy cập mạng thật.
+#
+#   python benchmarks/bench_scraper.py [--engine http|selenium] [--profiles 50] [--scenarios ok,missing,...]
+#
+# Mỗi tình huống cào một danh sách hồ sơ cùng loại (xem stubs.py) và đo: số hồ sơ/phút, thời gian trung bình mỗi
+# giai đoạn (pacing, navigate, extract, download, upload), số yêu cầu tới server giả và chi phí của các đường lỗi
+# so với tình huống "ok". Engine "selenium" cần Chrome và /usr/bin/chromedriver như khi chạy bot.
+
+import argparse
+import json
+import logging
+import os
+import pickle
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from stubs import CloudinaryStub, InstagramStub  # noqa: E402
+
+# Loại hồ sơ của từng tình huống; "repeat" cào lại đúng các hồ sơ của "ok" để đo đường dùng lại ảnh đại diện (304)
+SCENARIOS = {
+    "ok": "ok",
+    "repeat": "ok",
+    "missing": "missing",
+    "fail": "fail",
+    "slow": "slow",
+    "mixed": None,
+}
+DEFAULT_MIX = "ok=0.8,missing=0.1,slow=0.05,fail=0.05"
+
+
+def parse_mix(text: str) -> list:
+    weights = []
+    for item in text.split(","):
+        kind, _, weight = item.partition("=")
+        weights.append((kind.strip(), float(weight or 1)))
+    return weights
+
+
+def build_profiles(scenario: str, count: int, mix: list, rng: random.Random) -> list:
+    kind = SCENARIOS[scenario]
+    # Username riêng cho từng tình huống (trừ "repeat") để ảnh đại diện của tình huống trước không được dùng lại
+    group = "ok" if scenario == "repeat" else scenario
+    profiles = []
+    for i in range(count):
+        profile_kind = kind or rng.choices([k for k, _ in mix], weights=[w for _, w in mix])[0]
+        username = f"{'bench' if profile_kind == 'ok' else profile_kind}_{group}_{i:05d}"
+        profiles.append({"row_index": i + 2, "url": f"https://www.instagram.com/{username}/"})
+    return profiles
+
+
+def reset_limiter():
+    """Bộ giới hạn tốc độ mới cho mỗi tình huống, để tình huống trước (ví dụ nhiều lỗi) không ảnh hưởng tình huống sau."""
+    import http_scraper
+    import rate_limiter
+    import scraper
+
+    limiter = rate_limiter.AdaptiveRateLimiter.from_env()
+    rate_limiter.limiter = scraper.limiter = http_scraper.limiter = limiter
+    return limiter
+
+
+def run_scenario(scenario: str, profiles: list, engine: str, cookie_file: str, workers: int,
+                 instagram: InstagramStub, cloudinary_stub: CloudinaryStub) -> dict:
+    import scraper
+    from scrape_cache import outcome_of
+
+    limiter = reset_limiter()
+    instagram.reset_counters()
+    cloudinary_stub.reset_counters()
+    outcomes = {}
+    arrivals = []
+    started = time.perf_counter()
+    for result in scraper.iter_scrape_instagram_profiles(cookie_file, profiles, num_workers=workers, engine=engine, use_cache=False):
+        arrivals.append(time.perf_counter() - started)
+        outcome = outcome_of(result)
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    elapsed = time.perf_counter() - started
+
+    stages = scraper.stage_stats.summary()
+    return {
+        "profiles": len(profiles),
+        "results": len(arrivals),
+        "wall_seconds": elapsed,
+        "profiles_per_minute": len(arrivals) / elapsed * 60 if elapsed else 0.0,
+        "seconds_per_profile": elapsed / len(arrivals) if arrivals else None,
+        "first_result_seconds": arrivals[0] if arrivals else None,
+        "outcomes": outcomes,
+        "stages": stages,
+        "instagram_requests": dict(instagram.calls),
+        "cloudinary_requests": dict(cloudinary_stub.calls),
+        "rate_limiter": {
+            "final_rate_per_minute": limiter.rate,
+            "requests": limiter.total_requests,
+            "blocks": limiter.total_blocks,
+        },
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark thông lượng của scraper với Instagram / Cloudinary giả.")
+    parser.add_argument("--engine", choices=("http", "selenium"), default="http")
+    parser.add_argument("--lean", action="store_true", help="Bật SCRAPER_LEAN_MODE (chỉ với engine selenium)")
+    parser.add_argument("--profiles", type=int, default=50, help="Số hồ sơ mỗi tình huống")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Các tình huống, cách nhau bởi dấu phẩy")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Tỉ lệ các loại hồ sơ trong tình huống mixed")
+    parser.add_argument("--workers", type=int, default=2, help="Số trình duyệt (selenium) / số yêu cầu song song (http)")
+    parser.add_argument("--rate-per-minute", type=float, default=600, help="Tốc độ ban đầu của bộ giới hạn tốc độ")
+    parser.add_argument("--min-rate-per-minute", type=float, default=60)
+    parser.add_argument("--max-rate-per-minute", type=float, default=1200)
+    parser.add_argument("--backoff-seconds", type=float, default=1, help="Thời gian tạm dừng cơ bản khi bị chặn")
+    parser.add_argument("--latency-ms", type=float, default=30, help="Độ trễ mỗi phản hồi của Instagram giả")
+    parser.add_argument("--slow-ms", type=float, default=1500, help="Độ trễ thêm của các hồ sơ slow_")
+    parser.add_argument("--cdn-ms", type=float, default=20, help="Độ trễ khi tải ảnh đại diện")
+    parser.add_argument("--upload-ms", type=float, default=80, help="Độ trễ mỗi lần tải ảnh lên Cloudinary giả")
+    parser.add_argument("--avatar-kb", type=int, default=40)
+    parser.add_argument("--no-json", action="store_true", help="JSON endpoint trả về HTML (buộc đọc thẻ meta)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--log-level", default="CRITICAL", help="Mức log của bot trong lúc chạy (lỗi trên các đường lỗi là dự kiến)")
+    parser.add_argument("--output", help="File JSON kết quả (mặc định: benchmarks/results/scraper_<thời gian>.json)")
+    args = parser.parse_args()
+
+    instagram = InstagramStub(latency=args.latency_ms / 1000, slow_latency=args.slow_ms / 1000,
+                              cdn_latency=args.cdn_ms / 1000, avatar_bytes=args.avatar_kb * 1024,
+                              json_enabled=not args.no_json).start()
+    cloudinary_stub = CloudinaryStub(upload_latency=args.upload_ms / 1000).start()
+
+    # Cấu hình cho scraper phải có trước khi import (các giá trị được đọc khi module được nạp)
+    work_dir = tempfile.mkdtemp(prefix="bench_scraper_")
+    os.environ.update({
+        "INSTAGRAM_BASE_URL": instagram.url,
+        "SCRAPER_ENGINE": args.engine,
+        "SCRAPER_WORKERS": str(args.workers),
+        "HTTP_SCRAPER_CONCURRENCY": str(args.workers),
+        "SCRAPER_LEAN_MODE": "1" if args.lean else "0",
+        "SCRAPE_RATE_PER_MINUTE": str(args.rate_per_minute),
+        "SCRAPE_RATE_MIN_PER_MINUTE": str(args.min_rate_per_minute),
+        "SCRAPE_RATE_MAX_PER_MINUTE": str(args.max_rate_per_minute),
+        "SCRAPE_BACKOFF_BASE_SECONDS": str(args.backoff_seconds),
+        "SCRAPE_BACKOFF_MAX_SECONDS": str(args.backoff_seconds * 8),
+        "SCRAPE_CACHE_FILE": os.path.join(work_dir, "scrape_cache.sqlite3"),
+        "AVATAR_MANIFEST_FILE": os.path.join(work_dir, "avatar_manifest.json"),
+        "CLOUDINARY_CLOUD_NAME": "bench",
+        "CLOUDINARY_API_KEY": "bench",
+        "CLOUDINARY_API_SECRET": "bench",
+    })
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=args.log_level.upper())
+
+    import cloudinary
+    from scraper import ScraperUnavailable
+
+    # Mọi lần tải ảnh lên đi tới Cloudinary giả thay vì api.cloudinary.com
+    cloudinary.config(upload_prefix=cloudinary_stub.url)
+    cookie_file = os.path.join(work_dir, "cookies.pkl")
+    with open(cookie_file, "wb") as f:
+        pickle.dump([{"name": "sessionid", "value": "benchmark"}], f)
+
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    started_at = datetime.now()
+    results = {}
+    try:
+        for scenario in [name.strip() for name in args.scenarios.split(",") if name.strip()]:
+            if scenario not in SCENARIOS:
+                parser.error(f"Tình huống không hợp lệ: {scenario} (chọn trong {', '.join(SCENARIOS)})")
+            profiles = build_profiles(scenario, args.profiles, mix, rng)
+            result = run_scenario(scenario, profiles, args.engine, cookie_file, args.workers, instagram, cloudinary_stub)
+            results[scenario] = result
+            stages = ", ".join(f"{stage} {stats['avg'] * 1000:.1f}ms x{stats['count']}" for stage, stats in result["stages"].items())
+            print(f"{scenario:<8} {result['profiles_per_minute']:8.1f} hồ sơ/phút  {result['wall_seconds']:7.2f}s  "
+                  f"{result['outcomes']}  [{stages}]")
+    except ScraperUnavailable as e:
+        print(f"❌ Không thể chạy benchmark với engine {args.engine}: {e}")
+        sys.exit(1)
+    finally:
+        if args.engine == "selenium":
+            from browser_service import browser_pool
+            browser_pool.shutdown()
+        instagram.stop()
+        cloudinary_stub.stop()
+
+    # Chi phí của các đường lỗi: thời gian mỗi hồ sơ so với tình huống "ok"
+    baseline = (results.get("ok") or {}).get("seconds_per_profile")
+    error_path_cost = {
+        scenario: {
+            "seconds_per_profile": result["seconds_per_profile"],
+            "relative_to_ok": result["seconds_per_profile"] / baseline if baseline and result["seconds_per_profile"] else None,
+        }
+        for scenario, result in results.items()
+    }
+
+    report = {
+        "benchmark": "scraper",
+        "started_at": started_at.isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": results,
+        "error_path_cost": error_path_cost,
+    }
+    output = args.output or os.path.join(BENCH_DIR, "results", f"scraper_{started_at:%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ Đã lưu kết quả vào {output}")
+
+
+if __name__ == "__main__":
+    main()
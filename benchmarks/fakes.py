@@ -0,0 +1,203 @@
+# File: benchmarks/fakes.py
+# Các đối tượng giả dùng cho benchmark, chạy hoàn toàn offline:
+# - FakeWorksheet: worksheet gspread trong bộ nhớ, đếm số lần gọi "API" theo từng hàm
+# - FakeUpdate / FakeContext / FakeMessage / FakeInlineQuery: thay cho các đối tượng của python-telegram-bot
+# - generate_rows: sinh dữ liệu hồ sơ giống sheet thật (cố định theo seed)
+
+import random
+import re
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+HEADERS = ["URL", "full_name", "Rating", "profile_pic_url"]
+
+_SYLLABLES = ["an", "bao", "chi", "dung", "giang", "ha", "hoa", "khanh", "lan", "linh", "mai", "minh",
+              "nga", "ngoc", "phuong", "quynh", "thao", "thu", "trang", "tuan", "van", "vy", "yen"]
+
+
+def generate_rows(count: int, seed: int = 42) -> list:
+    """Sinh `count` hàng hồ sơ (kèm hàng tiêu đề), giống kết quả worksheet.get_all_values()."""
+    rng = random.Random(seed)
+    rows = [list(HEADERS)]
+    for i in range(count):
+        first, last = rng.choice(_SYLLABLES), rng.choice(_SYLLABLES)
+        username = f"{first}.{last}_{i:06d}"
+        full_name = f"{first.title()} {last.title()} {rng.choice(_SYLLABLES).title()}"
+        rating = str(rng.choices([1, 2, 3, 4, 5], weights=[5, 10, 30, 35, 20])[0])
+        rows.append([
+            f"https://www.instagram.com/{username}/",
+            full_name,
+            rating,
+            f"https://res.cloudinary.com/demo/image/upload/instagram_avatars/{username}.jpg",
+        ])
+    return rows
+
+
+# ======================= GOOGLE SHEETS GIẢ =======================
+
+_A1_RANGE = re.compile(r"^([A-Z]*)(\d*)(?::([A-Z]*)(\d*))?$")
+
+
+def _column_index(letters: str) -> int:
+    index = 0
+    for char in letters:
+        index = index * 26 + ord(char) - ord("A") + 1
+    return index
+
+
+class FakeResponse:
+    def __init__(self, payload: dict):
+        self._payload = payload
+
+    def json(self) -> dict:
+        return self._payload
+
+
+class FakeClient:
+    """Chỉ hỗ trợ lệnh đọc modifiedTime trên Drive mà storage.SheetsBackend dùng."""
+
+    def __init__(self, worksheet):
+        self._worksheet = worksheet
+
+    def request(self, method, url, params=None, **kwargs):
+        self._worksheet.calls["drive.modifiedTime"] += 1
+        return FakeResponse({"modifiedTime": self._worksheet.modified_time})
+
+
+class FakeWorksheet:
+    """
+    Worksheet gspread trong bộ nhớ. Mỗi hàm tương ứng một lần gọi Sheets API và được đếm trong `calls`.
+    Giá trị trả về được sao chép như khi gspread dựng lại từ JSON, để chi phí bộ nhớ gần với thực tế.
+    """
+
+    def __init__(self, rows: list):
+        self.rows = [list(row) for row in rows]
+        self.calls = Counter()
+        self._modified = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        self.spreadsheet = SimpleNamespace(id="fake-spreadsheet", client=FakeClient(self))
+
+    @property
+    def modified_time(self) -> str:
+        return self._modified.isoformat().replace("+00:00", "Z")
+
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def _touch(self):
+        self._modified += timedelta(seconds=1)
+
+    def _set(self, row: int, col: int, value):
+        while len(self.rows) < row:
+            self.rows.append([])
+        cells = self.rows[row - 1]
+        cells.extend([''] * (col - len(cells)))
+        cells[col - 1] = '' if value is None else str(value)
+
+    def _get_range(self, a1: str) -> list:
+        match = _A1_RANGE.match(a1)
+        if not match:
+            raise ValueError(f"Vùng A1 không hỗ trợ: {a1}")
+        start_col, start_row, end_col, end_row = match.groups()
+        if end_col is None and end_row is None:
+            end_col, end_row = start_col, start_row
+        first_row = int(start_row) if start_row else 1
+        last_row = int(end_row) if end_row else len(self.rows)
+        first_col = _column_index(start_col) if start_col else 1
+        last_col = _column_index(end_col) if end_col else None
+        values = []
+        for row in self.rows[first_row - 1:last_row]:
+            values.append(list(row[first_col - 1:last_col]))
+        # Giống Sheets API: bỏ các hàng trống ở cuối vùng
+        while values and not any(values[-1]):
+            values.pop()
+        return values
+
+    def get_all_values(self) -> list:
+        self.calls["get_all_values"] += 1
+        return [list(row) for row in self.rows]
+
+    def row_values(self, row: int) -> list:
+        self.calls["row_values"] += 1
+        return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def col_values(self, col: int) -> list:
+        self.calls["col_values"] += 1
+        return [row[col - 1] if col <= len(row) else '' for row in self.rows]
+
+    def batch_get(self, ranges: list, **kwargs) -> list:
+        self.calls["batch_get"] += 1
+        return [self._get_range(a1) for a1 in ranges]
+
+    def batch_update(self, data: list, value_input_option: str = "RAW", **kwargs):
+        self.calls["batch_update"] += 1
+        for item in data:
+            match = _A1_RANGE.match(item["range"])
+            row, col = int(match.group(2)), _column_index(match.group(1))
+            self._set(row, col, item["values"][0][0])
+        self._touch()
+
+    def update_cell(self, row: int, col: int, value):
+        self.calls["update_cell"] += 1
+        self._set(row, col, value)
+        self._touch()
+
+    def append_rows(self, rows: list, **kwargs):
+        self.calls["append_rows"] += 1
+        self.rows.extend(list(row) for row in rows)
+        self._touch()
+
+    def delete_rows(self, start_index: int, end_index: int | None = None):
+        self.calls["delete_rows"] += 1
+        del self.rows[start_index - 1:(end_index or start_index)]
+        self._touch()
+
+
+# ======================= TELEGRAM GIẢ =======================
+
+class FakeMessage:
+    """Tin nhắn giả: ghi lại các lần trả lời thay vì gửi tới Telegram."""
+
+    def __init__(self):
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(("text", text))
+        return SimpleNamespace(photo=[], message_id=len(self.replies))
+
+    async def reply_photo(self, photo, **kwargs):
+        self.replies.append(("photo", kwargs.get("caption")))
+        return SimpleNamespace(photo=[SimpleNamespace(file_id=f"fake-photo-{len(self.replies)}")], message_id=len(self.replies))
+
+    async def reply_document(self, document, **kwargs):
+        self.replies.append(("document", kwargs.get("filename")))
+        return SimpleNamespace(photo=[], message_id=len(self.replies))
+
+
+class FakeInlineQuery:
+    def __init__(self, query: str, user_id: int, offset: str = ""):
+        self.query = query
+        self.offset = offset
+        self.from_user = SimpleNamespace(id=user_id)
+        self.answers = []
+
+    async def answer(self, results, **kwargs):
+        self.answers.append((list(results), kwargs.get("next_offset")))
+
+
+class FakeUpdate:
+    def __init__(self, user_id: int = 1, message: FakeMessage | None = None, inline_query: FakeInlineQuery | None = None):
+        self.message = message
+        self.inline_query = inline_query
+        self.callback_query = None
+        self.effective_user = SimpleNamespace(id=user_id)
+        self.effective_chat = SimpleNamespace(id=user_id)
+
+
+class FakeContext:
+    def __init__(self, args: list | None = None, user_data: dict | None = None):
+        self.args = list(args or [])
+        self.user_data = {} if user_data is None else user_data
+        self.chat_data = {}
+        self.job_queue = None
+        self.bot = None
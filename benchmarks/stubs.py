@@ -0,0 +1,232 @@
+# File: benchmarks/stubs.py
+# Server HTTP giả lập Instagram và Cloudinary trên máy (127.0.0.1), dùng cho benchmark của scraper.
+# Hành vi của từng hồ sơ được quyết định bởi tiền tố của username:
+#   (mặc định)   hồ sơ bình thường: JSON (?__a=1) và trang HTML có og:title / og:image / <header><img>
+#   missing_     404 "Sorry, this page isn't available"
+#   slow_        hồ sơ bình thường nhưng phản hồi chậm (slow_ms)
+#   fail_        500 Internal Server Error
+#   ratelimited_ 429 Too Many Requests
+#   login_       chuyển hướng tới /accounts/login/
+#   nometa_      trang 200 không có thông tin hồ sơ (trang đăng nhập được render tại chỗ)
+
+import hashlib
+import html
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+BEHAVIOR_PREFIXES = ("missing", "slow", "fail", "ratelimited", "login", "nometa")
+
+NOT_FOUND_PAGE = (
+    "<!DOCTYPE html><html><head><title>Page not found • Instagram</title></head>"
+    "<body><h2>Sorry, this page isn't available.</h2>"
+    "<p>The link you followed may be broken, or the page may have been removed.</p></body></html>"
+)
+LOGIN_PAGE = "<!DOCTYPE html><html><head><title>Login • Instagram</title></head><body><form>Log in</form></body></html>"
+
+
+def behavior_of(username: str) -> str:
+    prefix = username.split("_", 1)[0]
+    return prefix if prefix in BEHAVIOR_PREFIXES else "ok"
+
+
+def full_name_of(username: str) -> str:
+    return " ".join(part.title() for part in username.split("_") if not part.isdigit())
+
+
+class _StubServer:
+    """ThreadingHTTPServer chạy trong thread nền, đếm số yêu cầu theo loại."""
+
+    def __init__(self, handler_class):
+        self.calls = Counter()
+        self._calls_lock = threading.Lock()
+        handler = type(handler_class.__name__, (handler_class,), {"stub": self})
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, kind: str):
+        with self._calls_lock:
+            self.calls[kind] += 1
+
+    def reset_counters(self):
+        with self._calls_lock:
+            self.calls = Counter()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Giữ kết nối (keep-alive) như server thật
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str = "text/html; charset=utf-8", headers: dict | None = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+
+class _InstagramHandler(_QuietHandler):
+    stub = None
+
+    def do_GET(self):
+        stub = self.stub
+        parts = urlsplit(self.path)
+        path = parts.path
+        if stub.latency:
+            time.sleep(stub.latency)
+
+        if path.startswith("/cdn/"):
+            self._send_avatar(path[len("/cdn/"):])
+            return
+        if path in ("", "/"):
+            stub.count("home")
+            self._send(200, b"<!DOCTYPE html><html><head><title>Instagram</title></head><body></body></html>")
+            return
+        if path.startswith("/accounts/login"):
+            stub.count("login_page")
+            self._send(200, LOGIN_PAGE.encode())
+            return
+
+        match = re.fullmatch(r"/([A-Za-z0-9_.]+)/?", path)
+        if not match:
+            stub.count("unknown")
+            self._send(404, NOT_FOUND_PAGE.encode())
+            return
+        username = match.group(1)
+        wants_json = "__a" in parse_qs(parts.query)
+        behavior = behavior_of(username)
+        stub.count(f"{behavior}_{'json' if wants_json else 'page'}")
+
+        if behavior == "slow":
+            time.sleep(stub.slow_latency)
+        if behavior == "missing":
+            self._send(404, NOT_FOUND_PAGE.encode())
+        elif behavior == "fail":
+            self._send(500, b"Internal Server Error", "text/plain")
+        elif behavior == "ratelimited":
+            self._send(429, b"Please wait a few minutes before you try again.", "text/plain")
+        elif behavior == "login":
+            self._send(302, b"", headers={"Location": f"/accounts/login/?next=/{username}/"})
+        elif behavior == "nometa":
+            self._send(200, LOGIN_PAGE.encode())
+        elif wants_json and stub.json_enabled:
+            self._send(200, json.dumps(self._profile_json(username)).encode(), "application/json; charset=utf-8")
+        else:
+            self._send(200, self._profile_page(username).encode())
+
+    do_HEAD = do_GET
+
+    def _avatar_url(self, username: str) -> str:
+        return f"{self.stub.url}/cdn/{username}.jpg"
+
+    def _profile_json(self, username: str) -> dict:
+        return {"graphql": {"user": {
+            "username": username,
+            "full_name": full_name_of(username),
+            "is_private": False,
+            "profile_pic_url": self._avatar_url(username),
+            "profile_pic_url_hd": self._avatar_url(username),
+        }}}
+
+    def _profile_page(self, username: str) -> str:
+        title = html.escape(f"{full_name_of(username)} (@{username}) • Instagram photos and videos")
+        avatar = html.escape(self._avatar_url(username))
+        return (
+            f"<!DOCTYPE html><html><head><title>{title}</title>"
+            f'<meta property="og:title" content="{title}">'
+            f'<meta property="og:image" content="{avatar}">'
+            f'</head><body><header><img src="{avatar}" alt="avatar"></header>'
+            f"<main>{'<div>post</div>' * 50}</main></body></html>"
+        )
+
+    def _send_avatar(self, name: str):
+        stub = self.stub
+        if stub.cdn_latency:
+            time.sleep(stub.cdn_latency)
+        etag = '"' + hashlib.md5(name.encode()).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            stub.count("avatar_304")
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        # Nội dung cố định theo tên ảnh để mã băm ổn định giữa các lần chạy
+        seed = hashlib.sha256(name.encode()).digest()
+        body = (seed * (stub.avatar_bytes // len(seed) + 1))[:stub.avatar_bytes]
+        stub.count("avatar")
+        self._send(200, body, "image/jpeg", headers={"ETag": etag, "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"})
+
+
+class InstagramStub(_StubServer):
+    """
+    Instagram giả: trang hồ sơ, JSON endpoint, trang lỗi và ảnh đại diện (CDN, có ETag / 304).
+    latency / slow_latency / cdn_latency tính bằng giây.
+    """
+
+    def __init__(self, latency: float = 0.03, slow_latency: float = 1.5, cdn_latency: float = 0.02,
+                 avatar_bytes: int = 40 * 1024, json_enabled: bool = True):
+        super().__init__(_InstagramHandler)
+        self.latency = latency
+        self.slow_latency = slow_latency
+        self.cdn_latency = cdn_latency
+        self.avatar_bytes = avatar_bytes
+        self.json_enabled = json_enabled
+
+
+class _CloudinaryHandler(_QuietHandler):
+    stub = None
+
+    def do_POST(self):
+        stub = self.stub
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        match = re.match(r"/v1_1/([^/]+)/image/upload", self.path)
+        if not match:
+            stub.count("unknown")
+            self._send(404, b'{"error": {"message": "Not found"}}', "application/json")
+            return
+        if stub.upload_latency:
+            time.sleep(stub.upload_latency)
+        stub.count("upload")
+        public_id = re.search(rb'name="public_id"\r\n\r\n([^\r]*)', body)
+        public_id = public_id.group(1).decode() if public_id else hashlib.md5(body).hexdigest()
+        cloud_name = match.group(1)
+        payload = {
+            "public_id": public_id,
+            "resource_type": "image",
+            "bytes": len(body),
+            "secure_url": f"https://res.cloudinary.com/{cloud_name}/image/upload/v1/{public_id}.jpg",
+        }
+        self._send(200, json.dumps(payload).encode(), "application/json")
+
+
+class CloudinaryStub(_StubServer):
+    """Cloudinary giả: nhận POST /v1_1/<cloud>/image/upload và trả về secure_url (dùng qua upload_prefix)."""
+
+    def __init__(self, upload_latency: float = 0.08):
+        super().__init__(_CloudinaryHandler)
+        self.upload_latency = upload_latency
@@ -0,0 +1,190 @@
+# File: browser_service.py
+# Quản lý các trình duyệt Chrome "ấm", tồn tại giữa các lần /scrape để không phải khởi động Chrome
+# và nạp cookie lại mỗi lần. Trình duyệt được kiểm tra trước khi dùng, tự khởi động lại khi bị crash,
+# và được thay mới sau N trang hoặc khi dùng quá nhiều RAM (quan trọng trên Raspberry Pi).
+
+import logging
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+import scraper
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Thay trình duyệt mới sau số trang này, hoặc khi tổng RSS của Chrome vượt ngưỡng (MB)
+BROWSER_MAX_PAGES = int(os.getenv("BROWSER_MAX_PAGES", "200"))
+BROWSER_MAX_RSS_MB = float(os.getenv("BROWSER_MAX_RSS_MB", "600"))
+# Đóng trình duyệt nếu không được dùng trong khoảng thời gian này (giây) để giải phóng RAM
+BROWSER_IDLE_TIMEOUT = float(os.getenv("BROWSER_IDLE_TIMEOUT", "900"))
+
+
+def process_tree_rss_mb(pid: int) -> float:
+    """Tổng RSS (MB) của một tiến trình và toàn bộ tiến trình con của nó (đọc từ /proc, chỉ trên Linux)."""
+    try:
+        children = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # Trường thứ 4 là ppid; tên tiến trình (trường 2) có thể chứa khoảng trắng nên cắt sau dấu ')'
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+                children.setdefault(ppid, []).append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+
+        total_pages = 0
+        stack = [pid]
+        while stack:
+            current = stack.pop()
+            stack.extend(children.get(current, []))
+            try:
+                with open(f"/proc/{current}/statm") as f:
+                    total_pages += int(f.read().split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+        return total_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except Exception:
+        return 0.0
+
+
+class BrowserService:
+    """Một trình duyệt được giữ sống lâu dài, tự kiểm tra sức khỏe và tự thay mới khi cần."""
+
+    def __init__(self, name: str, max_pages: int = BROWSER_MAX_PAGES, max_rss_mb: float = BROWSER_MAX_RSS_MB):
+        self.name = name
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        self._driver = None
+        self._cookie_file_path = None
+        self.pages = 0
+        self.restarts = 0
+        self.last_used = time.monotonic()
+
+    @property
+    def is_running(self) -> bool:
+        return self._driver is not None
+
+    def _is_healthy(self) -> bool:
+        try:
+            return self._driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    def _rss_mb(self) -> float:
+        try:
+            return process_tree_rss_mb(self._driver.service.process.pid)
+        except Exception:
+            return 0.0
+
+    def _start(self, cookie_file_path: str):
+        self._driver = scraper.create_driver(cookie_file_path)
+        self._cookie_file_path = cookie_file_path
+        self.pages = 0
+
+    def get_driver(self, cookie_file_path: str):
+        """Trả về trình duyệt sẵn sàng sử dụng, khởi động (lại) nếu chưa chạy, bị crash hoặc cần thay mới."""
+        self.last_used = time.monotonic()
+        if self._driver is not None:
+            reason = None
+            if cookie_file_path != self._cookie_file_path:
+                reason = "đổi file cookie"
+            elif self.pages >= self.max_pages:
+                reason = f"đã mở {self.pages} trang"
+            elif self.max_rss_mb and (rss := self._rss_mb()) > self.max_rss_mb:
+                reason = f"RAM {rss:.0f} MB vượt ngưỡng {self.max_rss_mb:.0f} MB"
+            elif not self._is_healthy():
+                reason = "không phản hồi"
+            if reason:
+                logger.info(f"♻️ [{self.name}] Khởi động lại trình duyệt ({reason}).")
+                self.quit()
+                self.restarts += 1
+        if self._driver is None:
+            self._start(cookie_file_path)
+        return self._driver
+
+    def note_page(self):
+        """Ghi nhận đã mở thêm một trang."""
+        self.pages += 1
+        self.last_used = time.monotonic()
+
+    def mark_broken(self):
+        """Trình duyệt gặp lỗi không phục hồi được: đóng để lần sau khởi động lại."""
+        self.quit()
+
+    def quit(self):
+        if self._driver is not None:
+            try:
+                self._driver.quit()
+            except Exception as e:
+                logger.debug(f"[{self.name}] Lỗi khi đóng trình duyệt: {e}")
+            self._driver = None
+
+
+class BrowserPool:
+    """Nhóm các BrowserService rảnh, được các worker của scraper mượn và trả lại giữa các lần cào."""
+
+    def __init__(self, max_idle: int | None = None, idle_timeout: float = BROWSER_IDLE_TIMEOUT):
+        self.max_idle = max_idle or scraper.SCRAPER_WORKERS
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._idle = []
+        self._created = 0
+        self._reaper = None
+
+    def checkout(self) -> BrowserService:
+        """Mượn một trình duyệt (ưu tiên trình duyệt đã chạy sẵn)."""
+        with self._lock:
+            self._idle.sort(key=lambda service: service.is_running)
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+            return BrowserService(name=f"browser-{self._created}")
+
+    def checkin(self, service: BrowserService):
+        """Trả trình duyệt về nhóm để dùng lại cho lần cào sau."""
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(service)
+                self._ensure_reaper()
+                return
+        service.quit()
+
+    def _ensure_reaper(self):
+        # Gọi trong self._lock; luồng dọn dẹp tự đặt _reaper = None (trong lock) khi dừng
+        if self.idle_timeout and self._reaper is None:
+            self._reaper = threading.Thread(target=self._reap_idle, name="browser-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_idle(self):
+        """Đóng các trình duyệt rảnh quá lâu; dừng khi không còn trình duyệt nào đang chạy."""
+        while True:
+            time.sleep(min(60.0, self.idle_timeout))
+            with self._lock:
+                # Đóng ngay trong lock để worker không mượn đúng trình duyệt đang bị đóng
+                now = time.monotonic()
+                for service in self._idle:
+                    if service.is_running and now - service.last_used > self.idle_timeout:
+                        logger.info(f"💤 [{service.name}] Đóng trình duyệt sau {self.idle_timeout:.0f} giây không sử dụng.")
+                        service.quit()
+                if not any(service.is_running for service in self._idle):
+                    # Đánh dấu đã dừng ngay trong lock: checkin() sau thời điểm này sẽ khởi động luồng dọn dẹp mới,
+                    # kể cả khi thread này chưa kết thúc hẳn
+                    self._reaper = None
+                    return
+
+    def shutdown(self):
+        """Đóng toàn bộ trình duyệt (gọi khi bot dừng)."""
+        with self._lock:
+            services, self._idle = self._idle, []
+        for service in services:
+            service.quit()
+
+
+# Nhóm trình duyệt dùng chung cho toàn bộ tiến trình
+browser_pool = BrowserPool()
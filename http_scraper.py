@@ -0,0 +1,225 @@
+# File: http_scraper.py
+# Engine cào dữ liệu không cần trình duyệt: gửi HTTP GET trực tiếp (httpx, dùng chung connection pool)
+# kèm cookie đã lưu, rồi đọc JSON endpoint hoặc thẻ meta og:title / og:image.
+# Khi gặp trang challenge hoặc trang yêu cầu đăng nhập, hồ sơ được trả lại để scraper chạy bằng Selenium;
+# khi bị giới hạn tốc độ (429), yêu cầu được gửi lại qua HTTP sau thời gian tạm dừng của bộ giới hạn tốc độ.
+
+import asyncio
+import html
+import json
+import logging
+import pickle
+import re
+import time
+from html.parser import HTMLParser
+
+import httpx
+
+import scraper
+from rate_limiter import NOT_FOUND_MARKER, detect_block_reason, limiter
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+
+class FallbackRequired(Exception):
+    """Instagram trả về trang challenge / yêu cầu đăng nhập: cần chuyển sang Selenium."""
+
+
+class _MetaParser(HTMLParser):
+    """Thu thập các thẻ <meta property=...> và nội dung thẻ <title>."""
+
+    def __init__(self):
+        super().__init__()
+        self.meta = {}
+        self.title = ""
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "meta":
+            attrs = dict(attrs)
+            key = attrs.get("property") or attrs.get("name")
+            if key and "content" in attrs:
+                self.meta.setdefault(key, attrs["content"] or "")
+        elif tag == "title":
+            self._in_title = True
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self._in_title = False
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+
+
+def load_cookies(cookie_file_path: str) -> dict:
+    """Đọc file cookie (định dạng pickle của Selenium) thành dict tên -> giá trị cho httpx."""
+    with open(cookie_file_path, "rb") as f:
+        cookies = pickle.load(f)
+    return {cookie["name"]: cookie["value"] for cookie in cookies if "name" in cookie and "value" in cookie}
+
+
+def detect_block(response: httpx.Response) -> str | None:
+    """Trả về lý do nếu phản hồi là trang challenge / yêu cầu đăng nhập / bị giới hạn tốc độ."""
+    return detect_block_reason(response.status_code, response.url.path)
+
+
+async def _get(client: httpx.AsyncClient, path: str, **kwargs) -> httpx.Response:
+    """
+    Gửi GET sau khi được bộ giới hạn tốc độ dùng chung cho phép; báo cho nó nếu bị chặn.
+    429 được gửi lại qua HTTP (tối đa HTTP_SCRAPER_MAX_RETRIES lần, sau thời gian tạm dừng của bộ giới hạn);
+    chỉ trang challenge / yêu cầu đăng nhập mới ném FallbackRequired.
+    """
+    for attempt in range(scraper.HTTP_SCRAPER_MAX_RETRIES + 1):
+        started = time.perf_counter()
+        await limiter.acquire_async()
+        scraper.stage_stats.record("pacing", time.perf_counter() - started)
+        started = time.perf_counter()
+        response = await client.get(path, **kwargs)
+        scraper.stage_stats.record("navigate", time.perf_counter() - started)
+        reason = detect_block(response)
+        if reason is None:
+            return response
+        limiter.record_block(reason)
+        if reason != "rate_limited":
+            raise FallbackRequired(reason)
+        # Bị giới hạn tốc độ: Selenium dùng chung IP nên cũng sẽ bị chặn; chờ tạm dừng (trong acquire_async) rồi thử lại
+        if attempt < scraper.HTTP_SCRAPER_MAX_RETRIES:
+            logger.info(f"[http] {path} bị giới hạn tốc độ, thử lại lần {attempt + 1}/{scraper.HTTP_SCRAPER_MAX_RETRIES}.")
+    # Hết số lần thử: coi như lỗi cào dữ liệu thông thường (hồ sơ sẽ được ghi "Scrape Error")
+    response.raise_for_status()
+    return response
+
+
+def parse_profile_json(data: dict):
+    """Lấy (full_name, profile_pic_url) từ JSON của endpoint ?__a=1, hoặc None nếu không có dữ liệu user."""
+    user_data = data.get("graphql", {}).get("user") or data.get("data", {}).get("user")
+    if not user_data:
+        return None
+    full_name = user_data.get("full_name") or user_data.get("username", "")
+    pic_url = user_data.get("profile_pic_url_hd") or user_data.get("profile_pic_url", "")
+    return full_name, pic_url
+
+
+def parse_profile_html(page: str):
+    """Lấy (full_name, profile_pic_url) từ thẻ og:title / og:image, hoặc None nếu trang không có các thẻ này."""
+    parser = _MetaParser()
+    parser.feed(page)
+    title = parser.meta.get("og:title") or parser.title
+    if not title or "(@" not in title:
+        return None
+    title = html.unescape(title)
+    match = re.search(r'^(.*?)\s*\(@', title)
+    full_name = match.group(1).strip() if match else ""
+    if not full_name:
+        username_match = re.search(r'\(@(.*?)\)', title)
+        full_name = username_match.group(1) if username_match else ""
+    return full_name, html.unescape(parser.meta.get("og:image", ""))
+
+
+async def fetch_profile(client: httpx.AsyncClient, username: str):
+    """
+    Lấy (full_name, profile_pic_url gốc) của một hồ sơ.
+    Trả về ("Not Found", "") nếu hồ sơ không tồn tại; ném FallbackRequired nếu gặp trang challenge / đăng nhập.
+    """
+    # 1. Thử JSON endpoint trước
+    response = await _get(client, f"/{username}/", params={"__a": "1", "__d": "dis"})
+    if response.status_code == 404:
+        limiter.record_block("page_unavailable", severe=False)
+        return "Not Found", ""
+    if response.status_code == 200 and "json" in response.headers.get("content-type", ""):
+        try:
+            started = time.perf_counter()
+            parsed = parse_profile_json(response.json())
+            scraper.stage_stats.record("extract", time.perf_counter() - started)
+            if parsed:
+                limiter.record_success()
+                return parsed
+        except json.JSONDecodeError:
+            pass
+
+    # 2. Dự phòng: đọc thẻ meta của trang hồ sơ
+    response = await _get(client, f"/{username}/")
+    if response.status_code == 404 or NOT_FOUND_MARKER in response.text:
+        limiter.record_block("page_unavailable", severe=False)
+        return "Not Found", ""
+    response.raise_for_status()
+    started = time.perf_counter()
+    parsed = parse_profile_html(response.text)
+    scraper.stage_stats.record("extract", time.perf_counter() - started)
+    if parsed is None:
+        # Trang không có thông tin hồ sơ: nhiều khả năng là trang đăng nhập được render tại chỗ
+        limiter.record_block("no_profile_meta")
+        raise FallbackRequired("no_profile_meta")
+    limiter.record_success()
+    return parsed
+
+
+async def scrape_profiles(cookie_file_path: str, indexed_profiles: list, base_url: str | None = None, concurrency: int = 2, on_result=None, stop_event=None):
+    """
+    Cào danh sách (vị trí, profile_info) bằng HTTP.
+    on_result(vị trí, kết quả) được gọi ngay khi từng hồ sơ xong; stop_event (threading.Event) cho phép dừng giữa chừng.
+    profile_pic_url trong kết quả là URL gốc trên CDN của Instagram (chưa tải lên Cloudinary).
+    Trả về (dict vị trí -> kết quả, danh sách (vị trí, profile_info) cần chạy lại bằng Selenium).
+    """
+    results = {}
+    fallback = []
+    blocked = asyncio.Event()  # Khi đã gặp challenge / trang đăng nhập, các hồ sơ còn lại chuyển thẳng sang Selenium
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(
+        base_url=base_url or scraper.INSTAGRAM_BASE_URL,
+        cookies=load_cookies(cookie_file_path),
+        headers={"User-Agent": USER_AGENT, "Accept-Language": "en-US,en;q=0.9"},
+        follow_redirects=True,
+        timeout=15,
+        limits=limits,
+    ) as client:
+
+        loop = asyncio.get_running_loop()
+
+        async def _record(position: int, result: dict):
+            results[position] = result
+            if on_result is not None:
+                # on_result có thể chờ chỗ trống trong hàng đợi tải ảnh (UploadStage.submit): chạy ngoài event loop
+                # để các yêu cầu đang chạy và bộ giới hạn tốc độ không bị treo theo
+                await loop.run_in_executor(None, on_result, position, result)
+
+        async def _scrape_one(position: int, profile_info: dict):
+            username = scraper.extract_username(profile_info.get("url"))
+            if not username:
+                logger.warning(f"Bỏ qua URL không hợp lệ: {profile_info.get('url')}")
+                return
+            async with semaphore:
+                if stop_event is not None and stop_event.is_set():
+                    return
+                if blocked.is_set():
+                    fallback.append((position, profile_info))
+                    return
+                try:
+                    logger.info(f"[http] Đang cào dữ liệu cho: {username}")
+                    full_name, original_pic_url = await fetch_profile(client, username)
+                except FallbackRequired as e:
+                    logger.warning(f"[http] {username} bị chặn ({e}), chuyển sang Selenium.")
+                    blocked.set()
+                    fallback.append((position, profile_info))
+                    return
+                except Exception as e:
+                    logger.error(f"[http] Lỗi khi cào dữ liệu cho {username}: {e}")
+                    await _record(position, {'row_index': profile_info['row_index'], 'full_name': "Scrape Error", 'profile_pic_url': ""})
+                    return
+
+            # Ảnh đại diện được tải lên Cloudinary bởi UploadStage của scraper
+            await _record(position, {
+                'row_index': profile_info['row_index'],
+                'full_name': full_name.strip() or username,
+                'profile_pic_url': original_pic_url or "",
+            })
+
+        await asyncio.gather(*(_scrape_one(position, info) for position, info in indexed_profiles))
+
+    fallback.sort(key=lambda item: item[0])
+    return results, fallback
@@ -10,6 +10,8 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.service import Service
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium.common.exceptions import NoSuchElementException
+from rate_limiter import limiter # Bộ giới hạn tốc độ thích ứng dùng chung với scraper
+from sheets_writer import sheets_writer # Gộp các lệnh ghi ô thành batch_update, giữ dưới hạn mức của Google Sheets
 
 # ======================= CẤU HÌNH =======================
 # THAY ĐỔI: Cấu hình cho Google Sheets
@@ -147,17 +149,22 @@ try:
             continue
 
         print(f"\n⏳ Đang xử lý URL từ hàng {row_index}: {profile_url}")
+        limiter.acquire() # Chờ tới lượt thay vì nghỉ cố định, tự giãn ra khi bị Instagram giới hạn
         display_name, avatar_url = get_instagram_profile_data(driver, profile_url)
+        if limiter.record_response(url=driver.current_url):
+            display_name, avatar_url = None, None # Trang đăng nhập / challenge: không dùng dữ liệu này
+        elif display_name is None:
+            limiter.record_block("scrape_error", severe=False)
 
         updates_made = False
         # Cập nhật từng ô nếu có dữ liệu mới và ô hiện tại trống
         if display_name and not row_data.get(FULL_NAME_COLUMN_NAME):
-            worksheet.update_cell(row_index, full_name_col_index, display_name)
+            sheets_writer.write_cell(worksheet, row_index, full_name_col_index, display_name, value_input_option="USER_ENTERED")
             print(f"  -> Cập nhật Tên: {display_name}")
             updates_made = True
 
         if avatar_url and not row_data.get(PROFILE_PIC_URL_COLUMN):
-            worksheet.update_cell(row_index, pic_url_col_index, avatar_url)
+            sheets_writer.write_cell(worksheet, row_index, pic_url_col_index, avatar_url, value_input_option="USER_ENTERED")
             print(f"  -> Cập nhật URL ảnh: {avatar_url}")
             updates_made = True
 
@@ -165,9 +172,9 @@ try:
             print(f"✅ Cập nhật thành công hàng {row_index}.")
         else:
             print(f"❌ Không có thông tin mới để cập nhật cho URL: {profile_url}")
-            
-        time.sleep(5) # Giữ khoảng nghỉ để tránh bị block
 
 finally:
+    sheets_writer.flush() # Ghi nốt các ô còn đang chờ
+    print(f"📝 {sheets_writer.summary()}")
     print("\n🎉 Hoàn thành! Đóng trình duyệt.")
     driver.quit()
\ No newline at end of file
@@ -0,0 +1,163 @@
+# File: rate_limiter.py
+# Bộ giới hạn tốc độ thích ứng (token bucket) dùng chung cho mọi đường cào dữ liệu Instagram.
+# Tăng dần tốc độ khi các phản hồi bình thường, giảm tốc độ và tạm dừng theo cấp số nhân
+# khi phát hiện bị giới hạn (429, trang "Sorry, this page isn't available", trang đăng nhập, challenge).
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+NOT_FOUND_MARKER = "Sorry, this page isn't available"
+
+
+def detect_block_reason(status_code: int | None = None, url: str = "", page_text: str = "") -> str | None:
+    """Nhận diện các dấu hiệu Instagram đang chặn / giới hạn. Trả về lý do hoặc None nếu phản hồi bình thường."""
+    if status_code == 429:
+        return "rate_limited"
+    if "/accounts/login" in (url or ""):
+        return "login_wall"
+    if "/challenge" in (url or "") or "/checkpoint" in (url or ""):
+        return "challenge"
+    if page_text and NOT_FOUND_MARKER in page_text:
+        return "page_unavailable"
+    return None
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket với tốc độ thay đổi theo kiểu AIMD:
+    - mỗi `increase_every` phản hồi tốt liên tiếp, tốc độ tăng thêm `increase_step` yêu cầu/phút;
+    - mỗi lần bị chặn thật sự (429, challenge, trang đăng nhập), tốc độ nhân với `decrease_factor` và tạm dừng
+      `backoff_base * 2^(n-1)` giây (tối đa `backoff_max`) với n là số lần bị chặn liên tiếp;
+    - các dấu hiệu không chắc chắn (hồ sơ "không tồn tại", lỗi khi cào) chỉ giảm nhẹ tốc độ theo `soft_decrease_factor`.
+    An toàn khi dùng từ nhiều thread và từ asyncio.
+    """
+
+    def __init__(self, rate_per_minute: float = 15, min_rate_per_minute: float = 2, max_rate_per_minute: float = 30,
+                 burst: int = 1, jitter: float = 0.3, increase_step: float = 1, increase_every: int = 5,
+                 decrease_factor: float = 0.5, soft_decrease_factor: float = 0.9, backoff_base: float = 30,
+                 backoff_max: float = 900):
+        self.rate = rate_per_minute
+        self.min_rate = min_rate_per_minute
+        self.max_rate = max_rate_per_minute
+        self.burst = max(1, burst)
+        self.jitter = jitter
+        self.increase_step = increase_step
+        self.increase_every = increase_every
+        self.decrease_factor = decrease_factor
+        self.soft_decrease_factor = soft_decrease_factor
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+        self._backoff_until = 0.0
+        self._consecutive_successes = 0
+        self._consecutive_blocks = 0
+        self.total_requests = 0
+        self.total_blocks = 0
+        self.events = deque(maxlen=20)  # (thời điểm, lý do, số giây tạm dừng, tốc độ mới)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            rate_per_minute=float(os.getenv("SCRAPE_RATE_PER_MINUTE", "15")),
+            min_rate_per_minute=float(os.getenv("SCRAPE_RATE_MIN_PER_MINUTE", "2")),
+            max_rate_per_minute=float(os.getenv("SCRAPE_RATE_MAX_PER_MINUTE", "30")),
+            soft_decrease_factor=float(os.getenv("SCRAPE_RATE_SOFT_DECREASE", "0.9")),
+            backoff_base=float(os.getenv("SCRAPE_BACKOFF_BASE_SECONDS", "30")),
+            backoff_max=float(os.getenv("SCRAPE_BACKOFF_MAX_SECONDS", "900")),
+        )
+
+    # ---------- Lấy lượt ----------
+
+    def reserve(self) -> float:
+        """Đặt trước một lượt gửi yêu cầu, trả về số giây cần chờ trước khi được gửi."""
+        with self._lock:
+            now = time.monotonic()
+            interval = 60.0 / self.rate
+            earliest = max(now - (self.burst - 1) * interval, self._backoff_until)
+            slot = max(self._next_slot, earliest)
+            self._next_slot = slot + interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+            self.total_requests += 1
+            return max(0.0, slot - now)
+
+    def acquire(self, stop_event: threading.Event | None = None) -> bool:
+        """Chờ tới lượt (chặn thread hiện tại). Trả về False nếu stop_event được bật trong lúc chờ."""
+        delay = self.reserve()
+        if stop_event is not None:
+            return not stop_event.wait(delay)
+        time.sleep(delay)
+        return True
+
+    async def acquire_async(self):
+        """Phiên bản asyncio của acquire()."""
+        await asyncio.sleep(self.reserve())
+
+    # ---------- Phản hồi ----------
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive_blocks = 0
+            self._consecutive_successes += 1
+            if self._consecutive_successes % self.increase_every == 0 and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def record_block(self, reason: str, severe: bool = True):
+        """
+        Ghi nhận một lần bị chặn. Nếu `severe`: giảm mạnh tốc độ (`decrease_factor`) và tạm dừng theo cấp số nhân;
+        nếu không (ví dụ hồ sơ đã bị xóa thật): chỉ giảm nhẹ tốc độ (`soft_decrease_factor`), không tạm dừng.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._consecutive_successes = 0
+            self.total_blocks += 1
+            factor = self.decrease_factor if severe else self.soft_decrease_factor
+            self.rate = max(self.min_rate, self.rate * factor)
+            delay = 0.0
+            if severe:
+                self._consecutive_blocks += 1
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (self._consecutive_blocks - 1))
+                delay *= random.uniform(1.0, 1.2)
+                self._backoff_until = max(self._backoff_until, now + delay)
+                self._next_slot = max(self._next_slot, self._backoff_until)
+            self.events.append((time.time(), reason, delay, self.rate))
+        if severe:
+            logger.warning(f"⚠️ Instagram giới hạn truy cập ({reason}): giảm tốc độ còn {self.rate:.1f} yêu cầu/phút, tạm dừng {delay:.0f} giây.")
+        else:
+            logger.info(f"Phản hồi bất thường ({reason}): giảm nhẹ tốc độ còn {self.rate:.1f} yêu cầu/phút.")
+
+    def record_response(self, status_code: int | None = None, url: str = "", page_text: str = "") -> str | None:
+        """Tự nhận diện phản hồi và ghi nhận thành công / bị chặn. Trả về lý do nếu bị chặn."""
+        reason = detect_block_reason(status_code, url, page_text)
+        if reason is None:
+            self.record_success()
+        else:
+            # Trang "không tồn tại" có thể là hồ sơ thật sự đã bị xóa, nên chỉ giảm nhẹ tốc độ, không tạm dừng
+            self.record_block(reason, severe=reason != "page_unavailable")
+        return reason
+
+    def snapshot(self) -> dict:
+        """Trạng thái hiện tại để theo dõi và tinh chỉnh."""
+        with self._lock:
+            return {
+                'rate_per_minute': self.rate,
+                'backoff_remaining': max(0.0, self._backoff_until - time.monotonic()),
+                'total_requests': self.total_requests,
+                'total_blocks': self.total_blocks,
+                'recent_events': list(self.events),
+            }
+
+
+# Bộ giới hạn dùng chung cho toàn bộ tiến trình
+limiter = AdaptiveRateLimiter.from_env()
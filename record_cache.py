@@ -0,0 +1,385 @@
+# File: record_cache.py
+# Module này giữ một bản sao trong bộ nhớ của dữ liệu Google Sheet để các lệnh của bot
+# không phải tải lại toàn bộ sheet mỗi lần được gọi.
+
+import logging
+import random
+import threading
+import time
+
+from search_index import NgramIndex
+
+logger = logging.getLogger(__name__)
+
+
+def parse_rating(value) -> float | None:
+    """Đọc giá trị rating dạng số trong một ô, trả về None nếu ô trống hoặc không hợp lệ."""
+    text = str(value).strip()
+    return float(text) if text.replace('.', '', 1).isdigit() else None
+
+
+class RatingStats:
+    """Các chỉ số rating được cộng dồn: số lượng, tổng và số tài liệu theo từng mức sao."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.histogram = {i: 0 for i in range(1, 6)}
+
+    def add(self, value, sign: int = 1):
+        rating = parse_rating(value)
+        if rating is None:
+            return
+        self.count += sign
+        self.total += sign * rating
+        star = int(round(rating))
+        if star in self.histogram:
+            self.histogram[star] += sign
+
+    def remove(self, value):
+        self.add(value, sign=-1)
+
+    @property
+    def average(self) -> float:
+        return self.total / self.count if self.count else 0
+
+
+class RatingBuckets:
+    """
+    Các bản ghi được chia nhóm theo giá trị rating. Mỗi nhóm là một danh sách, bản ghi bị xóa được thay chỗ
+    bằng phần tử cuối (swap-pop), nên thêm / xóa / lấy ngẫu nhiên đều là O(1).
+    """
+
+    def __init__(self):
+        self._buckets = {}  # rating (chuỗi) -> danh sách bản ghi
+        self._positions = {}  # id(bản ghi) -> (rating, vị trí trong danh sách, username chữ thường)
+
+    @staticmethod
+    def bucket_key(value) -> str:
+        return str(value).strip()
+
+    def add(self, record: dict, value, username: str | None = None):
+        key = self.bucket_key(value)
+        bucket = self._buckets.setdefault(key, [])
+        self._positions[id(record)] = (key, len(bucket), username)
+        bucket.append(record)
+
+    def remove(self, record: dict):
+        entry = self._positions.pop(id(record), None)
+        if entry is None:
+            return
+        key, position, _ = entry
+        bucket = self._buckets[key]
+        last = bucket.pop()
+        if last is not record:
+            bucket[position] = last
+            self._positions[id(last)] = (key, position, self._positions[id(last)][2])
+
+    def move(self, record: dict, value, username: str | None = None):
+        self.remove(record)
+        self.add(record, value, username)
+
+    def size(self, value) -> int:
+        return len(self._buckets.get(self.bucket_key(value), ()))
+
+    def members(self, value) -> list:
+        """Các bản ghi có rating `value` (không theo thứ tự hàng)."""
+        return list(self._buckets.get(self.bucket_key(value), ()))
+
+    def unseen(self, value=None, exclude=()) -> list:
+        """Các bản ghi có rating `value` (hoặc mọi bản ghi nếu value là None) có username không nằm trong `exclude`."""
+        buckets = [self._buckets.get(self.bucket_key(value), ())] if value is not None else self._buckets.values()
+        return [record for bucket in buckets for record in bucket if self._positions[id(record)][2] not in exclude]
+
+    def sample(self, value=None, weighted: bool = False):
+        """
+        Lấy ngẫu nhiên một bản ghi có rating `value` (hoặc trong tất cả các nhóm nếu value là None).
+        weighted=True: mỗi bản ghi có trọng số bằng rating của nó (bản ghi chưa có rating tính như 1 sao).
+        """
+        if value is not None:
+            bucket = self._buckets.get(self.bucket_key(value))
+            return random.choice(bucket) if bucket else None
+        keys = [key for key, bucket in self._buckets.items() if bucket]
+        if not keys:
+            return None
+        weights = [len(self._buckets[key]) * ((parse_rating(key) or 1) if weighted else 1) for key in keys]
+        bucket = self._buckets[random.choices(keys, weights=weights)[0]]
+        return random.choice(bucket)
+
+
+class RecordCache:
+    """
+    Bộ nhớ đệm dùng chung cho các bản ghi trong sheet.
+    Dữ liệu được tải một lần, tự làm mới sau `ttl` giây và được cập nhật ngay
+    khi chính bot ghi vào sheet (thêm, sửa, xóa hàng).
+    Kèm theo là chỉ mục username (chữ thường) -> số hàng để tra cứu trong O(1)
+    và chỉ mục n-gram để tìm kiếm theo username / tên đầy đủ.
+    Nếu có `rating_field`, các chỉ số rating (RatingStats) và các nhóm theo rating để lấy ngẫu nhiên (RatingBuckets)
+    cũng được duy trì liên tục.
+    """
+
+    def __init__(self, loader, key_func, ttl: float = 300, search_fields: tuple = (), rating_field: str | None = None,
+                 delta_loader=None):
+        # loader: hàm trả về danh sách các hàng (hàng đầu tiên là tiêu đề), giống worksheet.get_all_values()
+        # delta_loader: (tùy chọn) hàm trả về (các hàng mới ở cuối, {số hàng: hàng đã sửa}) kể từ lần tải trước,
+        #   hoặc None nếu cần tải lại toàn bộ
+        # key_func: hàm lấy username từ một bản ghi (trả về None nếu không có)
+        # search_fields: các cột được đưa vào chỉ mục tìm kiếm cùng với username
+        self._loader = loader
+        self._delta_loader = delta_loader
+        self._key_func = key_func
+        self._search_fields = tuple(search_fields)
+        self._search_index = NgramIndex()
+        self._rating_field = rating_field
+        self._rating_stats = RatingStats()
+        self._rating_buckets = RatingBuckets()
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        # Chỉ một lần tải / đồng bộ được chạy tại một thời điểm: hai lần đồng bộ song song sẽ cùng thấy
+        # các hàng mới so với một ảnh chụp cũ và thêm chúng hai lần. Khóa riêng để việc đọc không phải chờ mạng.
+        self._sync_lock = threading.RLock()
+        self.headers = []
+        self._records = []
+        self._keys = []  # username (chữ thường) của từng hàng, song song với _records
+        self._row_by_username = {}
+        self._loaded_at = None
+        self.version = 0
+
+    # ---------- Tải dữ liệu ----------
+
+    def is_stale(self) -> bool:
+        """Kiểm tra dữ liệu đã hết hạn (hoặc chưa từng được tải) hay chưa."""
+        with self._lock:
+            return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
+
+    def reload(self):
+        """Tải lại toàn bộ dữ liệu từ sheet."""
+        with self._sync_lock:
+            all_values = self._loader()
+            with self._lock:
+                self.headers = list(all_values[0]) if all_values else []
+                self._records = [self._row_to_record(row) for row in all_values[1:]]
+                self._rebuild_index()
+                self._rebuild_rating_stats()
+                self._loaded_at = time.monotonic()
+                self.version += 1
+                logger.info(f"Đã tải {len(self._records)} bản ghi vào bộ nhớ đệm.")
+
+    def sync(self):
+        """Làm mới dữ liệu, chỉ áp dụng phần thay đổi nếu delta_loader xác định được; nếu không thì tải lại toàn bộ."""
+        with self._sync_lock:
+            changes = None
+            if self._delta_loader is not None and self._loaded_at is not None:
+                changes = self._delta_loader()
+            if changes is None:
+                self.reload()
+                return
+            appended_rows, updated_rows = changes
+            with self._lock:
+                for row_index, row in updated_rows.items():
+                    self.update_row(row_index, self._row_to_record(row))
+                for row in appended_rows:
+                    self.append_row(row)
+                self._loaded_at = time.monotonic()
+
+    def ensure_fresh(self):
+        """Chỉ làm mới khi dữ liệu đã hết hạn; các lời gọi đồng thời chờ và dùng chung một lần làm mới."""
+        if self.is_stale():
+            with self._sync_lock:
+                # Kiểm tra lại: một thread khác có thể vừa làm mới xong trong lúc chờ khóa
+                if self.is_stale():
+                    self.sync()
+
+    def records(self) -> list:
+        """Trả về danh sách bản ghi hiện tại (tự làm mới nếu hết hạn)."""
+        self.ensure_fresh()
+        with self._lock:
+            return list(self._records)
+
+    def _key(self, record: dict) -> str | None:
+        key = self._key_func(record)
+        return key.lower() if key else None
+
+    def _rebuild_index(self):
+        self._keys = [self._key(record) for record in self._records]
+        self._row_by_username = {}
+        self._search_index.clear()
+        for position, key in enumerate(self._keys):
+            if key and key not in self._row_by_username:
+                # Nếu có username trùng lặp, giữ hàng xuất hiện đầu tiên như cách tìm tuần tự trước đây
+                self._row_by_username[key] = position + 2
+                self._index_for_search(key, self._records[position])
+
+    def _rebuild_rating_stats(self):
+        self._rating_stats = RatingStats()
+        self._rating_buckets = RatingBuckets()
+        # Dùng username đã tính trong _rebuild_index (gọi trước hàm này)
+        for record, key in zip(self._records, self._keys):
+            if self._rating_field:
+                self._rating_stats.add(record.get(self._rating_field, ''))
+            self._rating_buckets.add(record, record.get(self._rating_field, ''), key)
+
+    def _index_for_search(self, key: str, record: dict):
+        full_name = " ".join(str(record.get(field, "")) for field in self._search_fields)
+        self._search_index.add(key, key, full_name)
+
+    def _row_to_record(self, row) -> dict:
+        row = list(row) + [''] * (len(self.headers) - len(row))
+        return {header: value for header, value in zip(self.headers, row) if header}
+
+    # ---------- Tra cứu theo username ----------
+
+    def find(self, username: str):
+        """Trả về (số hàng, bản ghi) của username, hoặc (None, None) nếu không có."""
+        self.ensure_fresh()
+        with self._lock:
+            row_index = self._row_by_username.get(username.lower())
+            if row_index is None:
+                return None, None
+            return row_index, self._records[row_index - 2]
+
+    def has_username(self, username: str) -> bool:
+        """Kiểm tra username đã tồn tại trong sheet hay chưa."""
+        self.ensure_fresh()
+        with self._lock:
+            return username.lower() in self._row_by_username
+
+    def search(self, query: str) -> list:
+        """Tìm các bản ghi có username hoặc tên đầy đủ chứa `query` (không phân biệt dấu), xếp theo mức độ khớp."""
+        self.ensure_fresh()
+        with self._lock:
+            return [self._records[self._row_by_username[key] - 2] for key in self._search_index.search(query)]
+
+    def search_keys(self, query: str) -> list:
+        """Như search() nhưng chỉ trả về username (chữ thường) của các kết quả, theo cùng thứ tự."""
+        self.ensure_fresh()
+        with self._lock:
+            return list(self._search_index.search(query))
+
+    def rating_keys(self, rating) -> list:
+        """Username (chữ thường) của các tài liệu có rating `rating`, theo thứ tự hàng, lấy từ nhóm rating (không duyệt lại dữ liệu)."""
+        self.ensure_fresh()
+        with self._lock:
+            bucket_key = RatingBuckets.bucket_key(rating)
+            rows = set()
+            for record in self._rating_buckets.members(rating):
+                row_index = self._row_by_username.get(self._key(record))
+                # Username trùng lặp: chỉ tính hàng đầu tiên (hàng được dùng khi tra cứu), nếu nó có đúng rating này
+                if row_index is not None and RatingBuckets.bucket_key(self._records[row_index - 2].get(self._rating_field, '')) == bucket_key:
+                    rows.add(row_index)
+            return [self._keys[row_index - 2] for row_index in sorted(rows)]
+
+    def records_for(self, keys) -> list:
+        """Bản ghi của từng username trong `keys` (bỏ qua username không còn tồn tại)."""
+        with self._lock:
+            return [self._records[self._row_by_username[key] - 2] for key in keys if key in self._row_by_username]
+
+    def stats(self):
+        """Trả về (tổng số tài liệu, rating trung bình, số tài liệu theo từng mức sao) mà không cần duyệt lại dữ liệu."""
+        self.ensure_fresh()
+        with self._lock:
+            return len(self._records), self._rating_stats.average, dict(self._rating_stats.histogram)
+
+    def count_rating(self, rating) -> int:
+        """Số tài liệu có rating đúng bằng `rating`."""
+        self.ensure_fresh()
+        with self._lock:
+            return self._rating_buckets.size(rating)
+
+    def random_record(self, rating=None, weighted: bool = False, exclude=(), attempts: int = 8):
+        """
+        Lấy ngẫu nhiên một bản ghi (có rating `rating` nếu được chỉ định) mà không duyệt lại dữ liệu.
+        exclude: các username (chữ thường) không muốn lấy lại; trả về None nếu không còn bản ghi nào phù hợp.
+        """
+        self.ensure_fresh()
+        with self._lock:
+            for _ in range(attempts):
+                record = self._rating_buckets.sample(rating, weighted=weighted)
+                if record is None or self._key(record) not in exclude:
+                    return record
+            # Hầu hết bản ghi đã bị loại trừ: chọn trong số còn lại của nhóm (chỉ duyệt nhóm rating, username đã có sẵn)
+            candidates = self._rating_buckets.unseen(rating, exclude)
+            return random.choice(candidates) if candidates else None
+
+    # ---------- Cập nhật sau khi bot ghi vào sheet ----------
+
+    def apply_write(self, write, patch):
+        """
+        Ghi vào nơi lưu dữ liệu bằng `write()` rồi cập nhật bộ nhớ đệm bằng `patch(kết quả của write)`, giữ khóa
+        đồng bộ suốt cả hai bước: một lần reload()/sync() chen vào giữa sẽ đọc được thay đổi vừa ghi, và việc
+        cập nhật lại một lần nữa sẽ làm lệch số hàng (xóa thêm một hàng, thêm trùng hàng).
+        """
+        with self._sync_lock:
+            result = write()
+            patch(result)
+            return result
+
+    def append_row(self, row: list) -> int:
+        """Ghi nhận một hàng vừa được thêm vào cuối sheet. Trả về chỉ số hàng trong sheet."""
+        with self._lock:
+            record = self._row_to_record(row)
+            self._records.append(record)
+            if self._rating_field:
+                self._rating_stats.add(record.get(self._rating_field, ''))
+            key = self._key(record)
+            self._rating_buckets.add(record, record.get(self._rating_field, ''), key)
+            row_index = len(self._records) + 1
+            self._keys.append(key)
+            if key and key not in self._row_by_username:
+                self._row_by_username[key] = row_index
+                self._index_for_search(key, record)
+            self.version += 1
+            return row_index
+
+    def update_row(self, row_index: int, fields: dict):
+        """Ghi nhận việc cập nhật một số ô của hàng `row_index` (đánh số như trên sheet)."""
+        with self._lock:
+            position = row_index - 2
+            if 0 <= position < len(self._records):
+                record = self._records[position]
+                if self._rating_field in fields:
+                    self._rating_stats.remove(record.get(self._rating_field, ''))
+                    self._rating_stats.add(fields[self._rating_field])
+                record.update(fields)
+                key = self._keys[position]
+                new_key = self._key(record)
+                if self._rating_field in fields or new_key != key:
+                    self._rating_buckets.move(record, record.get(self._rating_field, ''), new_key)
+                if new_key != key:
+                    # URL của hàng thay đổi: dựng lại chỉ mục cho đơn giản (trường hợp hiếm)
+                    self._rebuild_index()
+                elif key and self._row_by_username.get(key) == row_index and any(f in fields for f in self._search_fields):
+                    # Ví dụ: scraper vừa điền tên đầy đủ cho hàng này
+                    self._index_for_search(key, record)
+                self.version += 1
+
+    def delete_row(self, row_index: int):
+        """Ghi nhận việc xóa hàng `row_index`; các hàng bên dưới sẽ dịch lên một hàng."""
+        with self._lock:
+            position = row_index - 2
+            if 0 <= position < len(self._records):
+                removed_record = self._records.pop(position)
+                if self._rating_field:
+                    self._rating_stats.remove(removed_record.get(self._rating_field, ''))
+                self._rating_buckets.remove(removed_record)
+                removed_key = self._keys.pop(position)
+                if removed_key and self._row_by_username.get(removed_key) == row_index:
+                    del self._row_by_username[removed_key]
+                    self._search_index.remove(removed_key)
+                else:
+                    removed_key = None
+                # worksheet.delete_rows làm các hàng bên dưới dịch lên một hàng,
+                # nên chỉ những mục trỏ tới các hàng đó cần giảm đi 1
+                for offset in range(len(self._keys) - position):
+                    key = self._keys[position + offset]
+                    if not key:
+                        continue
+                    current_row = row_index + offset
+                    if self._row_by_username.get(key) == current_row + 1:
+                        self._row_by_username[key] = current_row
+                    elif key == removed_key:
+                        # Hàng trùng username với hàng vừa xóa trở thành hàng đầu tiên của username đó
+                        self._row_by_username[key] = current_row
+                        self._index_for_search(key, self._records[position + offset])
+                        removed_key = None
+                self.version += 1
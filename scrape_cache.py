@@ -0,0 +1,98 @@
+# File: scrape_cache.py
+# Bộ nhớ đệm trên đĩa (SQLite) cho kết quả cào dữ liệu theo username, tồn tại qua các lần khởi động lại.
+# Mỗi loại kết quả có thời hạn riêng: thành công được giữ lâu, lỗi chỉ được giữ ngắn để sớm thử lại.
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+OUTCOME_OK = "ok"
+OUTCOME_NOT_FOUND = "not_found"
+OUTCOME_ERROR = "error"
+
+
+def outcome_of(result: dict) -> str:
+    """Phân loại một kết quả của scraper."""
+    full_name = result.get('full_name')
+    if full_name == "Not Found":
+        return OUTCOME_NOT_FOUND
+    if full_name == "Scrape Error" or not full_name:
+        return OUTCOME_ERROR
+    return OUTCOME_OK
+
+
+class ScrapeCache:
+    """Lưu (full_name, profile_pic_url, loại kết quả, thời điểm cào) cho từng username."""
+
+    def __init__(self, path: str, ttls: dict | None = None):
+        self.path = path
+        self.ttls = ttls or {
+            OUTCOME_OK: 7 * 24 * 3600,
+            OUTCOME_NOT_FOUND: 24 * 3600,
+            OUTCOME_ERROR: 30 * 60,
+        }
+        self._lock = threading.Lock()
+        self._conn = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.getenv("SCRAPE_CACHE_FILE", "scrape_cache.sqlite3"),
+            ttls={
+                OUTCOME_OK: float(os.getenv("SCRAPE_CACHE_TTL_OK", str(7 * 24 * 3600))),
+                OUTCOME_NOT_FOUND: float(os.getenv("SCRAPE_CACHE_TTL_NOT_FOUND", str(24 * 3600))),
+                OUTCOME_ERROR: float(os.getenv("SCRAPE_CACHE_TTL_ERROR", str(30 * 60))),
+            },
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        # Mở kết nối ở lần dùng đầu tiên; dùng chung giữa các thread và được bảo vệ bằng _lock
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS scrape_results ("
+                " username TEXT PRIMARY KEY,"
+                " outcome TEXT NOT NULL,"
+                " full_name TEXT,"
+                " profile_pic_url TEXT,"
+                " scraped_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get(self, username: str) -> dict | None:
+        """Trả về kết quả còn hạn của username (full_name, profile_pic_url, outcome), hoặc None."""
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT outcome, full_name, profile_pic_url, scraped_at FROM scrape_results WHERE username = ?",
+                (username.lower(),),
+            ).fetchone()
+        if row is None:
+            return None
+        outcome, full_name, profile_pic_url, scraped_at = row
+        if time.time() - scraped_at > self.ttls.get(outcome, 0):
+            return None
+        return {'full_name': full_name, 'profile_pic_url': profile_pic_url or "", 'outcome': outcome}
+
+    def put(self, username: str, result: dict):
+        """Lưu kết quả mới nhất của username."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO scrape_results (username, outcome, full_name, profile_pic_url, scraped_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (username.lower(), outcome_of(result), result.get('full_name'), result.get('profile_pic_url'), time.time()),
+            )
+            conn.commit()
+
+
+# Bộ nhớ đệm dùng chung cho toàn bộ tiến trình
+scrape_cache = ScrapeCache.from_env()
@@ -3,21 +3,25 @@
 # và tải ảnh đại diện lên Cloudinary để có URL vĩnh viễn.
 
 import logging
+import hashlib
+import io
+import json
 import time
 import random
 import re
 import os
 import pickle
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
-import cloudinary
-import cloudinary.uploader
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+from rate_limiter import detect_block_reason, limiter
+from scrape_cache import scrape_cache
+
+# selenium và cloudinary khá nặng nên chỉ được import khi thực sự cào dữ liệu / tải ảnh.
 # Bỏ import webdriver_manager vì không còn sử dụng
 # from webdriver_manager.chrome import ChromeDriverManager
 
@@ -26,13 +30,72 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-# --- CẤU HÌNH CLOUDINARY TỪ BIẾN MÔI TRƯỜDNG ---
-cloudinary.config(
-  cloud_name = os.getenv("CLOUDINARY_CLOUD_NAME"),
-  api_key = os.getenv("CLOUDINARY_API_KEY"),
-  api_secret = os.getenv("CLOUDINARY_API_SECRET"),
-  secure = True
-)
+# Số trình duyệt headless chạy song song khi cào dữ liệu
+SCRAPER_WORKERS = int(os.getenv("SCRAPER_WORKERS", "1"))
+# Engine cào dữ liệu: "selenium" (mặc định) hoặc "http" (HTTP trực tiếp, chỉ dùng Selenium khi bị chặn)
+SCRAPER_ENGINE = os.getenv("SCRAPER_ENGINE", "selenium").lower()
+HTTP_SCRAPER_CONCURRENCY = int(os.getenv("HTTP_SCRAPER_CONCURRENCY", "2"))
+# Số lần gửi lại qua HTTP (sau khi tạm dừng) khi Instagram trả về 429 trước khi coi hồ sơ là lỗi
+HTTP_SCRAPER_MAX_RETRIES = int(os.getenv("HTTP_SCRAPER_MAX_RETRIES", "3"))
+# Số luồng tải ảnh lên Cloudinary chạy song song và số ảnh tối đa được xếp hàng chờ tải
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "3"))
+UPLOAD_QUEUE_SIZE = int(os.getenv("UPLOAD_QUEUE_SIZE", "20"))
+# File lưu mã băm của ảnh đại diện đã tải lên Cloudinary, dùng để bỏ qua các ảnh không thay đổi
+AVATAR_MANIFEST_FILE = os.getenv("AVATAR_MANIFEST_FILE", "avatar_manifest.json")
+# Chế độ "lean": page load strategy "eager", chặn ảnh/video/font qua CDP và đọc thẻ og: bằng một lần execute_script
+SCRAPER_LEAN_MODE = os.getenv("SCRAPER_LEAN_MODE", "").lower() in ("1", "true", "yes")
+# Các loại tài nguyên bị chặn trong chế độ lean (không cần thiết để đọc tên và URL ảnh đại diện)
+LEAN_BLOCKED_URLS = [
+    "*.jpg", "*.jpeg", "*.png", "*.gif", "*.webp", "*.heic", "*.svg", "*.ico",
+    "*.mp4", "*.m4a", "*.m4v", "*.webm",
+    "*.woff", "*.woff2", "*.ttf", "*.otf",
+]
+# Địa chỉ gốc của Instagram (có thể trỏ tới server giả lập khi kiểm thử)
+INSTAGRAM_BASE_URL = os.getenv("INSTAGRAM_BASE_URL", "https://www.instagram.com").rstrip("/")
+
+# --- CẤU HÌNH CLOUDINARY TỪ BIẾN MÔI TRƯỜDNG (thực hiện ở lần tải ảnh đầu tiên) ---
+_cloudinary_configured = False
+_cloudinary_lock = threading.Lock()
+
+def get_cloudinary_uploader():
+    """Import và cấu hình Cloudinary ở lần dùng đầu tiên."""
+    global _cloudinary_configured
+    import cloudinary
+    import cloudinary.uploader
+    with _cloudinary_lock:
+        if not _cloudinary_configured:
+            cloudinary.config(
+              cloud_name = os.getenv("CLOUDINARY_CLOUD_NAME"),
+              api_key = os.getenv("CLOUDINARY_API_KEY"),
+              api_secret = os.getenv("CLOUDINARY_API_SECRET"),
+              secure = True
+            )
+            _cloudinary_configured = True
+    return cloudinary.uploader
+
+class StageStats:
+    """Thống kê thời gian của từng giai đoạn (pacing, navigate, extract, download, upload) để so sánh các chế độ cào."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            count, total = self._stats.get(stage, (0, 0.0))
+            self._stats[stage] = (count + 1, total + seconds)
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def summary(self) -> dict:
+        """Trả về {giai đoạn: {'count', 'total', 'avg'}} (thời gian tính bằng giây)."""
+        with self._lock:
+            return {stage: {'count': count, 'total': total, 'avg': total / count}
+                    for stage, (count, total) in self._stats.items()}
+
+stage_stats = StageStats()
 
 def extract_username(url: str) -> str | None:
     """Trích xuất username từ URL Instagram."""
@@ -40,34 +103,134 @@ def extract_username(url: str) -> str | None:
     match = re.search(r"(?:https?://)?(?:www\.)?instagram\.com/([A-Za-z0-9_](?:(?:[A-Za-z0-9_]|\.(?!\.))*[A-Za-z0-9_]){0,29})", url)
     return match.group(1) if match else None
 
+# Session dùng chung để tái sử dụng kết nối khi tải ảnh đại diện từ CDN
+_http_session = requests.Session()
+_http_session.mount("https://", HTTPAdapter(pool_connections=UPLOAD_WORKERS, pool_maxsize=UPLOAD_WORKERS))
+_http_session.mount("http://", HTTPAdapter(pool_connections=UPLOAD_WORKERS, pool_maxsize=UPLOAD_WORKERS))
+
+class AvatarManifest:
+    """
+    Danh sách các ảnh đại diện đã tải lên: username -> mã băm nội dung, ETag / Last-Modified của CDN
+    và secure_url trên Cloudinary. Được lưu ra file JSON để dùng lại giữa các lần chạy.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    self._entries = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self._entries = {}
+        return self._entries
+
+    def get(self, username: str) -> dict | None:
+        with self._lock:
+            entry = self._load().get(username.lower())
+            return dict(entry) if entry else None
+
+    def set(self, username: str, entry: dict):
+        with self._lock:
+            self._load()[username.lower()] = entry
+            # Ghi ra file tạm rồi đổi tên để file không bị hỏng nếu bot dừng giữa chừng
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+avatar_manifest = AvatarManifest(AVATAR_MANIFEST_FILE)
+
 def upload_image_to_cloudinary(image_url: str, public_id: str):
     """
     Tải ảnh từ một URL và đẩy lên Cloudinary.
+    Nếu ảnh không thay đổi so với lần tải trước (CDN trả về 304, hoặc trùng mã băm nội dung),
+    dùng lại secure_url cũ thay vì tải lên lần nữa.
     """
     if not image_url:
         return None
     try:
-        response = requests.get(image_url, stream=True, timeout=20)
+        entry = avatar_manifest.get(public_id)
+        headers = {}
+        if entry and entry.get('secure_url'):
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        started = time.perf_counter()
+        response = _http_session.get(image_url, headers=headers, timeout=20)
+        content = response.content
+        stage_stats.record("download", time.perf_counter() - started)
+        if response.status_code == 304 and entry:
+            logger.info(f"Ảnh đại diện của {public_id} không thay đổi (304), dùng lại URL cũ.")
+            return entry['secure_url']
         response.raise_for_status()
+
+        content_hash = hashlib.sha256(content).hexdigest()
+        new_entry = {
+            'hash': content_hash,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+        if entry and entry.get('hash') == content_hash and entry.get('secure_url'):
+            logger.info(f"Ảnh đại diện của {public_id} không thay đổi (trùng mã băm), bỏ qua việc tải lên.")
+            avatar_manifest.set(public_id, {**new_entry, 'secure_url': entry['secure_url']})
+            return entry['secure_url']
         
-        upload_result = cloudinary.uploader.upload(
-            response.raw,
+        started = time.perf_counter()
+        upload_result = get_cloudinary_uploader().upload(
+            io.BytesIO(content),
             public_id=f"instagram_profiles/{public_id}",
             overwrite=True,
             resource_type="image"
         )
-        return upload_result.get('secure_url')
+        stage_stats.record("upload", time.perf_counter() - started)
+        secure_url = upload_result.get('secure_url')
+        if secure_url:
+            avatar_manifest.set(public_id, {**new_entry, 'secure_url': secure_url})
+        return secure_url
     except Exception as e:
         logger.error(f"Lỗi khi tải ảnh lên Cloudinary cho {public_id}: {e}")
         return None
 
-def scrape_instagram_profiles(cookie_file_path: str, profiles_to_scrape: list):
+class UploadStage:
     """
-    Hàm chính để cào dữ liệu bằng Selenium và tải ảnh lên Cloudinary.
+    Nhóm luồng nền tải ảnh lên Cloudinary, tách biệt khỏi trình duyệt.
+    Hàng đợi có giới hạn: submit() sẽ chờ nếu đã có quá `queue_size` ảnh đang chờ tải.
     """
-    if not os.path.exists(cookie_file_path):
-        logger.error(f"Không tìm thấy file cookie tại '{cookie_file_path}'. Hãy tạo và tải nó lên.")
-        return None
+
+    def __init__(self, workers: int = UPLOAD_WORKERS, queue_size: int = UPLOAD_QUEUE_SIZE):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload")
+        self._slots = threading.BoundedSemaphore(max(queue_size, workers))
+
+    def submit(self, image_url: str, public_id: str, on_done):
+        """Xếp một ảnh vào hàng đợi tải lên; on_done(secure_url hoặc None) được gọi khi xong."""
+        self._slots.acquire()
+
+        def _run():
+            try:
+                secure_url = upload_image_to_cloudinary(image_url, public_id)
+            except Exception as e:
+                logger.error(f"Lỗi khi tải ảnh lên Cloudinary cho {public_id}: {e}")
+                secure_url = None
+            finally:
+                self._slots.release()
+            on_done(secure_url)
+
+        self._executor.submit(_run)
+
+    def close(self):
+        """Chờ tất cả ảnh trong hàng đợi tải xong."""
+        self._executor.shutdown(wait=True)
+
+def create_driver(cookie_file_path: str, lean: bool | None = None):
+    """Khởi động một trình duyệt Chrome headless và nạp cookie đăng nhập Instagram."""
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
 
     # --- Cấu hình Selenium để chạy ở chế độ headless ---
     options = webdriver.ChromeOptions()
@@ -75,81 +238,350 @@ def scrape_instagram_profiles(cookie_file_path: str, profiles_to_scrape: list):
     options.add_argument("--no-sandbox")
     options.add_argument("--disable-dev-shm-usage")
     options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36")
+    lean = SCRAPER_LEAN_MODE if lean is None else lean
+    if lean:
+        # Không chờ ảnh / iframe tải xong, chỉ cần DOM đã sẵn sàng
+        options.page_load_strategy = "eager"
+        options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
 
     # Trỏ trực tiếp đến chromedriver đã cài đặt trên hệ thống (dành cho Raspberry Pi)
     chromedriver_path = "/usr/bin/chromedriver"
     service = Service(executable_path=chromedriver_path)
     driver = webdriver.Chrome(service=service, options=options)
+    if lean:
+        # Chặn media và font ngay ở tầng mạng của Chrome
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": LEAN_BLOCKED_URLS})
+    driver.lean_mode = lean
     
     # Tải cookie để đăng nhập
-    driver.get("https://www.instagram.com/")
+    driver.get(f"{INSTAGRAM_BASE_URL}/")
     cookies = pickle.load(open(cookie_file_path, "rb"))
     for cookie in cookies:
         driver.add_cookie(cookie)
     
-    logger.info("✅ Trình duyệt Selenium (headless) đã khởi động và tải cookie thành công.")
+    logger.info(f"✅ Trình duyệt Selenium (headless{', lean' if lean else ''}) đã khởi động và tải cookie thành công.")
+    return driver
+
+# Đọc title, og:title, og:image và dấu hiệu trang không tồn tại trong một lần gọi
+_LEAN_EXTRACT_SCRIPT = """
+const meta = (p) => { const el = document.querySelector(`meta[property="${p}"]`); return el ? el.content : null; };
+return {
+    title: document.title,
+    og_title: meta("og:title"),
+    og_image: meta("og:image"),
+    not_found: !!(document.body && document.body.innerText.includes("Sorry, this page isn't available")),
+};
+"""
+
+def _extract_profile_lean(driver, username: str):
+    """Chế độ lean: chờ tới khi og:title chứa @username (hoặc trang báo không tồn tại) rồi trả về (full_name, ảnh gốc)."""
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    def _ready(d):
+        data = d.execute_script(_LEAN_EXTRACT_SCRIPT)
+        if data.get("not_found") or f"@{username}" in (data.get("og_title") or data.get("title") or ""):
+            return data
+        return False
+
+    data = WebDriverWait(driver, 15, poll_frequency=0.25).until(_ready)
+    if data.get("not_found"):
+        return "Not Found", ""
+    title = data.get("og_title") or data.get("title") or ""
+    match = re.search(r'^(.*?)\s+\(@', title)
+    full_name = match.group(1).strip() if match else ""
+    return full_name or username, data.get("og_image") or ""
+
+def scrape_single_profile(driver, profile_info: dict, upload: bool = True):
+    """
+    Cào dữ liệu cho một hồ sơ bằng trình duyệt đã đăng nhập.
+    Trả về dict kết quả (row_index, full_name, profile_pic_url) hoặc None nếu URL không hợp lệ.
+    Với upload=False, profile_pic_url là URL gốc và việc tải ảnh lên Cloudinary do bên gọi đảm nhận.
+    """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
+    url = profile_info.get('url')
+    username_to_scrape = extract_username(url)
+
+    if not username_to_scrape:
+        logger.warning(f"Bỏ qua URL không hợp lệ: {url}")
+        return None
 
-    results = []
     try:
-        for profile_info in profiles_to_scrape:
-            url = profile_info.get('url')
-            username_to_scrape = extract_username(url)
+        logger.info(f"Đang cào dữ liệu cho: {username_to_scrape}")
+        started = time.perf_counter()
+        driver.get(f"{INSTAGRAM_BASE_URL}/{username_to_scrape}/")
+        stage_stats.record("navigate", time.perf_counter() - started)
+        started = time.perf_counter()
 
-            if not username_to_scrape:
-                logger.warning(f"Bỏ qua URL không hợp lệ: {url}")
-                continue
+        if getattr(driver, "lean_mode", False):
+            full_name, original_pic_url = _extract_profile_lean(driver, username_to_scrape)
+            stage_stats.record("extract", time.perf_counter() - started)
+            if full_name == "Not Found":
+                return {'row_index': profile_info['row_index'], 'full_name': "Not Found", 'profile_pic_url': ""}
+            cloudinary_pic_url = upload_image_to_cloudinary(original_pic_url, username_to_scrape) if upload else None
+            return {
+                'row_index': profile_info['row_index'],
+                'full_name': full_name.strip() or username_to_scrape,
+                'profile_pic_url': cloudinary_pic_url or original_pic_url or "",
+            }
+        
+        wait = WebDriverWait(driver, 15)
+
+        # 1. Lấy ảnh đại diện
+        original_pic_url = None
+        try:
+            img_element = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, 'header img')))
+            original_pic_url = img_element.get_attribute('src')
+        except Exception as img_error:
+            logger.warning(f"Không thể lấy ảnh cho {username_to_scrape}. Lỗi: {img_error}")
+
+        # 2. Lấy tên đầy đủ từ thẻ <title> của trang - cách này ổn định hơn
+        full_name = username_to_scrape # Giá trị mặc định
+        try:
+            # Chờ cho đến khi tiêu đề chứa username để đảm bảo trang đã tải đúng
+            wait.until(EC.title_contains(f"@{username_to_scrape}"))
+            page_title = driver.title
+            # Mẫu regex: Lấy tất cả nội dung trước chuỗi " (@username)"
+            match = re.search(r'^(.*?)\s+\(@', page_title)
+            if match:
+                extracted_name = match.group(1).strip()
+                if extracted_name: # Đảm bảo tên không rỗng
+                    full_name = extracted_name
+        except Exception as title_error:
+            logger.warning(f"Không thể lấy tên từ title cho {username_to_scrape}, sử dụng username thay thế. Lỗi: {title_error}")
+        stage_stats.record("extract", time.perf_counter() - started)
 
+        # 3. Tải ảnh lên Cloudinary
+        cloudinary_pic_url = None
+        if upload:
+            logger.info(f"Đang tải ảnh đại diện của {username_to_scrape} lên Cloudinary...")
+            cloudinary_pic_url = upload_image_to_cloudinary(original_pic_url, username_to_scrape)
+        
+        return {
+            'row_index': profile_info['row_index'],
+            'full_name': full_name.strip() or username_to_scrape,
+            'profile_pic_url': cloudinary_pic_url or original_pic_url or "",
+        }
+
+    except Exception as e:
+        logger.error(f"Lỗi không xác định khi cào dữ liệu cho {username_to_scrape}: {e}")
+        if "Sorry, this page isn't available" in driver.page_source:
+            return {'row_index': profile_info['row_index'], 'full_name': "Not Found", 'profile_pic_url': ""}
+        return {'row_index': profile_info['row_index'], 'full_name': "Scrape Error", 'profile_pic_url': ""}
+
+class ScraperUnavailable(Exception):
+    """Không thể bắt đầu cào dữ liệu (thiếu file cookie hoặc không khởi động được trình duyệt)."""
+
+def _scrape_worker(worker_id: int, cookie_file_path: str, work_queue: queue.Queue, on_result, started: list, stop_event: threading.Event):
+    """Một worker: giữ một trình duyệt riêng và lần lượt lấy hồ sơ từ hàng đợi chung."""
+    # Giãn thời điểm khởi động để các trình duyệt không cùng lúc truy cập Instagram
+    if worker_id and stop_event.wait(random.uniform(1.0, 3.0) * worker_id):
+        return
+    # Mượn trình duyệt "ấm" từ nhóm dùng chung thay vì khởi động Chrome mới cho mỗi lần cào
+    from browser_service import browser_pool
+    service = browser_pool.checkout()
+    try:
+        service.get_driver(cookie_file_path)
+    except Exception as e:
+        logger.error(f"[worker {worker_id}] Không thể khởi động trình duyệt: {e}")
+        browser_pool.checkin(service)
+        return
+    started.append(worker_id)
+
+    try:
+        while not stop_event.is_set():
             try:
-                logger.info(f"Đang cào dữ liệu cho: {username_to_scrape}")
-                driver.get(f"https://www.instagram.com/{username_to_scrape}/")
-                
-                wait = WebDriverWait(driver, 15)
-
-                # 1. Lấy ảnh đại diện
-                original_pic_url = None
-                try:
-                    img_element = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, 'header img')))
-                    original_pic_url = img_element.get_attribute('src')
-                except Exception as img_error:
-                    logger.warning(f"Không thể lấy ảnh cho {username_to_scrape}. Lỗi: {img_error}")
-
-                # 2. Lấy tên đầy đủ từ thẻ <title> của trang - cách này ổn định hơn
-                full_name = username_to_scrape # Giá trị mặc định
-                try:
-                    # Chờ cho đến khi tiêu đề chứa username để đảm bảo trang đã tải đúng
-                    wait.until(EC.title_contains(f"@{username_to_scrape}"))
-                    page_title = driver.title
-                    # Mẫu regex: Lấy tất cả nội dung trước chuỗi " (@username)"
-                    match = re.search(r'^(.*?)\s+\(@', page_title)
-                    if match:
-                        extracted_name = match.group(1).strip()
-                        if extracted_name: # Đảm bảo tên không rỗng
-                            full_name = extracted_name
-                except Exception as title_error:
-                    logger.warning(f"Không thể lấy tên từ title cho {username_to_scrape}, sử dụng username thay thế. Lỗi: {title_error}")
-
-                # 3. Tải ảnh lên Cloudinary
-                logger.info(f"Đang tải ảnh đại diện của {username_to_scrape} lên Cloudinary...")
-                cloudinary_pic_url = upload_image_to_cloudinary(original_pic_url, username_to_scrape)
-                
-                results.append({
-                    'row_index': profile_info['row_index'],
-                    'full_name': full_name.strip() or username_to_scrape,
-                    'profile_pic_url': cloudinary_pic_url or original_pic_url or "",
-                })
-                
-                sleep_time = random.uniform(3.0, 6.0)
-                logger.debug(f"Nghỉ {sleep_time:.2f} giây...")
-                time.sleep(sleep_time)
+                position, profile_info = work_queue.get_nowait()
+            except queue.Empty:
+                break
+            if not extract_username(profile_info.get('url')):
+                logger.warning(f"Bỏ qua URL không hợp lệ: {profile_info.get('url')}")
+                continue
+            try:
+                # Kiểm tra sức khỏe, thay mới hoặc khởi động lại trình duyệt nếu cần
+                driver = service.get_driver(cookie_file_path)
+            except Exception as e:
+                logger.error(f"[worker {worker_id}] Không thể khởi động lại trình duyệt: {e}")
+                work_queue.put((position, profile_info))
+                break
+            # Chờ tới lượt theo bộ giới hạn tốc độ dùng chung thay vì nghỉ ngẫu nhiên cố định
+            wait_started = time.perf_counter()
+            if not limiter.acquire(stop_event):
+                break
+            stage_stats.record("pacing", time.perf_counter() - wait_started)
+            try:
+                result = scrape_single_profile(driver, profile_info, upload=False)
+                current_url = driver.current_url
+            except Exception as e:
+                # Trình duyệt bị crash giữa chừng: đóng để lần sau khởi động lại
+                logger.error(f"[worker {worker_id}] Trình duyệt gặp lỗi: {e}")
+                service.mark_broken()
+                result = {'row_index': profile_info['row_index'], 'full_name': "Scrape Error", 'profile_pic_url': ""}
+                current_url = ""
+            service.note_page()
+            if result is None:
+                continue
+
+            reason = detect_block_reason(url=current_url)
+            if reason:
+                # Bị chuyển tới trang đăng nhập / challenge: dữ liệu trên trang không phải của hồ sơ này
+                limiter.record_block(reason)
+                result = {**result, 'full_name': "Scrape Error", 'profile_pic_url': ""}
+            elif result['full_name'] == "Not Found":
+                limiter.record_block("page_unavailable", severe=False)
+            elif result['full_name'] == "Scrape Error":
+                limiter.record_block("scrape_error", severe=False)
+            else:
+                limiter.record_success()
+            on_result(position, result)
+    finally:
+        browser_pool.checkin(service)
+
+def _scrape_with_selenium(cookie_file_path: str, indexed_profiles: list, on_result, stop_event: threading.Event, num_workers: int | None = None) -> bool:
+    """
+    Cào danh sách (vị trí, profile_info) bằng một nhóm trình duyệt, gọi on_result(vị trí, kết quả) cho từng hồ sơ.
+    Trả về False nếu không có trình duyệt nào khởi động được.
+    """
+    work_queue = queue.Queue()
+    for item in indexed_profiles:
+        work_queue.put(item)
+
+    num_workers = max(1, min(num_workers or SCRAPER_WORKERS, len(indexed_profiles)))
+    started = []
+    workers = [
+        threading.Thread(
+            target=_scrape_worker,
+            args=(worker_id, cookie_file_path, work_queue, on_result, started, stop_event),
+            name=f"scraper-{worker_id}",
+            daemon=True,
+        )
+        for worker_id in range(num_workers)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    if not started:
+        logger.error("Không có trình duyệt nào khởi động được.")
+        return False
+    if not work_queue.empty() and not stop_event.is_set():
+        logger.warning(f"Còn {work_queue.qsize()} hồ sơ chưa được cào do các worker đã dừng.")
+    return True
 
+def _iter_indexed_results(cookie_file_path: str, profiles_to_scrape: list, num_workers: int | None = None, engine: str | None = None, use_cache: bool = True):
+    """Sinh ra từng cặp (vị trí, kết quả) ngay khi một hồ sơ được cào xong (không theo thứ tự)."""
+    # Các hồ sơ đã được cào gần đây (còn hạn trong scrape_cache) được trả về ngay, không cần truy cập mạng
+    remaining = []
+    for position, profile_info in enumerate(profiles_to_scrape):
+        username = extract_username(profile_info.get('url'))
+        cached = scrape_cache.get(username) if use_cache and username else None
+        if cached:
+            logger.info(f"Dùng kết quả đã lưu cho {username} ({cached['outcome']}).")
+            yield position, {'row_index': profile_info['row_index'], 'full_name': cached['full_name'], 'profile_pic_url': cached['profile_pic_url']}
+        else:
+            remaining.append((position, profile_info))
+    if not remaining:
+        return
+
+    if not os.path.exists(cookie_file_path):
+        logger.error(f"Không tìm thấy file cookie tại '{cookie_file_path}'. Hãy tạo và tải nó lên.")
+        raise ScraperUnavailable(f"Không tìm thấy file cookie tại '{cookie_file_path}'")
+
+    output = queue.Queue()
+    stop_event = threading.Event()
+    finished = object()
+
+    upload_stage = UploadStage()
+
+    def _emit(position, result):
+        username = extract_username(profiles_to_scrape[position].get('url'))
+        if username:
+            try:
+                scrape_cache.put(username, result)
             except Exception as e:
-                logger.error(f"Lỗi không xác định khi cào dữ liệu cho {username_to_scrape}: {e}")
-                if "Sorry, this page isn't available" in driver.page_source:
-                     results.append({'row_index': profile_info['row_index'], 'full_name': "Not Found", 'profile_pic_url': ""})
-                else:
-                    results.append({'row_index': profile_info['row_index'], 'full_name': "Scrape Error", 'profile_pic_url': ""})
-    
+                logger.warning(f"Không thể lưu kết quả của {username} vào bộ nhớ đệm: {e}")
+        output.put((position, result))
+
+    def _on_result(position, result):
+        if stop_event.is_set():
+            # Không còn ai đọc kết quả nữa
+            return
+        # Trình duyệt chuyển ngay sang hồ sơ tiếp theo; kết quả chỉ được trả ra khi ảnh đã tải xong
+        original_pic_url = result.get('profile_pic_url')
+        if not original_pic_url:
+            _emit(position, result)
+            return
+        username = extract_username(profiles_to_scrape[position].get('url'))
+
+        def _join(secure_url):
+            _emit(position, {**result, 'profile_pic_url': secure_url or original_pic_url})
+
+        upload_stage.submit(original_pic_url, username, _join)
+
+    def _produce():
+        stage_stats.reset()
+        try:
+            indexed_profiles = remaining
+            http_results = {}
+            if (engine or SCRAPER_ENGINE) == "http":
+                import asyncio
+                import http_scraper
+                http_results, indexed_profiles = asyncio.run(http_scraper.scrape_profiles(
+                    cookie_file_path, indexed_profiles, concurrency=HTTP_SCRAPER_CONCURRENCY,
+                    on_result=_on_result, stop_event=stop_event,
+                ))
+                if indexed_profiles:
+                    logger.info(f"Chuyển {len(indexed_profiles)} hồ sơ sang Selenium.")
+            if indexed_profiles and not stop_event.is_set():
+                if not _scrape_with_selenium(cookie_file_path, indexed_profiles, _on_result, stop_event, num_workers) and not http_results:
+                    output.put(ScraperUnavailable("Không có trình duyệt nào khởi động được"))
+        except Exception as e:
+            output.put(e)
+        finally:
+            upload_stage.close()
+            summary = stage_stats.summary()
+            if summary:
+                details = ", ".join(f"{stage} {stats['avg']:.2f}s x{stats['count']}" for stage, stats in summary.items())
+                logger.info(f"⏱️ Thời gian trung bình mỗi giai đoạn ({'lean' if SCRAPER_LEAN_MODE else 'đầy đủ'}): {details}")
+            output.put(finished)
+
+    producer = threading.Thread(target=_produce, name="scraper-producer", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = output.get()
+            if item is finished:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
     finally:
-        driver.quit()
-            
-    return results
+        # Người dùng dừng đọc giữa chừng: báo cho các worker dừng lại sau hồ sơ hiện tại
+        stop_event.set()
+
+def iter_scrape_instagram_profiles(cookie_file_path: str, profiles_to_scrape: list, num_workers: int | None = None, engine: str | None = None, use_cache: bool = True):
+    """
+    Chế độ streaming của scrape_instagram_profiles: trả về từng kết quả ngay khi cào xong
+    (cùng định dạng row_index, full_name, profile_pic_url), không theo thứ tự đầu vào.
+    Ném ScraperUnavailable nếu không thể bắt đầu cào dữ liệu.
+    """
+    for _, result in _iter_indexed_results(cookie_file_path, profiles_to_scrape, num_workers, engine, use_cache):
+        yield result
+
+def scrape_instagram_profiles(cookie_file_path: str, profiles_to_scrape: list, num_workers: int | None = None, engine: str | None = None, use_cache: bool = True):
+    """
+    Hàm chính để cào dữ liệu và tải ảnh lên Cloudinary.
+    Với engine "http", hồ sơ được lấy bằng HTTP trực tiếp và chỉ những hồ sơ bị chặn mới chạy lại bằng Selenium.
+    Với engine "selenium", dùng `num_workers` trình duyệt (mặc định SCRAPER_WORKERS) cùng lấy việc từ một hàng đợi chung.
+    Hồ sơ có kết quả còn hạn trong scrape_cache không bị cào lại (trừ khi use_cache=False).
+    Kết quả được trả về theo đúng thứ tự của `profiles_to_scrape`, hoặc None nếu không thể cào dữ liệu.
+    """
+    try:
+        results = dict(_iter_indexed_results(cookie_file_path, profiles_to_scrape, num_workers, engine, use_cache))
+    except ScraperUnavailable:
+        return None
+    return [results[position] for position in sorted(results)]
@@ -0,0 +1,114 @@
+# File: search_index.py
+# Chỉ mục n-gram (bigram + trigram) cho việc tìm kiếm theo username và tên đầy đủ,
+# thay cho việc quét tuần tự toàn bộ bản ghi ở mỗi lần tìm kiếm.
+
+import unicodedata
+
+NGRAM_SIZES = (2, 3)
+
+
+def fold_text(text) -> str:
+    """Chuyển về chữ thường và bỏ dấu tiếng Việt để "nguyen" khớp với "Nguyễn"."""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFD", str(text).lower())
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    return text.replace("đ", "d")
+
+
+def _ngrams(text: str, size: int) -> set:
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class NgramIndex:
+    """
+    Chỉ mục ánh xạ từng n-gram tới tập các khóa (username) chứa nó.
+    Mỗi khóa gắn với username và tên đầy đủ đã được chuẩn hóa bằng fold_text.
+    """
+
+    def __init__(self):
+        self._docs = {}      # key -> (username đã chuẩn hóa, tên đầy đủ đã chuẩn hóa)
+        self._postings = {}  # n-gram -> set(key)
+
+    def __len__(self):
+        return len(self._docs)
+
+    def clear(self):
+        self._docs = {}
+        self._postings = {}
+
+    def add(self, key: str, username: str, full_name: str = ""):
+        """Thêm (hoặc cập nhật) một khóa vào chỉ mục."""
+        if key in self._docs:
+            self.remove(key)
+        doc = (fold_text(username), fold_text(full_name))
+        self._docs[key] = doc
+        for gram in self._doc_grams(doc):
+            self._postings.setdefault(gram, set()).add(key)
+
+    def remove(self, key: str):
+        """Xóa một khóa khỏi chỉ mục (không làm gì nếu khóa không tồn tại)."""
+        doc = self._docs.pop(key, None)
+        if doc is None:
+            return
+        for gram in self._doc_grams(doc):
+            keys = self._postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[gram]
+
+    def search(self, query: str) -> list:
+        """Trả về danh sách khóa khớp với `query`, đã sắp xếp theo mức độ khớp."""
+        term = fold_text(query).strip()
+        if not term:
+            return []
+
+        if len(term) < min(NGRAM_SIZES):
+            # Truy vấn quá ngắn để dùng chỉ mục, đành duyệt toàn bộ
+            candidates = self._docs.keys()
+        else:
+            size = max(s for s in NGRAM_SIZES if s <= len(term))
+            postings = [self._postings.get(gram) for gram in _ngrams(term, size)]
+            if not all(postings):
+                return []
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for keys in postings[1:]:
+                candidates &= keys
+                if not candidates:
+                    return []
+
+        ranked = []
+        for key in candidates:
+            score = self._score(self._docs[key], term)
+            if score is not None:
+                ranked.append((score, len(key), key))
+        ranked.sort()
+        return [key for _, _, key in ranked]
+
+    @staticmethod
+    def _doc_grams(doc) -> set:
+        grams = set()
+        for text in doc:
+            for size in NGRAM_SIZES:
+                grams |= _ngrams(text, size)
+        return grams
+
+    @staticmethod
+    def _score(doc, term: str) -> int | None:
+        """Điểm càng nhỏ càng khớp tốt; None nghĩa là không khớp (n-gram trùng nhưng không chứa chuỗi con)."""
+        username, full_name = doc
+        if username == term:
+            return 0
+        if username.startswith(term):
+            return 1
+        if full_name == term:
+            return 2
+        if full_name.startswith(term) or any(word.startswith(term) for word in full_name.split()):
+            return 3
+        if term in username:
+            return 4
+        if term in full_name:
+            return 5
+        return None
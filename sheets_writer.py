@@ -0,0 +1,184 @@
+# File: sheets_writer.py
+# Lớp ghi dùng chung cho Google Sheets: gom các lệnh ghi ô đến trong một khoảng thời gian ngắn
+# thành một lần batch_update, giữ số lần gọi API dưới hạn mức (mặc định 60 yêu cầu/phút/người dùng)
+# và tự thử lại khi bị Google trả về 429 (quá hạn mức).
+
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = (429, 500, 503)
+
+
+def _status_code(error: Exception) -> int | None:
+    """Mã HTTP của một lỗi gspread.exceptions.APIError (không cần import gspread)."""
+    return getattr(getattr(error, "response", None), "status_code", None)
+
+
+class SheetsWriter:
+    """
+    Gom các lệnh ghi ô theo (worksheet, value_input_option) trong `window` giây rồi ghi bằng một lần batch_update.
+    Lệnh ghi sau vào cùng một ô ghi đè lệnh trước. Mọi lần gọi API đi qua lớp này đều được giới hạn
+    `budget_per_minute` lần/phút và được thử lại theo cấp số nhân khi gặp 429 / 5xx.
+    An toàn khi dùng từ nhiều thread; từ asyncio dùng `await asyncio.wrap_future(...)`.
+    """
+
+    def __init__(self, window: float = 1.0, budget_per_minute: int = 60, max_retries: int = 5,
+                 backoff_base: float = 2.0, backoff_max: float = 64.0):
+        self.window = window
+        self.budget_per_minute = max(1, budget_per_minute)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.RLock()  # Giữ thứ tự giữa các lô ghi và các lệnh gọi trực tiếp
+        self._budget_lock = threading.Lock()
+        self._pending = OrderedDict()  # (id(worksheet), value_input_option) -> (worksheet, {(hàng, cột): giá trị}, [future])
+        self._wake = threading.Event()
+        self._thread = None
+        self._call_times = deque()
+
+        self.write_requests = 0  # Số lệnh ghi nhận được (mỗi lệnh trước đây là một lần gọi API)
+        self.write_api_calls = 0
+        self.api_calls = 0
+        self.retries = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            window=float(os.getenv("SHEETS_WRITE_WINDOW_SECONDS", "1")),
+            budget_per_minute=int(os.getenv("SHEETS_REQUESTS_PER_MINUTE", "60")),
+            max_retries=int(os.getenv("SHEETS_MAX_RETRIES", "5")),
+            backoff_base=float(os.getenv("SHEETS_BACKOFF_BASE_SECONDS", "2")),
+            backoff_max=float(os.getenv("SHEETS_BACKOFF_MAX_SECONDS", "64")),
+        )
+
+    # ---------- Ghi ô ----------
+
+    def write_cells(self, worksheet, cells: list, value_input_option: str = "RAW") -> Future:
+        """
+        Xếp hàng ghi danh sách (hàng, cột, giá trị). Trả về Future hoàn thành khi lô chứa các ô này đã được ghi.
+        value_input_option="USER_ENTERED" để Sheets tự nhận diện số / ngày như khi gõ tay (giống update_cell).
+        """
+        future = Future()
+        if not cells:
+            future.set_result(0)
+            return future
+        with self._lock:
+            key = (id(worksheet), value_input_option)
+            if key not in self._pending:
+                self._pending[key] = (worksheet, OrderedDict(), [])
+            _, values, futures = self._pending[key]
+            for row, col, value in cells:
+                values[(row, col)] = value
+            futures.append(future)
+            self.write_requests += 1
+            self._ensure_thread()
+        self._wake.set()
+        return future
+
+    def write_cell(self, worksheet, row: int, col: int, value, value_input_option: str = "RAW") -> Future:
+        """Xếp hàng ghi một ô."""
+        return self.write_cells(worksheet, [(row, col, value)], value_input_option)
+
+    def flush(self):
+        """Ghi ngay toàn bộ các ô đang chờ (chặn tới khi xong)."""
+        with self._flush_lock:
+            self._flush_pending()
+
+    def call(self, func, *args, **kwargs):
+        """
+        Gọi trực tiếp một hàm của gspread (append_rows, delete_rows, get_all_values...) trong hạn mức, có thử lại.
+        Các ô đang chờ được ghi trước, để chỉ số hàng không bị lệch khi thêm / xóa hàng.
+        """
+        with self._flush_lock:
+            self._flush_pending()
+            return self._execute(func, *args, **kwargs)
+
+    # ---------- Nội bộ ----------
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="sheets-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            # Chờ hết cửa sổ để gom thêm các lệnh ghi đến ngay sau đó
+            time.sleep(self.window)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Lỗi khi ghi lô dữ liệu vào Google Sheets: {e}")
+
+    def _flush_pending(self):
+        from gspread.utils import rowcol_to_a1
+
+        with self._lock:
+            batches, self._pending = list(self._pending.items()), OrderedDict()
+
+        for (_, value_input_option), (worksheet, values, futures) in batches:
+            data = [{'range': rowcol_to_a1(row, col), 'values': [[value]]} for (row, col), value in values.items()]
+            try:
+                self._execute(worksheet.batch_update, data, value_input_option=value_input_option)
+            except Exception as e:
+                logger.error(f"Không thể ghi {len(data)} ô vào Google Sheets: {e}")
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            self.write_api_calls += 1
+            for future in futures:
+                future.set_result(len(data))
+            if len(futures) > 1:
+                logger.info(f"📝 Đã gộp {len(futures)} lệnh ghi ({len(data)} ô) thành 1 lần gọi API. {self.summary()}")
+
+    def _acquire_budget(self):
+        """Chờ tới khi số lần gọi API trong 60 giây gần nhất còn dưới hạn mức."""
+        while True:
+            with self._budget_lock:
+                now = time.monotonic()
+                while self._call_times and now - self._call_times[0] >= 60:
+                    self._call_times.popleft()
+                if len(self._call_times) < self.budget_per_minute:
+                    self._call_times.append(now)
+                    self.api_calls += 1
+                    return
+                wait = 60 - (now - self._call_times[0])
+            logger.info(f"⏳ Đã dùng hết hạn mức {self.budget_per_minute} yêu cầu/phút của Google Sheets, chờ {wait:.1f} giây.")
+            time.sleep(wait)
+
+    def _execute(self, func, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self._acquire_budget()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                status_code = _status_code(e)
+                if status_code not in RETRYABLE_STATUS_CODES or attempt == self.max_retries:
+                    raise
+                delay = min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(1.0, 1.2)
+                self.retries += 1
+                logger.warning(f"⚠️ Google Sheets trả về {status_code}, thử lại sau {delay:.1f} giây (lần {attempt + 1}/{self.max_retries}).")
+                time.sleep(delay)
+
+    def summary(self) -> str:
+        saved = max(0, self.write_requests - self.write_api_calls)
+        return (f"Tổng cộng {self.write_requests} lệnh ghi trong {self.write_api_calls} lần gọi API "
+                f"(tiết kiệm {saved} lần), {self.api_calls} lần gọi API, {self.retries} lần thử lại.")
+
+
+# Lớp ghi dùng chung cho toàn bộ tiến trình
+sheets_writer = SheetsWriter.from_env()
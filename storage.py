@@ -0,0 +1,430 @@
+# File: storage.py
+# Lớp lưu trữ dữ liệu của bot. Có hai cách lưu:
+# - SheetsBackend: đọc / ghi trực tiếp Google Sheet (như trước đây).
+# - SqliteBackend: SQLite trên máy là nơi lưu chính, mọi thay đổi được ghi vào bảng outbox
+#   và một tác vụ nền đồng bộ sang Google Sheet. Sheet vẫn là nơi con người xem và sửa,
+#   nhưng các lệnh của bot không phải chờ Google Sheets nữa.
+# Dữ liệu được trao đổi dưới dạng các hàng giống worksheet.get_all_values() (hàng đầu tiên là tiêu đề).
+
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class StorageBackend:
+    """Giao diện chung cho nơi lưu dữ liệu. Các hàng được xác định bằng chỉ số hàng (như trên sheet) và username."""
+
+    # True nếu mọi thao tác đều cần kết nối tới Google Sheets
+    needs_sheet_connection = True
+
+    def load_rows(self) -> list:
+        """Toàn bộ dữ liệu, hàng đầu tiên là tiêu đề."""
+        raise NotImplementedError
+
+    def append_rows(self, rows: list):
+        """Thêm các hàng vào cuối."""
+        raise NotImplementedError
+
+    def update_rows(self, updates: list):
+        """Cập nhật các ô theo danh sách (chỉ số hàng, username, {tên cột: giá trị})."""
+        raise NotImplementedError
+
+    def delete_row(self, row_index: int, username: str):
+        raise NotImplementedError
+
+    def refresh(self):
+        """Đồng bộ lại với Google Sheet trước khi tải lại dữ liệu (lệnh /refresh)."""
+
+
+def _column_letter(col: int) -> str:
+    from gspread.utils import rowcol_to_a1
+    return re.sub(r"\d", "", rowcol_to_a1(1, col))
+
+
+def _strip_trailing(values: list) -> list:
+    """Bỏ các ô trống ở cuối (Sheets API không trả về chúng)."""
+    values = list(values)
+    while values and not values[-1]:
+        values.pop()
+    return values
+
+
+def _column_values(value_range, length: int) -> list:
+    """Chuyển kết quả batch_get của một cột thành danh sách giá trị có độ dài `length`."""
+    values = [row[0] if row else '' for row in value_range]
+    return (values + [''] * length)[:length]
+
+
+class SheetsBackend(StorageBackend):
+    """
+    Lưu trực tiếp trên Google Sheet, mọi lệnh gọi đi qua lớp ghi dùng chung (gộp lệnh ghi, giới hạn hạn mức).
+    load_changes() kiểm tra các tín hiệu rẻ (modifiedTime trên Drive, cột URL, cột checksum) trước khi
+    quyết định có cần tải lại toàn bộ sheet hay chỉ tải lại những hàng đã thay đổi.
+    """
+
+    def __init__(self, get_worksheet, writer, user_entered_fields: tuple = (), key_column: str = "URL",
+                 checksum_column: str | None = None):
+        # user_entered_fields: các cột được ghi như khi gõ tay (USER_ENTERED), ví dụ rating để vẫn là số trên sheet
+        # checksum_column: cột (tùy chọn) có giá trị thay đổi mỗi khi hàng được sửa, ví dụ công thức băm nội dung hàng
+        self._get_worksheet = get_worksheet
+        self._writer = writer
+        self._user_entered_fields = tuple(user_entered_fields)
+        self._key_column = key_column
+        self._checksum_column = checksum_column
+        self.headers = None
+        # Ảnh chụp trạng thái sheet ở lần tải gần nhất, được cập nhật theo các lệnh ghi của chính bot
+        self._modified_time = None
+        self._keys = None
+        self._checksums = None
+        self._drive_available = True
+
+    def _worksheet(self):
+        worksheet = self._get_worksheet()
+        if worksheet is None:
+            raise RuntimeError("Không thể kết nối tới Google Sheets.")
+        return worksheet
+
+    def load_rows(self) -> list:
+        worksheet = self._worksheet()
+        # Lấy modifiedTime trước khi đọc để mọi chỉnh sửa xảy ra sau đó đều được phát hiện ở lần kiểm tra sau
+        modified_time = self._fetch_modified_time(worksheet)
+        rows = self._writer.call(worksheet.get_all_values)
+        self.headers = rows[0] if rows else []
+        self._modified_time = modified_time
+        self._keys = [self._cell(row, self._key_column) for row in rows[1:]]
+        self._checksums = [self._cell(row, self._checksum_column) for row in rows[1:]] if self._checksum_column else None
+        return rows
+
+    def _cell(self, row: list, column: str | None) -> str:
+        if column not in self.headers:
+            return ''
+        index = self.headers.index(column)
+        return row[index] if index < len(row) else ''
+
+    def _fetch_modified_time(self, worksheet) -> str | None:
+        """modifiedTime của file trên Google Drive (một lệnh gọi rất nhẹ), hoặc None nếu không lấy được."""
+        if not self._drive_available:
+            return None
+        try:
+            response = self._writer.call(
+                worksheet.spreadsheet.client.request,
+                "get",
+                f"https://www.googleapis.com/drive/v3/files/{worksheet.spreadsheet.id}",
+                params={"fields": "modifiedTime", "supportsAllDrives": True},
+            )
+            return response.json().get("modifiedTime")
+        except Exception as e:
+            # Ví dụ: Drive API chưa được bật cho project; bỏ qua tín hiệu này từ đây về sau
+            logger.warning(f"Không thể đọc modifiedTime từ Google Drive, bỏ qua tín hiệu này: {e}")
+            self._drive_available = False
+            return None
+
+    def load_changes(self):
+        """
+        Tìm các thay đổi kể từ lần tải gần nhất mà không đọc lại toàn bộ sheet.
+        Trả về (các hàng mới thêm vào cuối, {số hàng: nội dung mới của hàng}), hoặc None nếu cần tải lại toàn bộ.
+        """
+        if self._keys is None or self._key_column not in (self.headers or []):
+            return None
+        has_checksums = self._checksums is not None and self._checksum_column in self.headers
+        try:
+            worksheet = self._worksheet()
+            modified_time = self._fetch_modified_time(worksheet)
+            if modified_time is not None and modified_time == self._modified_time:
+                return [], {}
+            if not has_checksums:
+                # Không có cột checksum thì không biết những ô nào đã bị sửa: tải lại toàn bộ
+                return None
+            old_keys = self._keys
+            if old_keys and not old_keys[-1]:
+                # Không xác định được các hàng trống ở cuối sheet qua cột URL: tải lại toàn bộ cho chắc
+                return None
+
+            # Một lần batch_get cho hàng tiêu đề, cột URL và cột checksum
+            key_letter = _column_letter(self.headers.index(self._key_column) + 1)
+            checksum_letter = _column_letter(self.headers.index(self._checksum_column) + 1)
+            value_ranges = self._writer.call(
+                worksheet.batch_get, ["1:1", f"{key_letter}2:{key_letter}", f"{checksum_letter}2:{checksum_letter}"]
+            )
+            headers = list(value_ranges[0][0]) if value_ranges[0] else []
+            if _strip_trailing(headers) != _strip_trailing(self.headers):
+                return None
+
+            keys = _strip_trailing([row[0] if row else '' for row in value_ranges[1]])
+            if keys[:len(old_keys)] != old_keys:
+                # Hàng bị chèn / xóa / sắp xếp lại giữa sheet
+                return None
+            row_count = len(keys)
+            checksums = _column_values(value_ranges[2], row_count)
+            changed_rows = {position + 2 for position, (old, new) in enumerate(zip(self._checksums, checksums)) if old != new}
+
+            # Một lần batch_get nữa cho các hàng mới ở cuối và các hàng có checksum thay đổi
+            last_letter = _column_letter(len(self.headers))
+            fetch_ranges = [f"A{row}:{last_letter}{row}" for row in sorted(changed_rows)]
+            if row_count > len(old_keys):
+                fetch_ranges.append(f"A{len(old_keys) + 2}:{last_letter}{row_count + 1}")
+            fetched = self._writer.call(worksheet.batch_get, fetch_ranges) if fetch_ranges else []
+
+            updated_rows = {row: (fetched[i][0] if fetched[i] else []) for i, row in enumerate(sorted(changed_rows))}
+            appended_rows = list(fetched[-1]) if row_count > len(old_keys) else []
+            appended_rows += [[]] * (row_count - len(old_keys) - len(appended_rows))
+
+            self._modified_time = modified_time
+            self._keys = keys
+            self._checksums = checksums
+            logger.info(f"🔎 Đồng bộ một phần: {len(appended_rows)} hàng mới, {len(updated_rows)} hàng đã sửa.")
+            return appended_rows, updated_rows
+        except Exception as e:
+            logger.warning(f"Không thể đồng bộ một phần, sẽ tải lại toàn bộ sheet: {e}")
+            return None
+
+    def append_rows(self, rows: list):
+        if rows:
+            self._writer.call(self._worksheet().append_rows, rows)
+            if self._keys is not None:
+                self._keys.extend(self._cell(row, self._key_column) for row in rows)
+                if self._checksums is not None:
+                    self._checksums.extend(self._cell(row, self._checksum_column) for row in rows)
+
+    def update_rows(self, updates: list):
+        worksheet = self._worksheet()
+        if self.headers is None:
+            self.headers = self._writer.call(worksheet.row_values, 1)
+        cells = {"RAW": [], "USER_ENTERED": []}
+        for row_index, _, fields in updates:
+            for field, value in fields.items():
+                if field in self.headers:
+                    option = "USER_ENTERED" if field in self._user_entered_fields else "RAW"
+                    cells[option].append((row_index, self.headers.index(field) + 1, value))
+        futures = [self._writer.write_cells(worksheet, option_cells, option) for option, option_cells in cells.items()]
+        for future in futures:
+            future.result()
+        if self._keys is not None:
+            for row_index, _, fields in updates:
+                if self._key_column in fields and 0 <= row_index - 2 < len(self._keys):
+                    self._keys[row_index - 2] = fields[self._key_column]
+
+    def delete_row(self, row_index: int, username: str):
+        self._writer.call(self._worksheet().delete_rows, row_index)
+        if self._keys is not None and 0 <= row_index - 2 < len(self._keys):
+            self._keys.pop(row_index - 2)
+            if self._checksums is not None:
+                self._checksums.pop(row_index - 2)
+
+
+class SqliteBackend(StorageBackend):
+    """
+    SQLite là nơi lưu chính (có chỉ mục theo username và rating); mỗi thay đổi được ghi kèm vào bảng outbox
+    trong cùng một transaction, và mirror_pending() đẩy chúng sang Google Sheet (qua `mirror`).
+    Khi đồng bộ, hàng trên sheet được tìm lại theo username nên không phụ thuộc thứ tự hàng.
+    """
+
+    needs_sheet_connection = False
+
+    def __init__(self, path: str, mirror: SheetsBackend, key_func, rating_field: str | None = None):
+        # key_func: hàm lấy username từ một bản ghi (dict tên cột -> giá trị), trả về None nếu không có
+        self.path = path
+        self.mirror = mirror
+        self._key_func = key_func
+        self._rating_field = rating_field
+        self._lock = threading.Lock()
+        self._mirror_lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # Mở kết nối ở lần dùng đầu tiên; dùng chung giữa các thread và được bảo vệ bằng _lock
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);"
+                "CREATE TABLE IF NOT EXISTS profiles ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, rating TEXT, data TEXT NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS idx_profiles_username ON profiles (username);"
+                "CREATE INDEX IF NOT EXISTS idx_profiles_rating ON profiles (rating);"
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, op TEXT NOT NULL, username TEXT, payload TEXT, created_at REAL NOT NULL);"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _key(self, record: dict) -> str | None:
+        key = self._key_func(record)
+        return key.lower() if key else None
+
+    def _headers(self, conn) -> list | None:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'headers'").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _insert_records(self, conn, records: list):
+        conn.executemany(
+            "INSERT INTO profiles (username, rating, data) VALUES (?, ?, ?)",
+            [(self._key(record), str(record.get(self._rating_field, '')) if self._rating_field else None,
+              json.dumps(record, ensure_ascii=False)) for record in records],
+        )
+
+    def _replace_all(self, conn, rows: list):
+        headers = rows[0] if rows else []
+        records = [dict(zip(headers, row + [''] * (len(headers) - len(row)))) for row in rows[1:]]
+        conn.execute("DELETE FROM profiles")
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('headers', ?)", (json.dumps(headers, ensure_ascii=False),))
+        self._insert_records(conn, records)
+        conn.commit()
+
+    def _enqueue(self, conn, op: str, username: str | None, payload):
+        conn.execute(
+            "INSERT INTO outbox (op, username, payload, created_at) VALUES (?, ?, ?, ?)",
+            (op, username, json.dumps(payload, ensure_ascii=False), time.time()),
+        )
+
+    # ---------- Giao diện StorageBackend ----------
+
+    def load_rows(self) -> list:
+        with self._lock:
+            conn = self._connection()
+            headers = self._headers(conn)
+        if headers is None:
+            # Lần chạy đầu tiên: nạp dữ liệu ban đầu từ Google Sheet
+            rows = self.mirror.load_rows()
+            with self._lock:
+                self._replace_all(self._connection(), rows)
+            logger.info(f"✅ Đã nạp {max(0, len(rows) - 1)} hàng từ Google Sheet vào {self.path}.")
+        with self._lock:
+            conn = self._connection()
+            headers = self._headers(conn)
+            records = [json.loads(data) for (data,) in conn.execute("SELECT data FROM profiles ORDER BY id")]
+        return [headers] + [[record.get(header, '') for header in headers] for record in records]
+
+    def append_rows(self, rows: list):
+        with self._lock:
+            conn = self._connection()
+            headers = self._headers(conn) or []
+            records = [dict(zip(headers, row)) for row in rows]
+            self._insert_records(conn, records)
+            for record in records:
+                self._enqueue(conn, "append", self._key(record), record)
+            conn.commit()
+
+    def update_rows(self, updates: list):
+        with self._lock:
+            conn = self._connection()
+            for _, username, fields in updates:
+                username = username.lower()
+                row = conn.execute(
+                    "SELECT id, data FROM profiles WHERE username = ? ORDER BY id LIMIT 1", (username,)
+                ).fetchone()
+                if row is None:
+                    continue
+                record = {**json.loads(row[1]), **fields}
+                conn.execute(
+                    "UPDATE profiles SET data = ?, rating = ? WHERE id = ?",
+                    (json.dumps(record, ensure_ascii=False),
+                     str(record.get(self._rating_field, '')) if self._rating_field else None, row[0]),
+                )
+                self._enqueue(conn, "update", username, fields)
+            conn.commit()
+
+    def delete_row(self, row_index: int, username: str):
+        with self._lock:
+            conn = self._connection()
+            username = username.lower()
+            conn.execute(
+                "DELETE FROM profiles WHERE id = (SELECT id FROM profiles WHERE username = ? ORDER BY id LIMIT 1)", (username,)
+            )
+            self._enqueue(conn, "delete", username, None)
+            conn.commit()
+
+    def refresh(self):
+        """Đẩy hết thay đổi sang sheet, sau đó nạp lại toàn bộ từ sheet để nhận các chỉnh sửa trực tiếp trên sheet."""
+        with self._mirror_lock:
+            while self._mirror_batch():
+                pass
+            rows = self.mirror.load_rows()
+            with self._lock:
+                conn = self._connection()
+                if conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]:
+                    # Có thay đổi mới trong lúc đồng bộ: không ghi đè, lần /refresh sau sẽ thử lại
+                    logger.warning("Có thay đổi chưa được đồng bộ sang Google Sheet, bỏ qua việc nạp lại từ sheet.")
+                    return
+                self._replace_all(conn, rows)
+
+    # ---------- Đồng bộ sang Google Sheet ----------
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def mirror_pending(self) -> int:
+        """Đẩy các thay đổi trong outbox sang Google Sheet. Trả về số thay đổi đã đồng bộ."""
+        with self._mirror_lock:
+            return self._mirror_batch()
+
+    def _mirror_batch(self, limit: int = 500) -> int:
+        with self._lock:
+            ops = self._connection().execute(
+                "SELECT id, op, username, payload FROM outbox ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+        if not ops:
+            return 0
+
+        rows = self.mirror.load_rows()
+        headers = rows[0] if rows else []
+        sheet_keys = [self._key(dict(zip(headers, row))) for row in rows[1:]]
+
+        # Gộp các thay đổi theo username: cập nhật hàng có sẵn, xóa hàng có sẵn, thêm hàng mới
+        updates = {}
+        deletes = set()
+        appends = {}  # username -> bản ghi sẽ được thêm
+        for op_id, op, username, payload in ops:
+            payload = json.loads(payload) if payload else None
+            if op == "append":
+                if username in sheet_keys and username not in deletes:
+                    continue  # Đã được thêm ở lần đồng bộ trước (bị gián đoạn trước khi kịp xóa outbox)
+                appends[username or f"#{op_id}"] = payload
+            elif op == "update":
+                if username in appends:
+                    appends[username].update(payload)
+                elif username in sheet_keys and username not in deletes:
+                    updates.setdefault(username, {}).update(payload)
+            elif op == "delete":
+                if username in appends:
+                    del appends[username]
+                elif username in sheet_keys:
+                    deletes.add(username)
+                    updates.pop(username, None)
+
+        row_of = {}
+        for position, key in enumerate(sheet_keys):
+            if key and key not in row_of:
+                row_of[key] = position + 2
+        if updates:
+            self.mirror.update_rows([(row_of[username], username, fields) for username, fields in updates.items()])
+        # Xóa từ dưới lên để chỉ số của các hàng còn lại không bị lệch
+        for row_index in sorted((row_of[username] for username in deletes), reverse=True):
+            self.mirror.delete_row(row_index, sheet_keys[row_index - 2])
+        if appends:
+            self.mirror.append_rows([[record.get(header, '') for header in headers] for record in appends.values()])
+
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM outbox WHERE id <= ?", (ops[-1][0],))
+            conn.commit()
+        logger.info(f"🔁 Đã đồng bộ {len(ops)} thay đổi sang Google Sheet "
+                    f"({len(updates)} cập nhật, {len(deletes)} xóa, {len(appends)} thêm mới).")
+        return len(ops)
+
+
+def create_backend(name: str, get_worksheet, writer, key_func, rating_field: str | None = None,
+                   sqlite_path: str = "profiles.sqlite3", checksum_column: str | None = None) -> StorageBackend:
+    """Tạo nơi lưu dữ liệu theo tên ("sheets" hoặc "sqlite")."""
+    sheets = SheetsBackend(get_worksheet, writer, user_entered_fields=(rating_field,) if rating_field else (),
+                           checksum_column=checksum_column)
+    if name == "sqlite":
+        return SqliteBackend(sqlite_path, sheets, key_func, rating_field=rating_field)
+    if name != "sheets":
+        logger.warning(f"STORAGE_BACKEND không hợp lệ: {name}. Dùng Google Sheets.")
+    return sheets
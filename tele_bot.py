@@ -1,19 +1,23 @@
+import time
+# Mốc thời gian bắt đầu, dùng cho báo cáo thời gian khởi động (STARTUP_TIMING=1)
+STARTUP_T0 = time.perf_counter()
+
 import logging
 import re
 import os
-import random
-import csv
+import sys
+import threading
 import io
+import json
 import asyncio
 import uuid # TÍNH NĂNG MỚI: Thêm thư viện để tạo ID duy nhất
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 from dotenv import load_dotenv
-import gspread
-from google.oauth2.service_account import Credentials
 
-# Thêm thư viện để vẽ biểu đồ
-import matplotlib.pyplot as plt
-import seaborn as sns
+# Các thư viện nặng (gspread, matplotlib, seaborn, scraper/selenium/cloudinary) chỉ được
+# import khi lệnh cần đến chúng được dùng lần đầu, giúp bot khởi động nhanh và tốn ít RAM hơn.
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 # TÍNH NĂNG MỚI: Thêm các lớp cần thiết cho Chế độ Inline
@@ -31,8 +35,9 @@ from telegram.ext import (
     InlineQueryHandler, # TÍNH NĂNG MỚI
 )
 
-# Import module scraper
-import scraper
+from record_cache import RecordCache
+from sheets_writer import sheets_writer
+from storage import create_backend
 
 # Tải các biến môi trường từ file .env
 load_dotenv()
@@ -49,6 +54,58 @@ INSTAGRAM_COOKIE_FILE = os.getenv("INSTAGRAM_COOKIE_FILE")
 FULL_NAME_COLUMN_NAME = os.getenv("FULL_NAME_COLUMN_NAME", "full_name")
 PROFILE_PIC_URL_COLUMN_NAME = os.getenv("PROFILE_PIC_URL_COLUMN_NAME", "profile_pic_url")
 
+# Ghi kết quả cào dữ liệu vào sheet theo lô: mỗi N hồ sơ hoặc sau T giây, tùy điều kiện nào đến trước
+SCRAPE_FLUSH_EVERY = int(os.getenv("SCRAPE_FLUSH_EVERY", "10"))
+SCRAPE_FLUSH_SECONDS = float(os.getenv("SCRAPE_FLUSH_SECONDS", "30"))
+# Khoảng thời gian tối thiểu giữa hai lần sửa tin nhắn tiến độ (tránh bị Telegram giới hạn)
+SCRAPE_PROGRESS_SECONDS = float(os.getenv("SCRAPE_PROGRESS_SECONDS", "5"))
+# Số hồ sơ đã xong tối thiểu trước khi /scrape_status ước tính thời gian theo tốc độ đo được (trước đó dùng tốc độ cho phép)
+SCRAPE_ETA_MIN_DONE = int(os.getenv("SCRAPE_ETA_MIN_DONE", "5"))
+# File lưu các kết quả đã cào nhưng chưa ghi vào sheet, dùng để khôi phục khi bot bị dừng giữa chừng
+SCRAPE_CHECKPOINT_FILE = os.getenv("SCRAPE_CHECKPOINT_FILE", "scrape_checkpoint.jsonl")
+
+# Đặt STARTUP_TIMING=1 để in báo cáo thời gian khởi động và các module nặng đã được nạp
+STARTUP_TIMING = os.getenv("STARTUP_TIMING", "").lower() in ("1", "true", "yes")
+
+# Các hồ sơ được đánh giá trong /add được gom lại và ghi bằng một lần append_rows khi hết hàng đợi,
+# hoặc sau ADD_FLUSH_IDLE_SECONDS giây không có thao tác; file nhật ký giữ chúng an toàn tới khi được ghi
+ADD_FLUSH_IDLE_SECONDS = float(os.getenv("ADD_FLUSH_IDLE_SECONDS", "60"))
+ADD_JOURNAL_FILE = os.getenv("ADD_JOURNAL_FILE", "add_journal.jsonl")
+
+# Nơi lưu dữ liệu: "sheets" (đọc / ghi trực tiếp Google Sheet) hoặc "sqlite" (SQLite trên máy là nơi lưu chính,
+# thay đổi được đồng bộ sang Google Sheet mỗi STORAGE_MIRROR_SECONDS giây)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sheets").lower()
+STORAGE_SQLITE_FILE = os.getenv("STORAGE_SQLITE_FILE", "profiles.sqlite3")
+STORAGE_MIRROR_SECONDS = float(os.getenv("STORAGE_MIRROR_SECONDS", "30"))
+
+# Trước khi tải lại sheet, kiểm tra modifiedTime trên Drive (và cột checksum nếu có) để chỉ tải phần đã thay đổi.
+# SHEET_CHECKSUM_COLUMN: cột có giá trị đổi mỗi khi hàng bị sửa (ví dụ công thức băm nội dung hàng)
+SHEET_DELTA_SYNC = os.getenv("SHEET_DELTA_SYNC", "1").lower() in ("1", "true", "yes")
+SHEET_CHECKSUM_COLUMN = os.getenv("SHEET_CHECKSUM_COLUMN") or None
+
+# Thời gian (giây) giữ dữ liệu sheet trong bộ nhớ đệm trước khi tự tải lại
+RECORD_CACHE_TTL = float(os.getenv("RECORD_CACHE_TTL", "300"))
+
+# Chế độ inline: số kết quả mỗi trang (tối đa 50), bộ nhớ đệm kết quả đã dựng và thời gian chờ giữa các lần gõ phím
+INLINE_PAGE_SIZE = min(50, int(os.getenv("INLINE_PAGE_SIZE", "20")))
+INLINE_CACHE_SIZE = int(os.getenv("INLINE_CACHE_SIZE", "128"))
+INLINE_CACHE_TTL = float(os.getenv("INLINE_CACHE_TTL", "300"))
+INLINE_DEBOUNCE_SECONDS = float(os.getenv("INLINE_DEBOUNCE_SECONDS", "0.3"))
+
+# /random và inline "random": RANDOM_WEIGHTED=1 ưu tiên tài liệu rating cao (trọng số bằng rating),
+# RANDOM_NO_REPEAT=1 không lặp lại tài liệu cho một người dùng cho tới khi đã xem hết; phiên của một người dùng
+# hết hạn sau RANDOM_SESSION_TTL giây không dùng, và chỉ giữ tối đa RANDOM_SESSION_LIMIT phiên
+RANDOM_WEIGHTED = os.getenv("RANDOM_WEIGHTED", "").lower() in ("1", "true", "yes")
+RANDOM_NO_REPEAT = os.getenv("RANDOM_NO_REPEAT", "").lower() in ("1", "true", "yes")
+RANDOM_SESSION_TTL = float(os.getenv("RANDOM_SESSION_TTL", "3600"))
+RANDOM_SESSION_LIMIT = int(os.getenv("RANDOM_SESSION_LIMIT", "1000"))
+
+# /backup: định dạng mặc định, kích thước tối đa mỗi phần (MB, dưới giới hạn 50 MB của Telegram)
+# và ngưỡng (MB) để file tạm được chuyển từ bộ nhớ xuống đĩa
+BACKUP_FORMAT = os.getenv("BACKUP_FORMAT", "csv").lower()
+BACKUP_PART_MB = float(os.getenv("BACKUP_PART_MB", "45"))
+BACKUP_SPOOL_MB = float(os.getenv("BACKUP_SPOOL_MB", "8"))
+
 # Bật logging
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
@@ -61,17 +118,63 @@ if not all([TELEGRAM_TOKEN, GOOGLE_SHEET_NAME, WORKSHEET_NAME, GOOGLE_CREDENTIAL
     exit()
 
 # ======================= KHỞI TẠO KẾT NỐI GOOGLE SHEET =======================
+# Kết nối được mở khi cần lần đầu (hoặc trong lúc khởi động nền), không chặn việc bot bắt đầu polling.
 worksheet = None
-try:
-    logger.info("Đang kết nối tới Google Sheets...")
-    scopes = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
-    creds = Credentials.from_service_account_file(GOOGLE_CREDENTIALS_FILE, scopes=scopes)
-    client = gspread.authorize(creds)
-    spreadsheet = client.open(GOOGLE_SHEET_NAME)
-    worksheet = spreadsheet.worksheet(WORKSHEET_NAME)
-    logger.info("✅ Kết nối Google Sheets thành công!")
-except Exception as e:
-    logger.critical(f"LỖI NGHIÊM TRỌNG: Không thể kết nối tới Google Sheets khi khởi động. Lỗi: {e}")
+_worksheet_lock = threading.Lock()
+
+def get_worksheet():
+    """Trả về worksheet, kết nối tới Google Sheets nếu chưa kết nối. Trả về None nếu kết nối thất bại."""
+    global worksheet
+    if worksheet is not None:
+        return worksheet
+    with _worksheet_lock:
+        if worksheet is None:
+            try:
+                logger.info("Đang kết nối tới Google Sheets...")
+                import gspread
+                from google.oauth2.service_account import Credentials
+                scopes = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
+                creds = Credentials.from_service_account_file(GOOGLE_CREDENTIALS_FILE, scopes=scopes)
+                client = gspread.authorize(creds)
+                spreadsheet = client.open(GOOGLE_SHEET_NAME)
+                worksheet = spreadsheet.worksheet(WORKSHEET_NAME)
+                logger.info("✅ Kết nối Google Sheets thành công!")
+            except Exception as e:
+                logger.critical(f"LỖI NGHIÊM TRỌNG: Không thể kết nối tới Google Sheets. Lỗi: {e}")
+    return worksheet
+
+async def ensure_worksheet() -> bool:
+    """Đảm bảo đã kết nối tới Google Sheets (kết nối trong thread riêng nếu cần)."""
+    if worksheet is not None:
+        return True
+    return await asyncio.to_thread(get_worksheet) is not None
+
+async def ensure_storage() -> bool:
+    """Đảm bảo nơi lưu dữ liệu sẵn sàng. Với SQLite, bot vẫn hoạt động khi Google Sheets tạm thời không truy cập được."""
+    if not storage.needs_sheet_connection:
+        return True
+    return await ensure_worksheet()
+
+# Mọi thao tác đọc / ghi dữ liệu của bot đi qua nơi lưu này
+storage = create_backend(
+    STORAGE_BACKEND,
+    get_worksheet,
+    sheets_writer,
+    key_func=lambda record: extract_username(record.get("URL", "")),
+    rating_field=RATING_COLUMN_NAME,
+    sqlite_path=STORAGE_SQLITE_FILE,
+    checksum_column=SHEET_CHECKSUM_COLUMN,
+)
+
+# Bộ nhớ đệm dùng chung cho mọi lệnh, thay cho việc gọi worksheet.get_all_records() liên tục
+record_cache = RecordCache(
+    storage.load_rows,
+    key_func=lambda record: extract_username(record.get("URL", "")),
+    ttl=RECORD_CACHE_TTL,
+    search_fields=(FULL_NAME_COLUMN_NAME,),
+    rating_field=RATING_COLUMN_NAME,
+    delta_loader=getattr(storage, "load_changes", None) if SHEET_DELTA_SYNC else None,
+)
 
 # ======================= ĐỊNH NGHĨA TRẠNG THÁI HỘI THOẠI =======================
 (ASKING_RATING,) = range(1)
@@ -81,45 +184,119 @@ except Exception as e:
 
 # ======================= HÀM TIỆN ÍCH & VẼ BIỂU ĐỒ =======================
 
+# Matplotlib không an toàn khi vẽ song song, nên chỉ dùng một worker riêng cho việc vẽ biểu đồ
+chart_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chart")
+# Ảnh PNG đã vẽ và file_id Telegram của lần gửi đầu tiên, theo khóa là bộ số liệu rating
+CHART_CACHE_SIZE = 16
+chart_png_cache = OrderedDict()
+chart_file_ids = {}
+
+# Kết quả tìm kiếm inline, theo khóa (truy vấn đã chuẩn hóa, phiên bản dữ liệu) -> (thời điểm tạo, (loại, danh sách username))
+inline_result_cache = OrderedDict()
+# Số thứ tự truy vấn inline mới nhất của từng người dùng, dùng để bỏ qua các lần gõ phím đã bị thay thế
+inline_query_sequence = {}
+# Các username mà từng người dùng đã nhận từ /random trong phiên hiện tại: user_id -> (lần dùng cuối, tập username),
+# sắp xếp theo lần dùng cuối
+random_sessions = OrderedDict()
+
 def create_stats_chart(rating_counts: dict):
-    """Hàm để vẽ biểu đồ cột từ dữ liệu thống kê."""
+    """Hàm để vẽ biểu đồ cột từ dữ liệu thống kê. Trả về nội dung file PNG (bytes)."""
     try:
+        from matplotlib.figure import Figure
+        import seaborn as sns
+
         stars = [f"{i} ⭐" for i in rating_counts.keys()]
         counts = list(rating_counts.values())
 
-        plt.figure(figsize=(10, 6))
         sns.set_theme(style="darkgrid", font_scale=1.1)
+        # Dùng Figure trực tiếp thay vì pyplot để không phụ thuộc trạng thái toàn cục khi chạy trong thread
+        fig = Figure(figsize=(10, 6))
+        ax = fig.subplots()
         
-        bar_plot = sns.barplot(x=stars, y=counts, palette="viridis", width=0.6)
+        bar_plot = sns.barplot(x=stars, y=counts, palette="viridis", width=0.6, ax=ax)
 
-        plt.title('Phân loại tài liệu theo xếp hạng', fontsize=18, weight='bold')
-        plt.ylabel('Số lượng tài liệu', fontsize=12)
+        ax.set_title('Phân loại tài liệu theo xếp hạng', fontsize=18, weight='bold')
+        ax.set_ylabel('Số lượng tài liệu', fontsize=12)
         
         for index, value in enumerate(counts):
             if value > 0:
                 bar_plot.text(index, value, str(value), color='black', ha="center", va='bottom', fontsize=11)
         
         buf = io.BytesIO()
-        plt.savefig(buf, format='PNG', bbox_inches='tight')
-        buf.seek(0)
-        plt.close()
+        fig.savefig(buf, format='PNG', bbox_inches='tight')
         
-        return buf
+        return buf.getvalue()
     except Exception as e:
         logger.error(f"Lỗi khi tạo biểu đồ: {e}")
         return None
 
-def find_row_by_username(username_to_find: str):
+async def get_stats_chart(rating_counts: dict):
+    """Lấy biểu đồ từ bộ nhớ đệm, hoặc vẽ mới trong worker riêng để không chặn event loop."""
+    chart_key = tuple(sorted(rating_counts.items()))
+    if chart_key in chart_png_cache:
+        chart_png_cache.move_to_end(chart_key)
+        return chart_key, chart_png_cache[chart_key]
+
+    loop = asyncio.get_running_loop()
+    png_bytes = await loop.run_in_executor(chart_executor, create_stats_chart, rating_counts)
+    if png_bytes:
+        chart_png_cache[chart_key] = png_bytes
+        while len(chart_png_cache) > CHART_CACHE_SIZE:
+            old_key, _ = chart_png_cache.popitem(last=False)
+            chart_file_ids.pop(old_key, None)
+    return chart_key, png_bytes
+
+async def refresh_cache_if_stale():
+    """Chỉ tải lại sheet (trong thread riêng để không chặn bot) khi bộ nhớ đệm đã hết hạn."""
+    if record_cache.is_stale():
+        await asyncio.to_thread(record_cache.ensure_fresh)
+
+async def get_all_records() -> list:
+    """Lấy danh sách bản ghi từ bộ nhớ đệm."""
+    await refresh_cache_if_stale()
+    return record_cache.records()
+
+async def get_headers() -> list:
+    """Lấy hàng tiêu đề của sheet từ bộ nhớ đệm."""
+    await refresh_cache_if_stale()
+    return record_cache.headers
+
+def get_random_session(user_id: int) -> set:
+    """Tập username người dùng đã nhận từ /random; bỏ các phiên đã hết hạn hoặc cũ nhất khi vượt giới hạn."""
+    now = time.monotonic()
+    last_used, seen = random_sessions.pop(user_id, (now, set()))
+    if now - last_used > RANDOM_SESSION_TTL:
+        seen = set()
+    while random_sessions:
+        oldest_user, (last_used, _) = next(iter(random_sessions.items()))
+        if now - last_used <= RANDOM_SESSION_TTL and len(random_sessions) < RANDOM_SESSION_LIMIT:
+            break
+        del random_sessions[oldest_user]
+    random_sessions[user_id] = (now, seen)
+    return seen
+
+def pick_random_record(user_id: int, rating=None):
+    """
+    Lấy ngẫu nhiên một bản ghi từ các nhóm theo rating (không duyệt lại dữ liệu).
+    Với RANDOM_NO_REPEAT, mỗi người dùng sẽ không gặp lại một tài liệu cho tới khi đã xem hết.
+    """
+    seen = get_random_session(user_id) if RANDOM_NO_REPEAT else set()
+    record = record_cache.random_record(rating, weighted=RANDOM_WEIGHTED, exclude=seen)
+    if record is None and seen:
+        # Đã xem hết: bắt đầu một phiên mới
+        seen.clear()
+        record = record_cache.random_record(rating, weighted=RANDOM_WEIGHTED)
+    if record is not None and RANDOM_NO_REPEAT:
+        username = extract_username(record.get("URL", ""))
+        if username:
+            seen.add(username.lower())
+    return record
+
+async def find_row_by_username(username_to_find: str):
     """Tìm hàng và dữ liệu của một hồ sơ dựa trên username."""
-    if worksheet is None: return None, None
-    all_records = worksheet.get_all_records()
-    for index, record in enumerate(all_records):
-        url = record.get("URL", "")
-        if url:
-            existing_username = extract_username(url)
-            if existing_username and existing_username.lower() == username_to_find.lower():
-                return index + 2, record
-    return None, None
+    if not await ensure_storage(): return None, None
+    await refresh_cache_if_stale()
+    return record_cache.find(username_to_find)
 
 def extract_username(url: str) -> str | None:
     """Trích xuất username từ URL Instagram."""
@@ -129,55 +306,223 @@ def extract_username(url: str) -> str | None:
 
 # ======================= TÁC VỤ NỀN CHO SCRAPING =======================
 
+def read_jsonl(path: str) -> list:
+    """Đọc một file JSONL (nhật ký / checkpoint), bỏ qua các dòng hỏng. Trả về [] nếu file chưa tồn tại."""
+    if not os.path.exists(path):
+        return []
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                # Dòng cuối có thể bị ghi dở nếu bot dừng đột ngột
+                continue
+    return entries
+
+def load_scrape_checkpoint() -> list:
+    """Đọc các kết quả đã cào nhưng chưa kịp ghi vào sheet (từ lần chạy bị gián đoạn trước)."""
+    return read_jsonl(SCRAPE_CHECKPOINT_FILE)
+
+def append_scrape_checkpoint(entry: dict):
+    """Ghi thêm một kết quả vào file checkpoint ngay khi nhận được."""
+    with open(SCRAPE_CHECKPOINT_FILE, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+def clear_scrape_checkpoint():
+    if os.path.exists(SCRAPE_CHECKPOINT_FILE):
+        os.remove(SCRAPE_CHECKPOINT_FILE)
+
+async def write_scrape_results(entries: list) -> int:
+    """
+    Ghi một lô kết quả vào nơi lưu dữ liệu bằng một lần cập nhật.
+    Số hàng được xác định lại theo username tại thời điểm ghi, phòng khi có hàng bị xóa trong lúc cào.
+    """
+    await refresh_cache_if_stale()
+    updates = []
+    for entry in entries:
+        if not entry.get('username'):
+            continue
+        row, _ = record_cache.find(entry['username'])
+        if not row:
+            logger.warning(f"Bỏ qua kết quả của {entry['username']} vì hồ sơ không còn trong sheet.")
+            continue
+        updates.append((row, entry['username'], {
+            FULL_NAME_COLUMN_NAME: entry['full_name'],
+            PROFILE_PIC_URL_COLUMN_NAME: entry['profile_pic_url'],
+        }))
+
+    if updates:
+        def _patch(_):
+            for row, _, fields in updates:
+                record_cache.update_row(row, fields)
+        await asyncio.to_thread(record_cache.apply_write, lambda: storage.update_rows(updates), _patch)
+    return len(updates)
+
+# Mỗi sheet chỉ có một tác vụ cào dữ liệu tại một thời điểm. Các lệnh /scrape đến khi tác vụ đang chạy
+# được gắn vào tác vụ đó và nhận thông báo khi hoàn thành, thay vì khởi động thêm một trình duyệt.
+scrape_job = {
+    'running': False,
+    'owner_chat_id': None,
+    'subscribers': [],  # các chat khác đang chờ kết quả của tác vụ hiện tại
+    'progress_message': None,
+    'total': 0,
+    'done': 0,
+    'started_at': None,
+}
+
+def start_scrape_job(chat_id: int):
+    scrape_job.update(running=True, owner_chat_id=chat_id, subscribers=[], progress_message=None,
+                      total=0, done=0, started_at=time.monotonic())
+
+def attach_to_scrape_job(chat_id: int) -> bool:
+    """Gắn một chat vào tác vụ đang chạy. Trả về False nếu chat này đã đang chờ sẵn."""
+    if chat_id == scrape_job['owner_chat_id'] or chat_id in scrape_job['subscribers']:
+        return False
+    scrape_job['subscribers'].append(chat_id)
+    return True
+
 async def scraping_background_task(context: ContextTypes.DEFAULT_TYPE):
-    """Tác vụ chạy ngầm để cào dữ liệu mà không làm block bot."""
-    job = context.job
-    chat_id = job.chat_id
-    
+    """Chạy tác vụ cào dữ liệu duy nhất, rồi báo kết quả cho chat đã khởi động và các chat đã gắn vào."""
+    chat_id = context.job.chat_id
     try:
-        all_records = worksheet.get_all_records()
-        headers = worksheet.row_values(1)
-        
-        full_name_col = headers.index(FULL_NAME_COLUMN_NAME) + 1
-        pic_url_col = headers.index(PROFILE_PIC_URL_COLUMN_NAME) + 1
-        
-        profiles_to_scrape = []
-        for index, record in enumerate(all_records):
-            if not record.get(FULL_NAME_COLUMN_NAME) and record.get("URL"):
-                profiles_to_scrape.append({
-                    "row_index": index + 2,
-                    "url": record.get("URL")
-                })
-        
-        if not profiles_to_scrape:
-            await context.bot.send_message(chat_id, text="✅ Không có hồ sơ mới nào cần cào dữ liệu.")
-            return
+        summary = await run_scrape(context, chat_id)
+    except Exception as e:
+        logger.error(f"Lỗi trong tác vụ nền scraping: {e}")
+        summary = "❌ Đã có lỗi xảy ra trong quá trình cào dữ liệu."
 
-        scraped_data = await asyncio.to_thread(
-            scraper.scrape_instagram_profiles, INSTAGRAM_COOKIE_FILE, profiles_to_scrape
-        )
-        
-        if scraped_data is None:
-             await context.bot.send_message(chat_id, text="❌ Lỗi: Không thể cào dữ liệu. Vui lòng kiểm tra file cookie và log.")
-             return
-
-        if scraped_data:
-            cells_to_update = []
-            for data in scraped_data:
-                row = data['row_index']
-                cells_to_update.append(gspread.Cell(row, full_name_col, data['full_name']))
-                cells_to_update.append(gspread.Cell(row, pic_url_col, data['profile_pic_url']))
-                
-            if cells_to_update:
-                worksheet.update_cells(cells_to_update)
-                
-            await context.bot.send_message(chat_id, text=f"✅ Hoàn tất! Đã cào và cập nhật dữ liệu cho {len(scraped_data)} hồ sơ.")
-        else:
-            await context.bot.send_message(chat_id, text="ℹ️ Không có dữ liệu nào được cào thành công.")
+    progress_message = scrape_job['progress_message']
+    subscribers = scrape_job['subscribers']
+    scrape_job.update(running=False, owner_chat_id=None, subscribers=[], progress_message=None)
 
+    try:
+        if progress_message is not None:
+            await progress_message.edit_text(summary)
+        else:
+            await context.bot.send_message(chat_id, text=summary)
     except Exception as e:
-        logger.error(f"Lỗi trong tác vụ nền scraping: {e}")
-        await context.bot.send_message(chat_id, text="❌ Đã có lỗi xảy ra trong quá trình cào dữ liệu.")
+        logger.warning(f"Không thể gửi kết quả cào dữ liệu tới chat {chat_id}: {e}")
+    for subscriber in subscribers:
+        try:
+            await context.bot.send_message(subscriber, text=summary)
+        except Exception as e:
+            logger.warning(f"Không thể gửi kết quả cào dữ liệu tới chat {subscriber}: {e}")
+
+async def run_scrape(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> str:
+    """
+    Cào dữ liệu mà không làm block bot, trả về thông báo kết quả.
+    Kết quả được ghi vào sheet theo từng lô (mỗi SCRAPE_FLUSH_EVERY hồ sơ hoặc SCRAPE_FLUSH_SECONDS giây),
+    tiến độ được cập nhật trên một tin nhắn duy nhất, và file checkpoint giúp không mất kết quả khi bot dừng giữa chừng.
+    """
+    headers = await get_headers()
+    if FULL_NAME_COLUMN_NAME not in headers or PROFILE_PIC_URL_COLUMN_NAME not in headers:
+        raise ValueError(f"Sheet thiếu cột {FULL_NAME_COLUMN_NAME} hoặc {PROFILE_PIC_URL_COLUMN_NAME}.")
+
+    # Khôi phục các kết quả đã cào nhưng chưa được ghi từ lần chạy trước
+    recovered = load_scrape_checkpoint()
+    if recovered:
+        written = await write_scrape_results(recovered)
+        clear_scrape_checkpoint()
+        await context.bot.send_message(chat_id, text=f"♻️ Đã khôi phục {written} kết quả từ lần cào dữ liệu bị gián đoạn trước.")
+
+    all_records = await get_all_records()
+    
+    profiles_to_scrape = []
+    usernames_by_row = {}
+    for index, record in enumerate(all_records):
+        # Cào các hồ sơ chưa có tên, và thử lại các hồ sơ bị lỗi ở lần trước
+        # (scraper tự bỏ qua các hồ sơ vừa được cào gần đây nhờ bộ nhớ đệm kết quả)
+        full_name = record.get(FULL_NAME_COLUMN_NAME)
+        if (not full_name or full_name == "Scrape Error") and record.get("URL"):
+            profiles_to_scrape.append({
+                "row_index": index + 2,
+                "url": record.get("URL")
+            })
+            usernames_by_row[index + 2] = extract_username(record.get("URL"))
+    
+    if not profiles_to_scrape:
+        return "✅ Không có hồ sơ mới nào cần cào dữ liệu."
+
+    total = len(profiles_to_scrape)
+    scrape_job['total'] = total
+    progress_message = await context.bot.send_message(chat_id, text=f"⏳ Đang cào dữ liệu: 0/{total} hồ sơ...")
+    scrape_job['progress_message'] = progress_message
+
+    # Chạy scraper ở chế độ streaming trong thread riêng, chuyển từng kết quả về event loop qua hàng đợi
+    import scraper
+    loop = asyncio.get_running_loop()
+    result_queue = asyncio.Queue()
+    finished = object()
+
+    def _produce():
+        try:
+            for result in scraper.iter_scrape_instagram_profiles(INSTAGRAM_COOKIE_FILE, profiles_to_scrape):
+                loop.call_soon_threadsafe(result_queue.put_nowait, result)
+        except Exception as e:
+            loop.call_soon_threadsafe(result_queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(result_queue.put_nowait, finished)
+
+    producer = loop.run_in_executor(None, _produce)
+
+    pending = []
+    done_count = 0
+    written_count = 0
+    scrape_error = None
+    started_at = last_flush = last_progress = time.monotonic()
+
+    while True:
+        timeout = max(0.0, SCRAPE_FLUSH_SECONDS - (time.monotonic() - last_flush))
+        try:
+            item = await asyncio.wait_for(result_queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            item = None
+        if item is finished:
+            break
+        if isinstance(item, Exception):
+            scrape_error = item
+            continue
+        if item is not None:
+            entry = {**item, 'username': usernames_by_row.get(item['row_index'])}
+            append_scrape_checkpoint(entry)
+            pending.append(entry)
+            done_count += 1
+            scrape_job['done'] = done_count
+
+        now = time.monotonic()
+        if pending and (len(pending) >= SCRAPE_FLUSH_EVERY or now - last_flush >= SCRAPE_FLUSH_SECONDS):
+            try:
+                written_count += await write_scrape_results(pending)
+                pending = []
+                clear_scrape_checkpoint()
+            except Exception as e:
+                # Giữ lại lô này (và checkpoint) để thử ghi lại ở lần sau
+                logger.error(f"Lỗi khi ghi kết quả vào sheet, sẽ thử lại: {e}")
+            last_flush = now
+        elif not pending:
+            last_flush = now
+
+        if item is not None and now - last_progress >= SCRAPE_PROGRESS_SECONDS:
+            last_progress = now
+            rate = done_count / max(now - started_at, 1e-6) * 60
+            try:
+                await progress_message.edit_text(f"⏳ Đang cào dữ liệu: {done_count}/{total} hồ sơ ({rate:.1f} hồ sơ/phút)...")
+            except Exception as e:
+                logger.debug(f"Không thể cập nhật tin nhắn tiến độ: {e}")
+
+    await producer
+    if pending:
+        written_count += await write_scrape_results(pending)
+        clear_scrape_checkpoint()
+
+    if isinstance(scrape_error, scraper.ScraperUnavailable) and not done_count:
+        return "❌ Lỗi: Không thể cào dữ liệu. Vui lòng kiểm tra file cookie và log."
+    if scrape_error:
+        raise scrape_error
+
+    if done_count:
+        return f"✅ Hoàn tất! Đã cào và cập nhật dữ liệu cho {written_count} hồ sơ."
+    return "ℹ️ Không có dữ liệu nào được cào thành công."
 
 # ======================= CÁC HÀM XỬ LÝ LỆNH CHÍNH =======================
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -190,8 +535,10 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         "/search <code>&lt;tên&gt;</code> - Tìm kiếm tài liệu.\n"
         "/stats - Xem thống kê dữ liệu.\n"
         "/random <code>[rating]</code> - Lấy tài liệu ngẫu nhiên.\n"
-        "/backup - Sao lưu dữ liệu ra file CSV.\n"
+        "/backup <code>[csv|csv.gz|jsonl|jsonl.gz]</code> - Sao lưu dữ liệu ra file.\n"
         "/scrape - Lấy thông tin chi tiết cho các tài liệu mới.\n"
+        "/scrape_status - Xem tiến độ cào dữ liệu.\n"
+        "/refresh - Tải lại dữ liệu mới nhất từ Google Sheet.\n"
         "/cancel - Hủy bỏ thao tác hiện tại.\n\n"
         "<b>Chế độ Inline:</b>\n"
         "Gõ <code>@tên_bot</code> và một từ khóa trong bất kỳ chat nào để tìm kiếm và chia sẻ nhanh!"
@@ -199,6 +546,12 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     await update.message.reply_text(help_text, parse_mode=ParseMode.HTML)
 
 async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    if pending_add_rows:
+        # Các hồ sơ đã được đánh giá trước khi hủy vẫn được ghi vào sheet
+        try:
+            await flush_pending_adds()
+        except Exception as e:
+            logger.error(f"Lỗi khi ghi các tài liệu mới vào sheet, sẽ thử lại sau: {e}")
     if context.user_data:
         context.user_data.clear()
         if update.callback_query:
@@ -208,21 +561,12 @@ async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     return ConversationHandler.END
 
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    if worksheet is None:
+    if not await ensure_storage():
         await update.message.reply_text("Lỗi: Bot không thể kết nối tới Google Sheet.")
         return
     
-    all_records = worksheet.get_all_records()
-    total_profiles = len(all_records)
-    
-    ratings = [float(r.get(RATING_COLUMN_NAME, 0)) for r in all_records if str(r.get(RATING_COLUMN_NAME, '')).replace('.', '', 1).isdigit()]
-    avg_rating = sum(ratings) / len(ratings) if ratings else 0
-    
-    rating_counts = {i: 0 for i in range(1, 6)}
-    for r in ratings:
-        rating_int = int(round(r))
-        if 1 <= rating_int <= 5:
-            rating_counts[rating_int] += 1
+    await refresh_cache_if_stale()
+    total_profiles, avg_rating, rating_counts = record_cache.stats()
         
     stats_text = (
         f"<b>📊 Thống kê dữ liệu</b>\n\n"
@@ -230,14 +574,25 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         f"<b>Rating trung bình:</b> {avg_rating:.2f} ⭐️"
     )
 
-    chart_buffer = create_stats_chart(rating_counts)
+    chart_key, chart_png = await get_stats_chart(rating_counts)
     
-    if chart_buffer:
-        await update.message.reply_photo(
-            photo=chart_buffer,
+    if chart_png:
+        file_id = chart_file_ids.get(chart_key)
+        if file_id:
+            try:
+                # Ảnh này đã được gửi trước đó: dùng lại file_id thay vì tải lên lần nữa
+                await update.message.reply_photo(photo=file_id, caption=stats_text, parse_mode=ParseMode.HTML)
+                return
+            except Exception as e:
+                logger.warning(f"Không thể gửi lại biểu đồ bằng file_id, sẽ tải ảnh lên lại. Lỗi: {e}")
+                chart_file_ids.pop(chart_key, None)
+        sent_message = await update.message.reply_photo(
+            photo=chart_png,
             caption=stats_text,
             parse_mode=ParseMode.HTML
         )
+        if sent_message.photo:
+            chart_file_ids[chart_key] = sent_message.photo[-1].file_id
     else:
         stats_text += "\n\n<b>Phân loại theo rating:</b>\n"
         for star, count in rating_counts.items():
@@ -245,79 +600,208 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         await update.message.reply_text(stats_text, parse_mode=ParseMode.HTML)
 
 async def random_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    if worksheet is None:
+    if not await ensure_storage():
         await update.message.reply_text("Lỗi: Bot không thể kết nối tới Google Sheet.")
         return
-    all_records = worksheet.get_all_records()
-    target_rating = context.args[0] if context.args else None
-    filtered_records = all_records
-    if target_rating and target_rating.isdigit():
-        filtered_records = [r for r in all_records if str(r.get(RATING_COLUMN_NAME)) == target_rating]
-        if not filtered_records:
-            await update.message.reply_text(f"Không có tài liệu nào có rating là {target_rating} sao.")
-            return
-    if not filtered_records:
+    await refresh_cache_if_stale()
+    target_rating = context.args[0] if context.args and context.args[0].isdigit() else None
+    if target_rating and not record_cache.count_rating(target_rating):
+        await update.message.reply_text(f"Không có tài liệu nào có rating là {target_rating} sao.")
+        return
+    random_profile = pick_random_record(update.effective_user.id, target_rating)
+    if random_profile is None:
         await update.message.reply_text("Không có tài liệu nào trong sheet.")
         return
-    random_profile = random.choice(filtered_records)
     username = extract_username(random_profile.get("URL", ""))
     profile_url = random_profile.get("URL", "")
     profile_text = (f"<b>✨ Tài liệu ngẫu nhiên ✨</b>\n\n<b>Username:</b> <code>{username or 'N/A'}</code>\n<b>Rating:</b> {random_profile.get(RATING_COLUMN_NAME, 'N/A')} ⭐️\n<b>URL:</b> {profile_url}")
     await update.message.reply_text(profile_text, parse_mode=ParseMode.HTML)
 
 async def backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    if worksheet is None:
+    """Sao lưu dữ liệu từ bộ nhớ đệm ra file (csv, csv.gz, jsonl, jsonl.gz), tự chia phần nếu quá lớn."""
+    if not await ensure_storage():
         await update.message.reply_text("Lỗi: Bot không thể kết nối tới Google Sheet.")
         return
+    from backup_export import BACKUP_FORMATS, write_backup_parts
+    fmt = context.args[0].lower() if context.args else BACKUP_FORMAT
+    if fmt not in BACKUP_FORMATS:
+        await update.message.reply_text(f"Định dạng không hỗ trợ. Chọn một trong: <code>{', '.join(BACKUP_FORMATS)}</code>", parse_mode=ParseMode.HTML)
+        return
     await update.message.reply_text("Đang chuẩn bị file sao lưu...")
-    all_data = worksheet.get_all_values()
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerows(all_data)
-    output.seek(0)
-    backup_file = io.BytesIO(output.getvalue().encode('utf-8'))
-    backup_file.name = f"backup_{GOOGLE_SHEET_NAME.replace(' ', '_')}.csv"
-    await update.message.reply_document(document=backup_file)
+    await refresh_cache_if_stale()
+    headers = [header for header in record_cache.headers if header]
+    parts = await asyncio.to_thread(
+        write_backup_parts, headers, record_cache.records(), fmt,
+        max_part_bytes=int(BACKUP_PART_MB * 1024 * 1024),
+        spool_max_bytes=int(BACKUP_SPOOL_MB * 1024 * 1024),
+    )
+    base_name = f"backup_{GOOGLE_SHEET_NAME.replace(' ', '_')}"
+    try:
+        for number, part in enumerate(parts, start=1):
+            suffix = f"_part{number}" if len(parts) > 1 else ""
+            await update.message.reply_document(document=part, filename=f"{base_name}{suffix}.{fmt}")
+    finally:
+        for part in parts:
+            part.close()
+
+async def refresh_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Buộc tải lại dữ liệu từ Google Sheet (dùng khi sheet được sửa trực tiếp). Với SQLite, các thay đổi được đồng bộ sang sheet trước."""
+    if not await ensure_storage():
+        await update.message.reply_text("Lỗi: Bot không thể kết nối tới Google Sheet.")
+        return
+    try:
+        await asyncio.to_thread(storage.refresh)
+        await asyncio.to_thread(record_cache.reload)
+        await update.message.reply_text(f"🔄 Đã tải lại dữ liệu: {len(record_cache.records())} tài liệu.")
+    except Exception as e:
+        logger.error(f"Lỗi khi tải lại dữ liệu: {e}")
+        await update.message.reply_text("Lỗi khi tải lại dữ liệu từ Google Sheet.")
 
 async def scrape_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    if worksheet is None:
+    if not await ensure_storage():
         await update.message.reply_text("Lỗi: Bot không thể kết nối tới Google Sheet.")
         return
     chat_id = update.effective_chat.id
-    if context.job_queue:
-        await update.message.reply_text("⏳ Đã bắt đầu quá trình cào dữ liệu. Tác vụ sẽ chạy ngầm, tôi sẽ thông báo khi hoàn thành.")
-        context.job_queue.run_once(scraping_background_task, 0, chat_id=chat_id, name=f"scrape_{chat_id}")
-    else:
+    if not context.job_queue:
         await update.message.reply_text("Lỗi: JobQueue không khả dụng.")
+        return
+    if scrape_job['running']:
+        # Không khởi động tác vụ thứ hai cào trùng các hàng và ghi đè lên nhau
+        if attach_to_scrape_job(chat_id):
+            await update.message.reply_text("⏳ Đang có một tác vụ cào dữ liệu chạy. Tôi sẽ thông báo cho bạn khi tác vụ đó hoàn thành. Xem tiến độ bằng /scrape_status.")
+        else:
+            await update.message.reply_text("⏳ Tác vụ cào dữ liệu của bạn vẫn đang chạy. Xem tiến độ bằng /scrape_status.")
+        return
+    start_scrape_job(chat_id)
+    await update.message.reply_text("⏳ Đã bắt đầu quá trình cào dữ liệu. Tác vụ sẽ chạy ngầm, tôi sẽ thông báo khi hoàn thành.")
+    context.job_queue.run_once(scraping_background_task, 0, chat_id=chat_id, name="scrape")
+
+async def scrape_status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Hiển thị tiến độ, tốc độ hiện tại và thời gian dự kiến của tác vụ cào dữ liệu."""
+    if not scrape_job['running']:
+        await update.message.reply_text("💤 Hiện không có tác vụ cào dữ liệu nào đang chạy.")
+        return
+    from rate_limiter import limiter
+    limiter_state = limiter.snapshot()
+    total, done = scrape_job['total'], scrape_job['done']
+    remaining = max(0, total - done)
+    elapsed = time.monotonic() - scrape_job['started_at']
+    rate = limiter_state['rate_per_minute']
+    # Tốc độ thực tế (hồ sơ/phút) tính từ lúc bắt đầu, không vượt quá tốc độ cho phép của bộ giới hạn
+    measured_rate = done / elapsed * 60 if elapsed > 0 else 0.0
+    eta_rate = min(measured_rate, rate) if done >= SCRAPE_ETA_MIN_DONE and measured_rate > 0 else rate
+    eta_seconds = remaining / eta_rate * 60 + limiter_state['backoff_remaining'] if eta_rate else 0
+
+    status_text = (
+        f"<b>🔎 Tác vụ cào dữ liệu</b>\n\n"
+        f"<b>Tiến độ:</b> {done}/{total} hồ sơ\n"
+        f"<b>Còn trong hàng đợi:</b> {remaining} hồ sơ\n"
+        f"<b>Tốc độ cho phép:</b> {rate:.1f} yêu cầu/phút\n"
+        f"<b>Tốc độ thực tế:</b> {measured_rate:.1f} hồ sơ/phút\n"
+        f"<b>Thời gian đã chạy:</b> {elapsed / 60:.1f} phút\n"
+        f"<b>Dự kiến còn:</b> ~{eta_seconds / 60:.0f} phút\n"
+        f"<b>Số chat đang chờ kết quả:</b> {len(scrape_job['subscribers']) + 1}"
+    )
+    if limiter_state['backoff_remaining'] > 0:
+        status_text += f"\n\n⚠️ Đang tạm dừng {limiter_state['backoff_remaining']:.0f} giây do Instagram giới hạn truy cập."
+    await update.message.reply_text(status_text, parse_mode=ParseMode.HTML)
 
 # --- Luồng hội thoại cho lệnh /add ---
 
-async def write_profile_to_sheet(profile_data: dict):
-    """Hàm tiện ích để ghi một hồ sơ hoàn chỉnh vào Google Sheet."""
+# Các hàng đã được đánh giá nhưng chưa ghi vào sheet: username (chữ thường) -> {'username', 'row'}
+pending_add_rows = OrderedDict()
+_add_flush_lock = asyncio.Lock()
+
+def load_add_journal() -> list:
+    """Đọc các hàng đã đánh giá nhưng chưa kịp ghi vào sheet (từ lần chạy bị gián đoạn trước)."""
+    return read_jsonl(ADD_JOURNAL_FILE)
+
+def rewrite_add_journal():
+    """Ghi lại file nhật ký chỉ với các hàng còn đang chờ (xóa file nếu không còn hàng nào)."""
+    if not pending_add_rows:
+        if os.path.exists(ADD_JOURNAL_FILE):
+            os.remove(ADD_JOURNAL_FILE)
+        return
+    tmp_path = ADD_JOURNAL_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for entry in pending_add_rows.values():
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, ADD_JOURNAL_FILE)
+
+def is_pending_add(username: str) -> bool:
+    return username.lower() in pending_add_rows
+
+async def buffer_profile_row(profile_data: dict, context: ContextTypes.DEFAULT_TYPE):
+    """Đưa một hồ sơ đã đánh giá vào bộ đệm ghi (và file nhật ký), hẹn giờ ghi nếu không có thao tác tiếp."""
+    headers = await get_headers()
+    new_row = [''] * len(headers)
+    new_row[headers.index("URL")] = profile_data.get('url', '')
+    new_row[headers.index(RATING_COLUMN_NAME)] = profile_data.get('rating', '')
+
+    entry = {'username': profile_data['username'], 'row': new_row}
+    with open(ADD_JOURNAL_FILE, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    pending_add_rows[profile_data['username'].lower()] = entry
+
+    if context.job_queue:
+        for job in context.job_queue.get_jobs_by_name("flush_adds"):
+            job.schedule_removal()
+        context.job_queue.run_once(flush_pending_adds_job, ADD_FLUSH_IDLE_SECONDS, name="flush_adds")
+
+async def flush_pending_adds() -> int:
+    """Ghi toàn bộ các hàng đang chờ vào sheet bằng một lần append_rows. Trả về số hàng đã ghi."""
+    async with _add_flush_lock:
+        if not pending_add_rows or not await ensure_storage():
+            return 0
+        await refresh_cache_if_stale()
+        entries = list(pending_add_rows.values())
+        # Bỏ qua các hàng đã có trong sheet (ví dụ bot dừng ngay sau khi ghi, trước khi kịp xóa nhật ký)
+        rows = [entry['row'] for entry in entries if not record_cache.has_username(entry['username'])]
+        if rows:
+            def _patch(_):
+                for row in rows:
+                    record_cache.append_row(row)
+            await asyncio.to_thread(record_cache.apply_write, lambda: storage.append_rows(rows), _patch)
+        for entry in entries:
+            pending_add_rows.pop(entry['username'].lower(), None)
+        rewrite_add_journal()
+        logger.info(f"Đã ghi {len(rows)} tài liệu mới vào sheet bằng một lần append_rows.")
+        return len(rows)
+
+async def flush_pending_adds_job(context: ContextTypes.DEFAULT_TYPE):
+    """Ghi các hàng đang chờ sau một khoảng thời gian không có thao tác."""
     try:
-        headers = worksheet.row_values(1)
-        new_row = [''] * len(headers)
-        
-        url_col_index = headers.index("URL")
-        rating_col_index = headers.index(RATING_COLUMN_NAME)
-        
-        new_row[url_col_index] = profile_data.get('url', '')
-        new_row[rating_col_index] = profile_data.get('rating', '')
-        
-        worksheet.append_row(new_row)
-        logger.info(f"Đã ghi tài liệu {profile_data.get('username')} vào sheet.")
-        return True
+        await flush_pending_adds()
     except Exception as e:
-        logger.error(f"Lỗi khi ghi vào sheet: {e}")
-        return False
+        logger.error(f"Lỗi khi ghi các tài liệu mới vào sheet, sẽ thử lại sau: {e}")
+        if context.job_queue:
+            context.job_queue.run_once(flush_pending_adds_job, ADD_FLUSH_IDLE_SECONDS, name="flush_adds")
+
+async def replay_add_journal():
+    """Khôi phục và ghi các hàng còn trong file nhật ký khi bot khởi động."""
+    entries = load_add_journal()
+    if not entries:
+        return
+    for entry in entries:
+        if entry.get('username') and entry.get('row'):
+            pending_add_rows[entry['username'].lower()] = entry
+    written = await flush_pending_adds()
+    logger.info(f"♻️ Đã khôi phục {written} tài liệu từ file nhật ký /add.")
 
 async def process_next_in_queue(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Xử lý hồ sơ tiếp theo trong hàng đợi."""
     profiles_to_process = context.user_data.get('profiles_to_process', [])
     
     if not profiles_to_process:
-        await update.callback_query.edit_message_text("✅ Hoàn tất! Đã xử lý tất cả tài liệu mới.")
         context.user_data.clear()
+        try:
+            await flush_pending_adds()
+            await update.callback_query.edit_message_text("✅ Hoàn tất! Đã xử lý tất cả tài liệu mới.")
+        except Exception as e:
+            logger.error(f"Lỗi khi ghi vào sheet: {e}")
+            await update.callback_query.edit_message_text("⚠️ Đã lưu các đánh giá nhưng chưa ghi được vào Google Sheet. Tôi sẽ tự thử lại sau.")
+            if context.job_queue:
+                context.job_queue.run_once(flush_pending_adds_job, ADD_FLUSH_IDLE_SECONDS, name="flush_adds")
         return ConversationHandler.END
 
     next_profile = profiles_to_process.pop(0)
@@ -336,7 +820,7 @@ async def process_next_in_queue(update: Update, context: ContextTypes.DEFAULT_TY
 
 async def add_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Bắt đầu quá trình thêm và đánh giá tuần tự nhiều hồ sơ."""
-    if worksheet is None:
+    if not await ensure_storage():
         await update.message.reply_text("Lỗi: Bot không thể kết nối tới Google Sheet.")
         return ConversationHandler.END
     if not context.args:
@@ -348,15 +832,16 @@ async def add_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     skipped_usernames = []
     
     try:
-        existing_urls = worksheet.col_values(2)[1:]
-        existing_usernames = {extract_username(url).lower() for url in existing_urls if extract_username(url)}
+        await refresh_cache_if_stale()
         
         for raw_url in urls_to_add:
             new_username = extract_username(raw_url)
             if not new_username:
                 await update.message.reply_text(f"URL không hợp lệ: <code>{raw_url}</code>", parse_mode=ParseMode.HTML)
                 continue
-            if new_username.lower() in existing_usernames:
+            # Kiểm tra trùng với sheet, với các hàng đang chờ ghi và với các URL trước đó trong cùng lệnh
+            if (record_cache.has_username(new_username) or is_pending_add(new_username)
+                    or any(p['username'].lower() == new_username.lower() for p in profiles_to_process_queue)):
                 skipped_usernames.append(new_username)
                 continue
             
@@ -401,7 +886,22 @@ async def rating_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     current_profile['rating'] = rating_value
     
-    await write_profile_to_sheet(current_profile)
+    try:
+        await buffer_profile_row(current_profile, context)
+    except Exception as e:
+        logger.error(f"Lỗi khi lưu đánh giá cho {current_profile.get('username')}: {e}")
+        # Giữ nguyên hồ sơ hiện tại và hàng đợi để người dùng có thể chọn lại xếp hạng
+        keyboard = [[InlineKeyboardButton(f"⭐️ {i}", callback_data=str(i)) for i in range(1, 6)]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        try:
+            await query.edit_message_text(
+                f"❌ Không lưu được đánh giá cho <b>{current_profile['username']}</b>. Vui lòng chọn lại xếp hạng để thử lại:",
+                reply_markup=reply_markup, parse_mode=ParseMode.HTML,
+            )
+        except Exception as edit_error:
+            # Ví dụ: tin nhắn không đổi khi thử lại và lại thất bại
+            logger.debug(f"Không thể cập nhật tin nhắn đánh giá: {edit_error}")
+        return ASKING_RATING
     
     return await process_next_in_queue(update, context)
 
@@ -411,11 +911,12 @@ async def delete_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await update.message.reply_text("Sử dụng: /delete <code>&lt;username&gt;</code>", parse_mode=ParseMode.HTML)
         return ConversationHandler.END
     username = context.args[0]
-    row_index, record = find_row_by_username(username)
+    row_index, record = await find_row_by_username(username)
     if not row_index:
         await update.message.reply_text(f"Không tìm thấy tài liệu với username <code>{username}</code>.", parse_mode=ParseMode.HTML)
         return ConversationHandler.END
     context.user_data['row_to_delete'] = row_index
+    context.user_data['username_to_delete'] = username
     keyboard = [[InlineKeyboardButton("🔴 Có, xóa đi", callback_data="confirm_delete"), InlineKeyboardButton("Không", callback_data="cancel_delete")]]
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text(f"Bạn có chắc chắn muốn xóa tài liệu của <code>{username}</code> không?", reply_markup=reply_markup, parse_mode=ParseMode.HTML)
@@ -426,7 +927,9 @@ async def delete_confirmation_callback(update: Update, context: ContextTypes.DEF
     if query.data == "confirm_delete":
         row_index = context.user_data.get('row_to_delete')
         try:
-            worksheet.delete_rows(row_index)
+            username = context.user_data.get('username_to_delete')
+            await asyncio.to_thread(record_cache.apply_write, lambda: storage.delete_row(row_index, username),
+                                    lambda _: record_cache.delete_row(row_index))
             await query.edit_message_text("🗑️ Đã xóa tài liệu thành công.")
         except Exception as e:
             logger.error(f"Lỗi khi xóa hàng: {e}")
@@ -440,11 +943,12 @@ async def update_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await update.message.reply_text("Sử dụng: /update <code>&lt;username&gt;</code>", parse_mode=ParseMode.HTML)
         return ConversationHandler.END
     username = context.args[0]
-    row_index, record = find_row_by_username(username)
+    row_index, record = await find_row_by_username(username)
     if not row_index:
         await update.message.reply_text(f"Không tìm thấy tài liệu với username <code>{username}</code>.", parse_mode=ParseMode.HTML)
         return ConversationHandler.END
     context.user_data['row_to_update'] = row_index
+    context.user_data['username_to_update'] = username
     current_rating = record.get(RATING_COLUMN_NAME, "chưa có")
     keyboard = [[InlineKeyboardButton(f"⭐️ {i}", callback_data=f"update_{i}") for i in range(1, 6)]]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -456,9 +960,10 @@ async def update_rating_callback(update: Update, context: ContextTypes.DEFAULT_T
     rating_value = query.data.split('_')[1]
     row_index = context.user_data.get('row_to_update')
     try:
-        headers = worksheet.row_values(1)
-        rating_col_index = headers.index(RATING_COLUMN_NAME) + 1
-        worksheet.update_cell(row_index, rating_col_index, rating_value)
+        username = context.user_data.get('username_to_update')
+        await asyncio.to_thread(record_cache.apply_write,
+                                lambda: storage.update_rows([(row_index, username, {RATING_COLUMN_NAME: rating_value})]),
+                                lambda _: record_cache.update_row(row_index, {RATING_COLUMN_NAME: rating_value}))
         await query.edit_message_text(f"✅ Đã cập nhật rating thành {rating_value} sao!")
     except Exception as e:
         logger.error(f"Lỗi khi cập nhật rating: {e}")
@@ -470,13 +975,8 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await update.message.reply_text("Sử dụng: /search <code>&lt;tên&gt;</code>", parse_mode=ParseMode.HTML)
         return ConversationHandler.END
     search_term = " ".join(context.args).lower()
-    all_records = worksheet.get_all_records()
-    results = []
-    for record in all_records:
-        username = extract_username(record.get("URL", ""))
-        full_name = record.get("full_name", "")
-        if (username and search_term in username.lower()) or (full_name and search_term in full_name.lower()):
-            results.append(record)
+    await refresh_cache_if_stale()
+    results = record_cache.search(search_term)
     if not results:
         await update.message.reply_text(f"Không tìm thấy tài liệu nào khớp với '<code>{search_term}</code>'.", parse_mode=ParseMode.HTML)
         return ConversationHandler.END
@@ -522,26 +1022,27 @@ async def search_page_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     return PAGING_SEARCH_RESULTS
 
 # --- TÍNH NĂNG MỚI: Xử lý Chế độ Inline ---
-async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """
-    Xử lý các yêu cầu tìm kiếm inline.
-    Hỗ trợ nhiều loại truy vấn: tìm kiếm theo tên, xem thống kê, lấy ngẫu nhiên, lọc theo rating.
-    """
-    query = update.inline_query.query.lower().strip()
-    
-    if worksheet is None:
-        return
+def profile_article(record: dict, kind: str, title_prefix: str = "Tài liệu tham khảo") -> InlineQueryResultArticle:
+    """Một kết quả inline cho một hồ sơ. ID được tạo từ loại truy vấn và username nên giống nhau giữa các lần trả lời."""
+    username = extract_username(record.get("URL", ""))
+    full_name = record.get(FULL_NAME_COLUMN_NAME) or username
+    rating = record.get(RATING_COLUMN_NAME, "N/A")
+    message_content = (f"<b>{title_prefix}: {full_name}</b>\n\n<b>Username:</b> <code>{username}</code>\n<b>Rating:</b> {rating} ⭐\n<b>URL:</b> {record.get('URL')}")
+    return InlineQueryResultArticle(
+        id=f"{kind}:{username}"[:64],
+        title=full_name,
+        description=f"@{username} - Rating: {rating} ⭐",
+        input_message_content=InputTextMessageContent(message_content, parse_mode=ParseMode.HTML),
+        thumbnail_url=record.get(PROFILE_PIC_URL_COLUMN_NAME),
+    )
 
-    all_records = worksheet.get_all_records()
+def build_inline_results(query: str, user_id: int) -> list:
+    """Kết quả inline cho các truy vấn chỉ có một kết quả: "stats" (xem thống kê) và "random" (lấy ngẫu nhiên)."""
     inline_results = []
 
-    # --- Phân tích và xử lý các loại truy vấn khác nhau ---
-
     # 1. Xử lý lệnh "stats"
     if query == "stats":
-        total_profiles = len(all_records)
-        ratings = [float(r.get(RATING_COLUMN_NAME, 0)) for r in all_records if str(r.get(RATING_COLUMN_NAME, '')).replace('.', '', 1).isdigit()]
-        avg_rating = sum(ratings) / len(ratings) if ratings else 0
+        total_profiles, avg_rating, _ = record_cache.stats()
         
         # Nội dung tin nhắn sẽ được gửi
         message_content = (
@@ -552,7 +1053,7 @@ async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         
         inline_results.append(
             InlineQueryResultArticle(
-                id=str(uuid.uuid4()),
+                id=f"stats:{record_cache.version}",
                 title="📊 Thống kê dữ liệu",
                 description=f"Tổng số: {total_profiles} | Rating trung bình: {avg_rating:.2f} ⭐",
                 input_message_content=InputTextMessageContent(
@@ -563,10 +1064,10 @@ async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYP
 
     # 2. Xử lý lệnh "random"
     elif query.startswith("random"):
-        if not all_records:
-            return
+        random_profile = pick_random_record(user_id)
+        if random_profile is None:
+            return []
         
-        random_profile = random.choice(all_records)
         username = extract_username(random_profile.get("URL", ""))
         full_name = random_profile.get(FULL_NAME_COLUMN_NAME, username)
         rating = random_profile.get(RATING_COLUMN_NAME, "N/A")
@@ -591,67 +1092,144 @@ async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYP
             )
         )
 
-    # 3. Xử lý lệnh lọc theo rating (ví dụ: "5 sao")
-    elif "sao" in query and query.split(" ")[0].isdigit():
-        try:
-            target_rating = query.split(" ")[0]
-            filtered_records = [r for r in all_records if str(r.get(RATING_COLUMN_NAME)) == target_rating]
-            
-            if not filtered_records:
-                inline_results.append(InlineQueryResultArticle(id=str(uuid.uuid4()), title=f"Không có tài liệu nào được xếp hạng {target_rating} sao.", input_message_content=InputTextMessageContent(f"Không tìm thấy tài liệu nào có rating {target_rating} sao.")))
-            
-            for record in filtered_records[:10]: # Giới hạn 10 kết quả
-                username = extract_username(record.get("URL", ""))
-                full_name = record.get(FULL_NAME_COLUMN_NAME, username)
-                
-                message_content = (f"<b>Tài liệu tham khảo: {full_name}</b>\n\n<b>Username:</b> <code>{username}</code>\n<b>Rating:</b> {target_rating} ⭐\n<b>URL:</b> {record.get('URL')}")
-                
-                inline_results.append(
-                    InlineQueryResultArticle(
-                        id=str(uuid.uuid4()),
-                        title=full_name,
-                        description=f"@{username} - Rating: {target_rating} ⭐",
-                        input_message_content=InputTextMessageContent(message_content, parse_mode=ParseMode.HTML),
-                        thumbnail_url=record.get(PROFILE_PIC_URL_COLUMN_NAME),
-                    )
-                )
-        except Exception as e:
-            logger.error(f"Lỗi khi lọc inline theo rating: {e}")
-
-    # 4. Xử lý tìm kiếm mặc định theo tên
-    elif len(query) >= 2:
-        search_term = query.lower()
-        search_results = []
-        for record in all_records:
-            username = extract_username(record.get("URL", ""))
-            full_name = record.get(FULL_NAME_COLUMN_NAME, "")
-            if (username and search_term in username.lower()) or (full_name and search_term in full_name.lower()):
-                search_results.append(record)
-        
-        for record in search_results[:10]:
-            username = extract_username(record.get("URL", ""))
-            full_name = record.get(FULL_NAME_COLUMN_NAME, username)
-            rating = record.get(RATING_COLUMN_NAME, "N/A")
-            
-            message_content = (f"<b>Tài liệu tham khảo: {full_name}</b>\n\n<b>Username:</b> <code>{username}</code>\n<b>Rating:</b> {rating} ⭐\n<b>URL:</b> {record.get('URL')}")
-            
-            inline_results.append(
-                InlineQueryResultArticle(
-                    id=str(uuid.uuid4()),
-                    title=full_name,
-                    description=f"@{username} - Rating: {rating} ⭐",
-                    input_message_content=InputTextMessageContent(message_content, parse_mode=ParseMode.HTML),
-                    thumbnail_url=record.get(PROFILE_PIC_URL_COLUMN_NAME),
-                )
-            )
+    return inline_results
+
+def find_inline_matches(query: str):
+    """
+    Tìm các hồ sơ khớp với truy vấn lọc theo rating (ví dụ "5 sao") hoặc tìm kiếm theo tên.
+    Trả về (loại kết quả dùng trong ID, danh sách username đã sắp xếp); chỉ danh sách này được lưu vào bộ nhớ đệm,
+    còn các InlineQueryResultArticle chỉ được dựng cho trang đang được yêu cầu.
+    """
+    # 3. Lọc theo rating: lấy thẳng từ nhóm rating thay vì duyệt toàn bộ dữ liệu
+    if "sao" in query and query.split(" ")[0].isdigit():
+        target_rating = query.split(" ")[0]
+        return f"r{target_rating}", record_cache.rating_keys(target_rating)
+    # 4. Tìm kiếm mặc định theo tên
+    if len(query) >= 2:
+        return "s", record_cache.search_keys(query)
+    return "s", []
+
+def build_inline_page(kind: str, keys: list, offset: int) -> list:
+    """Dựng kết quả inline cho một trang (offset, INLINE_PAGE_SIZE) của danh sách username."""
+    page = [profile_article(record, kind) for record in record_cache.records_for(keys[offset:offset + INLINE_PAGE_SIZE])]
+    if not keys and offset == 0 and kind.startswith("r"):
+        target_rating = kind[1:]
+        page.append(InlineQueryResultArticle(id=f"empty:{target_rating}", title=f"Không có tài liệu nào được xếp hạng {target_rating} sao.", input_message_content=InputTextMessageContent(f"Không tìm thấy tài liệu nào có rating {target_rating} sao.")))
+    return page
+
+def get_cached_inline_matches(query: str):
+    """(loại, danh sách username) đã tìm cho (truy vấn, phiên bản dữ liệu), hoặc None nếu chưa có / đã hết hạn."""
+    key = (query, record_cache.version)
+    cached = inline_result_cache.get(key)
+    if cached is None:
+        return None
+    created_at, matches = cached
+    if time.monotonic() - created_at > INLINE_CACHE_TTL:
+        del inline_result_cache[key]
+        return None
+    inline_result_cache.move_to_end(key)
+    return matches
+
+def store_inline_matches(query: str, matches: tuple):
+    inline_result_cache[(query, record_cache.version)] = (time.monotonic(), matches)
+    while len(inline_result_cache) > INLINE_CACHE_SIZE:
+        inline_result_cache.popitem(last=False)
+
+async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Xử lý các yêu cầu tìm kiếm inline.
+    Danh sách username khớp với truy vấn được lưu trong bộ nhớ đệm theo (truy vấn, phiên bản dữ liệu); kết quả
+    được dựng và trả về theo từng trang qua next_offset. Các lần gõ phím liên tiếp của cùng một người
+    chỉ được xử lý ở lần cuối cùng.
+    """
+    inline_query = update.inline_query
+    query = " ".join(inline_query.query.lower().split())
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    # Đánh số truy vấn theo thứ tự đến, trước mọi thao tác chờ
+    user_id = inline_query.from_user.id
+    sequence = inline_query_sequence.get(user_id, 0) + 1
+    if offset == 0:
+        inline_query_sequence[user_id] = sequence
+    
+    if not await ensure_storage():
+        return
+
+    await refresh_cache_if_stale()
+    if query == "stats" or query.startswith("random"):
+        # Chỉ có một kết quả: dựng trực tiếp, không cần phân trang
+        page, next_offset = build_inline_results(query, user_id), ""
+    else:
+        matches = get_cached_inline_matches(query)
+        if matches is None:
+            if offset == 0 and INLINE_DEBOUNCE_SECONDS > 0:
+                # Chờ một chút: nếu người dùng đã gõ tiếp thì bỏ qua truy vấn cũ này
+                await asyncio.sleep(INLINE_DEBOUNCE_SECONDS)
+                if inline_query_sequence.get(user_id) != sequence:
+                    return
+            matches = find_inline_matches(query)
+            store_inline_matches(query, matches)
+        kind, keys = matches
+        page = build_inline_page(kind, keys, offset)
+        next_offset = str(offset + INLINE_PAGE_SIZE) if offset + INLINE_PAGE_SIZE < len(keys) else ""
 
     # Trả về kết quả cho Telegram
-    await update.inline_query.answer(inline_results, cache_time=10)
+    try:
+        await inline_query.answer(page, cache_time=10, next_offset=next_offset)
+    except Exception as e:
+        # Ví dụ: truy vấn đã quá hạn trả lời
+        logger.debug(f"Không thể trả lời truy vấn inline: {e}")
+
+
+
+def log_startup_timing(stage: str):
+    """In thời gian đã trôi qua từ lúc khởi động, RSS và các module nặng đã nạp (khi bật STARTUP_TIMING)."""
+    if not STARTUP_TIMING:
+        return
+    elapsed_ms = (time.perf_counter() - STARTUP_T0) * 1000
+    try:
+        import resource
+        rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        rss_mb = float("nan")
+    heavy_modules = [name for name in ("gspread", "matplotlib", "seaborn", "selenium", "cloudinary", "scraper") if name in sys.modules]
+    logger.info(
+        f"⏱️ [startup] {stage}: {elapsed_ms:.0f} ms, RSS tối đa {rss_mb:.1f} MB, "
+        f"module nặng đã nạp: {', '.join(heavy_modules) or 'không có'} "
+        f"(chạy 'python -X importtime tele_bot.py' để xem chi tiết từng import)"
+    )
 
+async def warm_up(application: Application) -> None:
+    """Kết nối Google Sheets và nạp bộ nhớ đệm ở chế độ nền sau khi bot đã sẵn sàng."""
+    async def _load():
+        try:
+            if await ensure_storage():
+                await refresh_cache_if_stale()
+                log_startup_timing("đã nạp dữ liệu sheet")
+                await replay_add_journal()
+        except Exception as e:
+            logger.error(f"Lỗi khi nạp dữ liệu ban đầu: {e}")
+    application.create_task(_load())
 
+async def mirror_storage_job(context: ContextTypes.DEFAULT_TYPE):
+    """Đồng bộ các thay đổi trong SQLite sang Google Sheet."""
+    try:
+        await asyncio.to_thread(storage.mirror_pending)
+    except Exception as e:
+        logger.error(f"Lỗi khi đồng bộ dữ liệu sang Google Sheet, sẽ thử lại: {e}")
+
+async def close_resources(application: Application) -> None:
+    """Đóng các trình duyệt còn giữ sống và đồng bộ nốt dữ liệu sang Google Sheet khi bot dừng."""
+    if "browser_service" in sys.modules:
+        await asyncio.to_thread(sys.modules["browser_service"].browser_pool.shutdown)
+    if hasattr(storage, "mirror_pending"):
+        try:
+            await asyncio.to_thread(storage.mirror_pending)
+        except Exception as e:
+            logger.error(f"Không thể đồng bộ dữ liệu sang Google Sheet trước khi dừng: {e}")
 
 def main() -> None:
     """Khởi chạy và vận hành bot."""
+    log_startup_timing("đã import xong")
     # Khởi động keep-alive system nếu đang chạy trên Render
     if os.getenv('RENDER'):
         try:
@@ -668,6 +1246,8 @@ def main() -> None:
         .job_queue(job_queue)
         .connect_timeout(15)
         .read_timeout(15)
+        .post_init(warm_up)
+        .post_shutdown(close_resources)
         .build()
     )
 
@@ -686,17 +1266,25 @@ def main() -> None:
     # Thêm các trình xử lý vào ứng dụng
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("scrape", scrape_command))
+    application.add_handler(CommandHandler("scrape_status", scrape_status_command))
     application.add_handler(CommandHandler("stats", stats_command))
     application.add_handler(CommandHandler("random", random_command))
     application.add_handler(CommandHandler("backup", backup_command))
+    application.add_handler(CommandHandler("refresh", refresh_command))
     application.add_handler(add_conv)
     application.add_handler(delete_conv)
     application.add_handler(update_conv)
     application.add_handler(search_conv)
     
-    # Thêm trình xử lý cho chế độ inline
-    application.add_handler(InlineQueryHandler(inline_query_handler))
+    # Thêm trình xử lý cho chế độ inline. block=False: truy vấn inline chạy song song với các update khác,
+    # để thời gian chờ debounce không chặn bot và lần gõ phím tiếp theo được nhận trong lúc chờ
+    application.add_handler(InlineQueryHandler(inline_query_handler, block=False))
+
+    # Đồng bộ định kỳ các thay đổi trong SQLite sang Google Sheet
+    if hasattr(storage, "mirror_pending"):
+        job_queue.run_repeating(mirror_storage_job, interval=STORAGE_MIRROR_SECONDS, first=STORAGE_MIRROR_SECONDS, name="mirror_storage")
 
+    log_startup_timing("sẵn sàng polling")
     print("🚀 Bot siêu cấp đang chạy... Nhấn Ctrl+C để dừng.")
     application.run_polling()
 